@@ -0,0 +1 @@
+"""Offline benchmarks for the stitching code (stitch_bench)."""
@@ -0,0 +1,350 @@
+"""
+Benchmark for stitch_equirect with synthetic 24-dot captures.
+
+Captures are rendered from a procedural equirect scene (noise + checkerboard + grid +
+discs, so ORB has something to match) at the TARGET_DOTS poses (3 rings × 8 yaws, app
+FOV). Upper / lower ring images are rendered with a known yaw error (--yaw-jitter) that
+_correct_upper_lower_yaw should recover; the residual is reported as yaw_residual_deg.
+
+Each case (output width × blend mode × capture size) runs in a fresh process so its
+peak RSS is its own, and times:
+  yaw_correct  _correct_upper_lower_yaw
+  stitch       stitch_equirectangular (yaw_auto_correct=False, corrected yaws)
+  undistort    undistort_panorama
+  wall         stitch_and_save end to end (yaw correction, stitch, undistort, JPEG write)
+Times are min / median over --repeat runs; one extra stitch_and_save under tracemalloc gives
+the Python-heap peak (numpy buffers; OpenCV's own allocations only show up in RSS).
+
+Run (from backend/):
+  python -m bench.stitch_bench --update            # measure and write bench/stitch_baseline.json
+  python -m bench.stitch_bench --check             # measure, compare, exit 1 on regression
+  python -m bench.stitch_bench --quick --check     # 1024/2048 × both modes × 720x960, 1 repeat
+Baselines are machine specific; --check warns when the baseline was recorded elsewhere.
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import stitch_equirect as se
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Windows – no ru_maxrss, RSS peaks are reported as null
+
+BASELINE_VERSION = 1
+DEFAULT_BASELINE = Path(__file__).with_name("stitch_baseline.json")
+
+# Must match src/sphereConfig.ts TARGET_DOTS: upper, center, lower ring × 8 yaws
+RING_PITCHES = (135.0, 90.0, 45.0)
+NUM_COLS = 8
+TARGET_DOTS = [(pitch, col * 360.0 / NUM_COLS) for pitch in RING_PITCHES for col in range(NUM_COLS)]
+
+MODES = {
+    "winner_takes_all": {"winner_takes_all": True, "column_first": False},
+    "column_first": {"winner_takes_all": True, "column_first": True},
+    "feather": {"winner_takes_all": False, "column_first": False},
+}
+STAGES = ("yaw_correct", "stitch", "undistort")
+# Stages faster than this are too noisy to gate on
+MIN_GATED_S = 0.05
+
+
+@dataclass
+class Case:
+    width: int
+    mode: str
+    capture: str  # "WxH"
+
+    @property
+    def key(self) -> str:
+        return f"w{self.width}/{self.mode}/{self.capture}"
+
+
+# ── Synthetic captures ────────────────────────────────────────────────────────
+def make_scene(width: int = 4096, seed: int = 0) -> np.ndarray:
+    """Textured 2:1 equirect BGR scene; deterministic for a given seed."""
+    rng = np.random.default_rng(seed)
+    h = width // 2
+    scene = np.zeros((h, width, 3), dtype=np.float32)
+    # Multi-scale noise: large blotches for phase correlation, fine grain for ORB corners
+    for cells, amp in ((8, 90.0), (32, 60.0), (128, 40.0)):
+        noise = rng.random((cells, cells * 2, 3), dtype=np.float32)
+        scene += cv2.resize(noise, (width, h), interpolation=cv2.INTER_CUBIC) * amp
+    yy, xx = np.mgrid[0:h, 0:width]
+    checker = ((xx // (width // 64)) + (yy // (h // 32))) % 2
+    scene += checker[:, :, None].astype(np.float32) * 30.0
+    img = np.clip(scene, 0, 255).astype(np.uint8)
+    img[:: h // 16, :] = (255, 255, 255)
+    img[:, :: width // 32] = (255, 255, 255)
+    for _ in range(400):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, h)))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.circle(img, center, int(rng.integers(4, width // 128)), color, -1, cv2.LINE_AA)
+    return img
+
+
+def _camera_basis(pitch_deg: float, yaw_deg: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(look, right, up) as used by stitch_equirect.direction_to_rectilinear with roll 0."""
+    look = np.array(se._camera_look_direction(pitch_deg, yaw_deg))
+    right = np.array([look[2], 0.0, -look[0]])
+    right /= max(np.linalg.norm(right), 1e-9)
+    up = np.cross(look, right)
+    up /= max(np.linalg.norm(up), 1e-9)
+    return look, right, up
+
+
+def render_capture(
+    scene: np.ndarray, pitch_deg: float, yaw_deg: float, width: int, height: int,
+    fov_h_deg: float = se.FOV_H_DEG, fov_v_deg: float = se.FOV_V_DEG,
+) -> np.ndarray:
+    """Rectilinear view of the scene for one pose (inverse of the stitcher's projection)."""
+    look, right, up = _camera_basis(pitch_deg, yaw_deg)
+    x = np.linspace(-1.0, 1.0, width, dtype=np.float64) * math.tan(math.radians(fov_h_deg / 2))
+    y = np.linspace(1.0, -1.0, height, dtype=np.float64) * math.tan(math.radians(fov_v_deg / 2))
+    xx, yy = np.meshgrid(x, y)
+    d = look[None, None, :] + xx[..., None] * right + yy[..., None] * up
+    d /= np.linalg.norm(d, axis=2, keepdims=True)
+    lon = np.degrees(np.arctan2(d[..., 2], d[..., 0]))
+    lat = np.degrees(np.arcsin(np.clip(d[..., 1], -1.0, 1.0)))
+    sh, sw = scene.shape[:2]
+    map_x = (((lon + 180.0) / 360.0) * sw - 0.5).astype(np.float32)
+    map_y = (((90.0 - lat) / 180.0) * sh - 0.5).astype(np.float32)
+    return cv2.remap(scene, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_WRAP)
+
+
+def write_captures(
+    out_dir: Path, capture: str, yaw_jitter_deg: float, seed: int, scene: np.ndarray,
+) -> dict:
+    """Render the 24 TARGET_DOTS captures as JPEGs; returns paths, nominal poses and true yaws."""
+    w, h = (int(v) for v in capture.split("x"))
+    rng = np.random.default_rng(seed + 1)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths, pitches, yaws, true_yaws = [], [], [], []
+    for i, (pitch, yaw) in enumerate(TARGET_DOTS):
+        # Gyro drift only affects the tilted rings; the horizon ring is the stitcher's anchor
+        err = 0.0 if pitch == 90.0 else float(rng.uniform(-yaw_jitter_deg, yaw_jitter_deg))
+        img = render_capture(scene, pitch, (yaw + err) % 360.0, w, h)
+        path = out_dir / f"img_{i:02d}.jpg"
+        cv2.imwrite(str(path), img, [cv2.IMWRITE_JPEG_QUALITY, 92])
+        paths.append(str(path))
+        pitches.append(pitch)
+        yaws.append(yaw)
+        true_yaws.append(yaw + err)
+    return {"paths": paths, "pitches": pitches, "yaws": yaws, "true_yaws": true_yaws}
+
+
+# ── Measurement (runs in a child process per case) ────────────────────────────
+def _peak_rss_mb() -> float | None:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+def _summary(samples: list[float]) -> dict:
+    return {"min": round(min(samples), 4), "median": round(statistics.median(samples), 4)}
+
+
+def run_case(case: Case, captures: dict, repeat: int, out_dir: str) -> dict:
+    paths, pitches, yaws = captures["paths"], captures["pitches"], captures["yaws"]
+    rolls = [0.0] * len(paths)
+    opts = MODES[case.mode]
+    out_path = os.path.join(out_dir, f"pano_{os.getpid()}.jpg")
+    times: dict[str, list[float]] = {s: [] for s in (*STAGES, "wall")}
+    corrected = yaws
+
+    # The stitcher prints one [YawCorr] line per image; keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            corrected = se._correct_upper_lower_yaw(
+                paths, pitches, yaws, fov_h_deg=se.FOV_H_DEG, fov_v_deg=se.FOV_V_DEG, num_columns=NUM_COLS,
+            )
+            t1 = time.perf_counter()
+            pano = se.stitch_equirectangular(
+                paths, pitches, corrected, rolls, output_width=case.width, yaw_auto_correct=False, **opts,
+            )
+            t2 = time.perf_counter()
+            se.undistort_panorama(pano)
+            t3 = time.perf_counter()
+            del pano
+            se.stitch_and_save(
+                paths, pitches, yaws, rolls, output_path=out_path, output_width=case.width, **opts,
+            )
+            t4 = time.perf_counter()
+            times["yaw_correct"].append(t1 - t0)
+            times["stitch"].append(t2 - t1)
+            times["undistort"].append(t3 - t2)
+            times["wall"].append(t4 - t3)
+
+        tracemalloc.start()
+        se.stitch_and_save(paths, pitches, yaws, rolls, output_path=out_path, output_width=case.width, **opts)
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    residual = [abs(c - t) for c, t, p in zip(corrected, captures["true_yaws"], pitches) if p != 90.0]
+    with contextlib.suppress(OSError):
+        os.remove(out_path)
+    return {
+        "wall_s": _summary(times["wall"]),
+        "stages_s": {s: _summary(times[s]) for s in STAGES},
+        "tracemalloc_peak_mb": round(traced_peak / 2**20, 1),
+        "rss_peak_mb": _peak_rss_mb(),
+        "yaw_residual_deg": round(statistics.mean(residual), 3) if residual else 0.0,
+    }
+
+
+# ── Baseline comparison ───────────────────────────────────────────────────────
+def machine_info() -> dict:
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "opencv_threads": cv2.getNumThreads(),
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float, mem_threshold: float) -> list[str]:
+    """Human-readable regressions of current vs baseline; empty when within thresholds."""
+    problems = []
+    for key, cur in current["cases"].items():
+        base = baseline["cases"].get(key)
+        if base is None:
+            continue
+        checks = [("wall", base["wall_s"]["min"], cur["wall_s"]["min"])]
+        checks += [
+            (stage, base["stages_s"][stage]["min"], cur["stages_s"][stage]["min"])
+            for stage in STAGES if stage in base["stages_s"]
+        ]
+        for name, b, c in checks:
+            if b >= MIN_GATED_S and c > b * (1 + threshold):
+                problems.append(f"{key} {name}: {b:.3f}s → {c:.3f}s (+{(c / b - 1):.0%})")
+        b, c = base["tracemalloc_peak_mb"], cur["tracemalloc_peak_mb"]
+        if b and c > b * (1 + mem_threshold):
+            problems.append(f"{key} tracemalloc peak: {b:.0f} MB → {c:.0f} MB (+{(c / b - 1):.0%})")
+    return problems
+
+
+def _print_row(key: str, r: dict) -> None:
+    s = r["stages_s"]
+    rss = f"{r['rss_peak_mb']:>9.0f}" if r["rss_peak_mb"] is not None else f"{'-':>9}"
+    print(
+        f"{key:<36}{r['wall_s']['min']:>8.2f}{s['yaw_correct']['min']:>8.2f}{s['stitch']['min']:>8.2f}"
+        f"{s['undistort']['min']:>8.2f}{r['tracemalloc_peak_mb']:>9.0f}{rss}{r['yaw_residual_deg']:>8.2f}"
+    )
+
+
+def _csv(value: str) -> list[str]:
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--widths", default="1024,2048,4096,8192", help="comma list of output widths")
+    parser.add_argument("--modes", default="winner_takes_all,column_first", help=f"comma list of {', '.join(MODES)}")
+    parser.add_argument("--captures", default="720x960,1440x1920", help="comma list of capture sizes (WxH)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case (min / median reported)")
+    parser.add_argument("--quick", action="store_true", help="1024,2048 × 720x960, one repeat")
+    parser.add_argument("--yaw-jitter", type=float, default=2.0, help="max yaw error (deg) of upper/lower captures")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--update", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--check", action="store_true", help="exit 1 if any case regresses past the thresholds")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed slowdown vs baseline (0.15 = +15%%)")
+    parser.add_argument("--mem-threshold", type=float, default=0.10, help="allowed tracemalloc peak growth")
+    parser.add_argument("--in-process", action="store_true", help="no process per case (RSS peaks become cumulative)")
+    parser.add_argument("--json", type=Path, help="also write the results to this file")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.widths, args.captures, args.repeat = "1024,2048", "720x960", 1
+    for mode in _csv(args.modes):
+        if mode not in MODES:
+            raise SystemExit(f"unknown mode {mode!r}; expected one of {', '.join(MODES)}")
+    cases = [
+        Case(int(w), mode, capture)
+        for capture in _csv(args.captures) for mode in _csv(args.modes) for w in _csv(args.widths)
+    ]
+
+    results = {
+        "version": BASELINE_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "machine": machine_info(),
+        "config": {"repeat": args.repeat, "yaw_jitter_deg": args.yaw_jitter, "seed": args.seed},
+        "cases": {},
+    }
+    print(f"{'case':<36}{'wall s':>8}{'yaw s':>8}{'stitch':>8}{'undist':>8}{'heap MB':>9}{'RSS MB':>9}{'yaw err':>8}")
+    with tempfile.TemporaryDirectory(prefix="stitch_bench_") as tmp:
+        scene = make_scene(seed=args.seed)
+        captures = {
+            c: write_captures(Path(tmp) / c, c, args.yaw_jitter, args.seed, scene) for c in _csv(args.captures)
+        }
+        del scene
+        pool = None
+        if not args.in_process:
+            pool = ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn"), max_tasks_per_child=1)
+        try:
+            for case in cases:
+                if pool is None:
+                    r = run_case(case, captures[case.capture], args.repeat, tmp)
+                else:
+                    r = pool.submit(run_case, case, captures[case.capture], args.repeat, tmp).result()
+                results["cases"][case.key] = r
+                _print_row(case.key, r)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+    status = 0
+    if args.check:
+        if not args.baseline.is_file():
+            raise SystemExit(f"no baseline at {args.baseline}; run with --update first")
+        baseline = json.loads(args.baseline.read_text())
+        if baseline.get("machine") != results["machine"]:
+            print(f"warning: baseline was recorded on a different machine / library set ({args.baseline})")
+        missing = [k for k in results["cases"] if k not in baseline["cases"]]
+        if missing:
+            print(f"not in baseline (not gated): {', '.join(missing)}")
+        problems = compare(baseline, results, args.threshold, args.mem_threshold)
+        for p in problems:
+            print(f"REGRESSION {p}")
+        if problems:
+            status = 1
+        else:
+            print(f"OK: no regressions past +{args.threshold:.0%} time / +{args.mem_threshold:.0%} memory")
+
+    if args.update:
+        args.baseline.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"baseline written to {args.baseline}")
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Content-addressed storage for panorama JPEGs.
+
+Every stitched / staged / imported JPEG is stored once, named by the sha256 of its bytes:
+
+  <PANORAMA_OUTPUT_DIR>/blobs/<h[0:2]>/<h[2:4]>/<h>.jpg
+
+Panorama rows keep the path relative to OUTPUT_DIR in stitched_filename / staged_filename
+(so older panorama_{id}.jpg rows still resolve) and the hash in stitched_sha256 /
+staged_sha256. A put whose hash already exists skips the write entirely; new blobs are
+moved into place with an atomic rename, so readers never see a partial file. The hash
+doubles as a strong ETag and as the ?v= version in image URLs.
+
+Blobs are never overwritten or deleted here; retention.py collects unreferenced ones.
+"""
+from __future__ import annotations
+
+import hashlib
+from dataclasses import dataclass
+from pathlib import Path
+
+from retention import PANORAMA, FileIndex
+from storage import write_atomic
+from uploads import SpooledFile
+
+
+@dataclass
+class Blob:
+    sha256: str
+    path: Path
+    filename: str  # relative to the store root's parent (OUTPUT_DIR), as stored in panorama rows
+    created: bool  # False when identical bytes were already stored
+
+
+class BlobStore:
+    def __init__(self, root: Path, index: FileIndex | None = None):
+        self.root = Path(root)
+        self.dir = self.root / "blobs"
+        self.index = index
+
+    def filename_for(self, sha256: str, ext: str = ".jpg") -> str:
+        return f"blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}{ext}"
+
+    def path_for(self, sha256: str, ext: str = ".jpg") -> Path:
+        return self.root / self.filename_for(sha256, ext)
+
+    def _blob(self, sha256: str, created: bool) -> Blob:
+        path = self.path_for(sha256)
+        if self.index is not None:
+            # Re-referenced: restart the GC grace period in the index. The blob's mtime is left
+            # alone; variant names and tile pyramid versions are keyed on it.
+            self.index.record(path, PANORAMA, referenced=not created)
+        return Blob(sha256, path, self.filename_for(sha256), created)
+
+    def put_bytes(self, data: bytes) -> Blob:
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self.path_for(sha256)
+        if path.is_file():
+            return self._blob(sha256, created=False)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(path, data)
+        return self._blob(sha256, created=True)
+
+    def put_spooled(self, upload: SpooledFile) -> Blob:
+        """Adopt a spooled upload (hash computed while spooling); a duplicate is left in scratch."""
+        path = self.path_for(upload.sha256)
+        if path.is_file():
+            return self._blob(upload.sha256, created=False)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        upload.move_to(path)
+        return self._blob(upload.sha256, created=True)
+
+    def sha256_of(self, path: Path) -> str | None:
+        """Hash of a file inside the store (taken from its name), else None."""
+        try:
+            Path(path).relative_to(self.dir)
+        except ValueError:
+            return None
+        return Path(path).stem
@@ -7,7 +7,7 @@ from __future__ import annotations
 
 from datetime import datetime, timezone
 
-from sqlalchemy import DateTime, String, Text
+from sqlalchemy import BigInteger, DateTime, Index, String, Text, text
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import Mapped, mapped_column
 
@@ -30,6 +30,12 @@ class Panorama(Base):
     # Filenames under PANORAMA_OUTPUT_DIR (not full URLs — app may use local file://)
     stitched_filename: Mapped[str] = mapped_column(String(512))
     staged_filename: Mapped[str | None] = mapped_column(String(512), nullable=True)
+    # sha256 of those files (content-addressed blobs, see blobstore.py); NULL for legacy rows
+    stitched_sha256: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    staged_sha256: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    # /stitch with preview: "preview" until the full stitch replaces the file, then "complete"
+    # (or "failed", keeping the preview); NULL for rows stitched in one step
+    stitch_status: Mapped[str | None] = mapped_column(String(16), nullable=True)
 
     staging_prompt_last: Mapped[str | None] = mapped_column(Text, nullable=True)
 
@@ -39,5 +45,22 @@ class Panorama(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=_utcnow)
     updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=_utcnow, onupdate=_utcnow)
 
+    # Id of the transaction that last wrote the row (pg_current_xact_id(), PostgreSQL 13+); the
+    # commit-ordered position of GET /panoramas/changes. Set by every write in panorama_db.
+    change_xid: Mapped[int] = mapped_column(
+        BigInteger, server_default=text("(pg_current_xact_id()::text::bigint)"),
+    )
+
     # Optional multi-device / future auth (nullable)
     device_id: Mapped[str | None] = mapped_column(String(128), nullable=True, index=True)
+
+    __table_args__ = (
+        # Keyset pagination for GET /panoramas: (created_at, id) desc, optionally per device
+        Index("ix_panoramas_created_at_id", "created_at", "id"),
+        Index("ix_panoramas_device_created_at_id", "device_id", "created_at", "id"),
+        # Delta sync (GET /panoramas/changes): rows with (change_xid, id) after the client's token
+        Index("ix_panoramas_change_xid_id", "change_xid", "id"),
+        # Retention GC: "is this file still referenced by any row?"
+        Index("ix_panoramas_stitched_filename", "stitched_filename"),
+        Index("ix_panoramas_staged_filename", "staged_filename"),
+    )
@@ -0,0 +1,64 @@
+"""
+Conditional GET for image files under PANORAMA_OUTPUT_DIR.
+
+- Strong ETag from mtime + size (cheap: one stat, no hashing).
+- If-None-Match → 304 with no body.
+- Cache-Control: `immutable` when the URL's ?v=… is the file's current version, otherwise
+  `no-cache` so clients revalidate and get a 304 (a stale or made-up ?v= is never pinned
+  for a year).
+- Range / If-Range: handled by Starlette's FileResponse; If-Range is checked against our ETag.
+"""
+from __future__ import annotations
+
+import os
+from email.utils import formatdate
+from pathlib import Path
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+
+CACHE_CONTROL_IMMUTABLE = "public, max-age=31536000, immutable"
+CACHE_CONTROL_REVALIDATE = "no-cache"
+
+
+def file_etag(st: os.stat_result) -> str:
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison (RFC 9110 §13.1.2): W/ prefixes are ignored for If-None-Match
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return etag in tags
+
+
+class _ETagFileResponse(FileResponse):
+    """FileResponse whose If-Range check uses our ETag instead of Starlette's md5 one."""
+
+    def _should_use_range(self, http_if_range: str, stat_result: os.stat_result) -> bool:
+        return http_if_range in (self.headers.get("etag"), formatdate(stat_result.st_mtime, usegmt=True))
+
+
+def cached_file_response(
+    request: Request,
+    path: Path,
+    *,
+    media_type: str = "image/jpeg",
+    etag: str | None = None,
+    version: str | None = None,
+) -> Response:
+    """Serve path with ETag / 304 / Cache-Control / Range. Caller checks the file exists.
+
+    version is the file's current ?v= value; only a request carrying exactly it is immutable."""
+    st = os.stat(path)
+    etag = etag or file_etag(st)
+    immutable = version is not None and request.query_params.get("v") == version
+    headers = {
+        "ETag": etag,
+        "Cache-Control": CACHE_CONTROL_IMMUTABLE if immutable else CACHE_CONTROL_REVALIDATE,
+    }
+    inm = request.headers.get("if-none-match")
+    if inm and _etag_matches(inm, etag):
+        return Response(status_code=304, headers=headers)
+    return _ETagFileResponse(path, media_type=media_type, headers=headers, stat_result=st)
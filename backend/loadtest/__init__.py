@@ -0,0 +1 @@
+"""Offline load testing: provider stand-ins (fake_providers) and a load driver (driver)."""
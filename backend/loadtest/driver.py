@@ -0,0 +1,269 @@
+"""
+Closed-loop load driver for the backend.
+
+For each concurrency level, `concurrency` workers send requests back to back until
+`--requests` have completed, then the driver reports throughput, p50 / p95 / p99 latency,
+errors and the backend's peak RSS (summed over the given PID and its children, i.e. all
+uvicorn workers) for that level.
+
+Scenarios:
+  stitch       POST /stitch with --images synthetic JPEGs (24 → column-then-full path)
+  stage        POST /stage
+  reconstruct  POST /reconstruct
+  list         GET  /panoramas?limit=50
+  image        GET  /panoramas/{id}/image?w=512 (ids taken from the first list page)
+
+Run (from backend/, with the backend pointed at loadtest.fake_providers):
+  python -m loadtest.driver --scenario stitch --concurrency 1,2,4,8 --requests 40 --pid <uvicorn pid>
+Needs httpx; psutil is optional (falls back to /proc on Linux).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from dataclasses import asdict, dataclass
+
+import httpx
+
+try:
+    import psutil
+except ImportError:
+    psutil = None  # optional – RSS is read from /proc instead (Linux only)
+
+
+@dataclass
+class LevelResult:
+    scenario: str
+    concurrency: int
+    requests: int
+    errors: int
+    seconds: float
+    throughput_rps: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    max_ms: float
+    peak_rss_mb: float | None
+
+
+def _percentile(sorted_ms: list[float], p: float) -> float:
+    if not sorted_ms:
+        return 0.0
+    return round(sorted_ms[min(len(sorted_ms) - 1, int(p * len(sorted_ms)))], 1)
+
+
+# ── Backend memory ────────────────────────────────────────────────────────────
+def _proc_rss_bytes(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as fh:
+        for line in fh:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def _proc_children(pid: int) -> list[int]:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as fh:
+            return [int(c) for c in fh.read().split()]
+    except OSError:
+        return []
+
+
+def tree_rss_bytes(pid: int) -> int:
+    """RSS of pid plus all descendants (uvicorn --workers / --reload spawn children)."""
+    if psutil is not None:
+        root = psutil.Process(pid)
+        procs = [root, *root.children(recursive=True)]
+        total = 0
+        for p in procs:
+            try:
+                total += p.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        return total
+    total, stack = 0, [pid]
+    while stack:
+        p = stack.pop()
+        try:
+            total += _proc_rss_bytes(p)
+        except OSError:
+            continue
+        stack.extend(_proc_children(p))
+    return total
+
+
+async def _sample_rss(pid: int, peak: list[int], stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        try:
+            peak[0] = max(peak[0], tree_rss_bytes(pid))
+        except Exception:
+            return
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=0.25)
+        except asyncio.TimeoutError:
+            pass
+
+
+# ── Request payloads ──────────────────────────────────────────────────────────
+def _synthetic_jpeg(width: int, height: int, seed: int) -> bytes:
+    """Noisy JPEG roughly the size of a phone capture at the same resolution."""
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    img = rng.integers(0, 255, (height // 8, width // 8, 3), dtype=np.uint8)
+    img = cv2.resize(img, (width, height), interpolation=cv2.INTER_LINEAR)
+    ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return buf.tobytes()
+
+
+class Scenario:
+    def __init__(self, name: str, args: argparse.Namespace):
+        self.name = name
+        self.args = args
+        self.headers = {"Prefer": "return=minimal"} if args.minimal else {}
+        w, h = (int(v) for v in args.capture_size.split("x"))
+        if name == "stitch":
+            self.captures = [_synthetic_jpeg(w, h, i) for i in range(args.images)]
+            poses = [{"pitch": 135 - 45 * (i // 8), "yaw": 45 * (i % 8)} for i in range(args.images)]
+            self.poses_json = json.dumps(poses)
+        elif name in ("stage", "reconstruct"):
+            self.panorama = _synthetic_jpeg(2 * w, w, 0)
+        self.ids: list[str] = []
+
+    async def prepare(self, client: httpx.AsyncClient) -> None:
+        if self.name == "image":
+            r = await client.get("/panoramas", params={"limit": 50, "fields": "id"})
+            r.raise_for_status()
+            self.ids = [row["id"] for row in r.json()]
+            if not self.ids:
+                raise SystemExit("scenario 'image' needs at least one panorama in the database")
+
+    async def send(self, client: httpx.AsyncClient) -> httpx.Response:
+        if self.name == "stitch":
+            files = [("images", (f"img_{i:02d}.jpg", b, "image/jpeg")) for i, b in enumerate(self.captures)]
+            return await client.post("/stitch", data={"poses_json": self.poses_json}, files=files, headers=self.headers)
+        if self.name == "stage":
+            return await client.post(
+                "/stage",
+                data={"prompt": "modern living room with warm lighting"},
+                files={"image": ("pano.jpg", self.panorama, "image/jpeg")},
+                headers=self.headers,
+            )
+        if self.name == "reconstruct":
+            return await client.post(
+                "/reconstruct",
+                data={"display_name": "Load test", "model": "Marble 0.1-mini"},
+                files={"image": ("pano.jpg", self.panorama, "image/jpeg")},
+            )
+        if self.name == "list":
+            return await client.get("/panoramas", params={"limit": 50})
+        if self.name == "image":
+            return await client.get(f"/panoramas/{random.choice(self.ids)}/image", params={"w": 512})
+        raise ValueError(f"unknown scenario {self.name!r}")
+
+
+# ── Driver ────────────────────────────────────────────────────────────────────
+async def run_level(
+    client: httpx.AsyncClient, scenario: Scenario, concurrency: int, total: int, pid: int | None,
+) -> LevelResult:
+    latencies: list[float] = []
+    errors = 0
+    remaining = total
+
+    async def worker() -> None:
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            t0 = time.perf_counter()
+            try:
+                r = await scenario.send(client)
+                await r.aread()
+                ok = r.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            latencies.append((time.perf_counter() - t0) * 1000)
+            if not ok:
+                errors += 1
+
+    peak = [0]
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(_sample_rss(pid, peak, stop)) if pid else None
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    if sampler:
+        await sampler
+
+    latencies.sort()
+    return LevelResult(
+        scenario=scenario.name,
+        concurrency=concurrency,
+        requests=len(latencies),
+        errors=errors,
+        seconds=round(elapsed, 2),
+        throughput_rps=round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        p50_ms=_percentile(latencies, 0.50),
+        p95_ms=_percentile(latencies, 0.95),
+        p99_ms=_percentile(latencies, 0.99),
+        max_ms=round(latencies[-1], 1) if latencies else 0.0,
+        peak_rss_mb=round(peak[0] / 2**20, 1) if pid else None,
+    )
+
+
+def _print_row(r: LevelResult) -> None:
+    rss = f"{r.peak_rss_mb:>9.1f}" if r.peak_rss_mb is not None else f"{'-':>9}"
+    print(
+        f"{r.scenario:<12}{r.concurrency:>5}{r.requests:>7}{r.errors:>7}{r.throughput_rps:>9.2f}"
+        f"{r.p50_ms:>10.1f}{r.p95_ms:>10.1f}{r.p99_ms:>10.1f}{rss}"
+    )
+
+
+async def main_async(args: argparse.Namespace) -> list[LevelResult]:
+    levels = [int(c) for c in args.concurrency.split(",")]
+    timeout = httpx.Timeout(args.timeout)
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    results = []
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=timeout, limits=limits) as client:
+        for name in args.scenario.split(","):
+            scenario = Scenario(name, args)
+            await scenario.prepare(client)
+            if args.warmup:
+                await run_level(client, scenario, 1, args.warmup, None)
+            print(f"{'scenario':<12}{'conc':>5}{'reqs':>7}{'errs':>7}{'rps':>9}"
+                  f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'RSS MB':>9}")
+            for c in levels:
+                result = await run_level(client, scenario, c, max(args.requests, c), args.pid)
+                _print_row(result)
+                results.append(result)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default=os.environ.get("BACKEND_URL", "http://127.0.0.1:8000"))
+    parser.add_argument("--scenario", default="stitch", help="comma list: stitch,stage,reconstruct,list,image")
+    parser.add_argument("--concurrency", default="1,2,4,8,16", help="comma list of levels, run in order")
+    parser.add_argument("--requests", type=int, default=50, help="requests per level")
+    parser.add_argument("--warmup", type=int, default=2, help="sequential requests before measuring")
+    parser.add_argument("--pid", type=int, help="backend (uvicorn) PID for RSS sampling")
+    parser.add_argument("--images", type=int, default=24, help="captures per /stitch request")
+    parser.add_argument("--capture-size", default="1440x1920", help="WxH of synthetic captures")
+    parser.add_argument("--minimal", action="store_true", help="send Prefer: return=minimal")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(main_async(args))
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump([asdict(r) for r in results], fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
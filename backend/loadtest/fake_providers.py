@@ -0,0 +1,298 @@
+"""
+Local stand-ins for the external providers the backend calls, for offline load tests.
+
+One server mimics all of them (request / response shapes as parsed by nanobanana.py and
+worldlabs.py):
+
+  Gemini      POST /gemini/v1beta/models/{model}:generateContent
+  imgbb       POST /imgbb/1/upload
+  NanoBanana  POST /nanobanana/api/v1/nanobanana/generate
+              GET  /nanobanana/api/v1/nanobanana/record-info?taskId=…
+  WorldLabs   POST /worldlabs/marble/v1/media-assets:prepare_upload
+              PUT  /gcs/{asset_id}                      (signed upload URL)
+              POST /worldlabs/marble/v1/worlds:generate
+              GET  /worldlabs/marble/v1/operations/{operation_id}
+  Downloads   GET  /files/{name}                        (imgbb / NanoBanana result URLs)
+
+Every provider call sleeps for a log-normal latency (median + sigma) and fails with the
+configured probability, so retries, timeouts and slow upstreams can be reproduced.
+
+Run (from backend/):
+  python -m loadtest.fake_providers --port 9100 --latency gemini=4000:0.4 --fail gemini=0.02
+then start the backend with the environment printed at startup.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import math
+import random
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+PROVIDERS = ("gemini", "imgbb", "nanobanana", "worldlabs", "gcs")
+
+
+@dataclass
+class ProviderProfile:
+    median_ms: float = 0.0
+    sigma: float = 0.0  # log-normal shape; 0 → constant latency
+    fail_rate: float = 0.0
+
+    def delay_s(self) -> float:
+        if self.median_ms <= 0:
+            return 0.0
+        return self.median_ms * math.exp(random.gauss(0.0, self.sigma)) / 1000
+
+
+@dataclass
+class FakeConfig:
+    profiles: dict[str, ProviderProfile] = field(
+        default_factory=lambda: {
+            "gemini": ProviderProfile(3000, 0.4),
+            "imgbb": ProviderProfile(300, 0.3),
+            "nanobanana": ProviderProfile(150, 0.3),
+            "worldlabs": ProviderProfile(150, 0.3),
+            "gcs": ProviderProfile(200, 0.3),
+        }
+    )
+    image_width: int = 4096
+    # Polls that report "still running" before a NanoBanana task / WorldLabs operation is done
+    nanobanana_polls: int = 2
+    worldlabs_polls: int = 3
+
+
+config = FakeConfig()
+
+_result_jpeg: bytes = b""
+_gemini_body: bytes = b""
+_ids = itertools.count(1)
+_polls: dict[str, int] = {}
+
+
+def _make_result_jpeg(width: int) -> bytes:
+    """Synthetic 2:1 equirect stand-in (gradient + grid), encoded once at startup."""
+    import cv2
+    import numpy as np
+
+    h = width // 2
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, h, dtype=np.float32)[:, None]
+    img = np.dstack([np.broadcast_to(x, (h, width)), np.broadcast_to(y, (h, width)), np.full((h, width), 96)])
+    img = img.astype(np.uint8)
+    img[::64, :] = 255
+    img[:, ::64] = 255
+    ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    return buf.tobytes()
+
+
+def _prepare() -> None:
+    global _result_jpeg, _gemini_body
+    _result_jpeg = _make_result_jpeg(config.image_width)
+    _gemini_body = json.dumps({
+        "candidates": [{
+            "finishReason": "STOP",
+            "content": {"parts": [{"inlineData": {
+                "mimeType": "image/jpeg",
+                "data": base64.b64encode(_result_jpeg).decode(),
+            }}]},
+        }],
+    }).encode()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    _prepare()
+    yield
+
+
+app = FastAPI(title="Fake providers (load testing)", lifespan=lifespan)
+
+
+async def _simulate(provider: str) -> bool:
+    """Sleep for the provider's latency; True if this call should fail."""
+    profile = config.profiles[provider]
+    await asyncio.sleep(profile.delay_s())
+    return random.random() < profile.fail_rate
+
+
+def _next_id(prefix: str) -> str:
+    return f"{prefix}-{next(_ids)}"
+
+
+def _base(request: Request) -> str:
+    return str(request.base_url).rstrip("/")
+
+
+# ── Gemini ────────────────────────────────────────────────────────────────────
+@app.post("/gemini/v1beta/models/{model_action}")
+async def gemini_generate(model_action: str, request: Request):
+    await request.body()  # consume the (large) base64 payload like the real API would
+    if await _simulate("gemini"):
+        return JSONResponse({"error": {"code": 503, "message": "fake: model overloaded"}}, status_code=503)
+    return Response(_gemini_body, media_type="application/json")
+
+
+# ── imgbb ─────────────────────────────────────────────────────────────────────
+@app.post("/imgbb/1/upload")
+async def imgbb_upload(request: Request):
+    await request.form()
+    if await _simulate("imgbb"):
+        return JSONResponse({"success": False, "error": {"message": "fake: upload failed"}}, status_code=500)
+    return {"success": True, "data": {"url": f"{_base(request)}/files/{_next_id('imgbb')}.jpg"}}
+
+
+# ── NanoBanana ────────────────────────────────────────────────────────────────
+@app.post("/nanobanana/api/v1/nanobanana/generate")
+async def nanobanana_generate(request: Request):
+    await request.json()
+    if await _simulate("nanobanana"):
+        return {"code": 500, "msg": "fake: submit failed"}
+    task_id = _next_id("task")
+    _polls[task_id] = 0
+    return {"code": 200, "data": {"taskId": task_id}}
+
+
+@app.get("/nanobanana/api/v1/nanobanana/record-info")
+async def nanobanana_record_info(taskId: str, request: Request):
+    failed = await _simulate("nanobanana")
+    n = _polls.get(taskId, 0) + 1
+    _polls[taskId] = n
+    if failed:
+        return {"code": 200, "data": {"taskId": taskId, "successFlag": 3, "errorMessage": "fake: generation failed"}}
+    if n <= config.nanobanana_polls:
+        return {"code": 200, "data": {"taskId": taskId, "successFlag": 0}}
+    _polls.pop(taskId, None)
+    return {"code": 200, "data": {
+        "taskId": taskId,
+        "successFlag": 1,
+        "response": {"resultImageUrl": f"{_base(request)}/files/{taskId}.jpg"},
+    }}
+
+
+@app.get("/files/{name}")
+async def download(name: str):
+    return Response(_result_jpeg, media_type="image/jpeg")
+
+
+# ── WorldLabs ─────────────────────────────────────────────────────────────────
+@app.post("/worldlabs/marble/v1/media-assets:prepare_upload")
+async def worldlabs_prepare_upload(request: Request):
+    await request.json()
+    if await _simulate("worldlabs"):
+        return JSONResponse({"detail": "fake: prepare_upload failed"}, status_code=500)
+    asset_id = _next_id("asset")
+    return {
+        "media_asset": {"media_asset_id": asset_id},
+        "upload_info": {
+            "upload_url": f"{_base(request)}/gcs/{asset_id}",
+            "required_headers": {"Content-Type": "image/jpeg"},
+        },
+    }
+
+
+@app.put("/gcs/{asset_id}")
+async def gcs_put(asset_id: str, request: Request):
+    await request.body()
+    if await _simulate("gcs"):
+        return Response(status_code=503)
+    return Response(status_code=200)
+
+
+@app.post("/worldlabs/marble/v1/worlds:generate")
+async def worldlabs_generate(request: Request):
+    await request.json()
+    if await _simulate("worldlabs"):
+        return JSONResponse({"detail": "fake: generate failed"}, status_code=500)
+    op = _next_id("op")
+    _polls[op] = 0
+    return {"operation_id": op}
+
+
+@app.get("/worldlabs/marble/v1/operations/{operation_id}")
+async def worldlabs_operation(operation_id: str, request: Request):
+    failed = await _simulate("worldlabs")
+    n = _polls.get(operation_id, 0) + 1
+    _polls[operation_id] = n
+    if failed:
+        _polls.pop(operation_id, None)
+        return {"done": True, "error": {"message": "fake: generation failed"}}
+    if n <= config.worldlabs_polls:
+        return {"done": False, "metadata": {"progress": {"status": "IN_PROGRESS"}}}
+    _polls.pop(operation_id, None)
+    world_id = operation_id.replace("op-", "world-")
+    base = _base(request)
+    return {"done": True, "response": {"world": {
+        "id": world_id,
+        "world_marble_url": f"{base}/marble/{world_id}",
+        "assets": {
+            "thumbnail_url": f"{base}/files/{world_id}_thumb.jpg",
+            "caption": "fake world",
+            "imagery": {"pano_url": f"{base}/files/{world_id}_pano.jpg"},
+            "splats": {"spz_urls": {
+                "100k": f"{base}/files/{world_id}_100k.spz",
+                "500k": f"{base}/files/{world_id}_500k.spz",
+                "full_res": f"{base}/files/{world_id}_full.spz",
+            }},
+            "mesh": {"collider_mesh_url": f"{base}/files/{world_id}_collider.glb"},
+        },
+    }}}
+
+
+# ── CLI ───────────────────────────────────────────────────────────────────────
+def _parse_kv(values: list[str], what: str) -> dict[str, str]:
+    out = {}
+    for v in values:
+        name, _, rest = v.partition("=")
+        if name not in PROVIDERS or not rest:
+            raise SystemExit(f"--{what} expects PROVIDER=VALUE with PROVIDER in {', '.join(PROVIDERS)}: {v!r}")
+        out[name] = rest
+    return out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", action="append", default=[], metavar="PROVIDER=MEDIAN_MS[:SIGMA]")
+    parser.add_argument("--fail", action="append", default=[], metavar="PROVIDER=RATE")
+    parser.add_argument("--image-width", type=int, default=config.image_width, help="width of the returned JPEG")
+    parser.add_argument("--nanobanana-polls", type=int, default=config.nanobanana_polls)
+    parser.add_argument("--worldlabs-polls", type=int, default=config.worldlabs_polls)
+    args = parser.parse_args()
+
+    for name, spec in _parse_kv(args.latency, "latency").items():
+        median, _, sigma = spec.partition(":")
+        config.profiles[name].median_ms = float(median)
+        if sigma:
+            config.profiles[name].sigma = float(sigma)
+    for name, rate in _parse_kv(args.fail, "fail").items():
+        config.profiles[name].fail_rate = float(rate)
+    config.image_width = args.image_width
+    config.nanobanana_polls = args.nanobanana_polls
+    config.worldlabs_polls = args.worldlabs_polls
+
+    origin = f"http://{args.host}:{args.port}"
+    print("Point the backend at these stand-ins:")
+    print(f"  export GEMINI_API_BASE={origin}/gemini/v1beta/models")
+    print(f"  export NANOBANANA_API_BASE={origin}/nanobanana")
+    print(f"  export IMGBB_UPLOAD_URL={origin}/imgbb/1/upload")
+    print(f"  export WORLDLABS_API_BASE={origin}/worldlabs")
+    print("  export NANOBANANA_POLL_INTERVAL_S=0.5 WORLDLABS_POLL_INTERVAL_S=0.5")
+    print("  export GOOGLE_API_KEY=fake WORLDLABS_API_KEY=fake NANOBANANA_API_KEY=fake IMGBB_API_KEY=fake")
+    for name, p in config.profiles.items():
+        print(f"  {name:<10} median {p.median_ms:.0f} ms  sigma {p.sigma}  fail {p.fail_rate:.1%}")
+
+    import uvicorn
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
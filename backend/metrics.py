@@ -0,0 +1,246 @@
+"""
+In-process stage timers and provider counters, exported in Prometheus text format.
+
+  with stage("gemini.generate"):        # duration → histogram + this request's Server-Timing
+      resp = requests.post(...)
+  count_http("gemini", resp)            # request / response body bytes for the provider
+
+GET /metrics (text format 0.0.4):
+  backend_stage_duration_seconds{stage,outcome}                histogram (outcome = ok | error)
+  backend_http_request_duration_seconds{method,route,status}   histogram
+  backend_provider_requests_total{provider,status}             counter
+  backend_provider_bytes_total{provider,direction}             counter (direction = sent | received)
+
+ServerTimingMiddleware adds a Server-Timing header to every response: each stage that ran
+for the request (summed, with a call count) plus `total`. Stages inside run_in_threadpool /
+asyncio.to_thread count too, since contextvars are copied into the worker thread; stages of
+background tasks finish after the header is sent and only reach the histograms.
+
+Values are per process: with uvicorn --workers, each worker serves its own /metrics.
+Standard library only.
+"""
+from __future__ import annotations
+
+import abc
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from starlette.datastructures import MutableHeaders
+
+import tracing
+
+# Seconds; provider calls range from ~100 ms (polls) to minutes (Gemini stitching)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(value: float) -> str:
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+class _Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _labels(self, values: tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{k}="{_escape(str(v))}"' for k, v in zip(self.labelnames, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+    @abc.abstractmethod
+    def _samples(self) -> list[str]:
+        """Sample lines in Prometheus text format."""
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self._values: dict[tuple[str, ...], float] = {}
+        super().__init__(name, help, labelnames)
+
+    def inc(self, labels: tuple[str, ...] = (), amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{self._labels(k)} {_fmt(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        # labels → [per-bucket counts (+Inf last), sum, count]
+        self._values: dict[tuple[str, ...], list] = {}
+        super().__init__(name, help, labelnames)
+
+    def observe(self, labels: tuple[str, ...], value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = sorted((k, ([*v[0]], v[1], v[2])) for k, v in self._values.items())
+        lines = []
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip((*self.buckets, float("inf")), counts):
+                cumulative += n
+                le = f'le="{_fmt(bound)}"'
+                lines.append(f"{self.name}_bucket{self._labels(labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(labels)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{self._labels(labels)} {count}")
+        return lines
+
+
+REGISTRY: list[_Metric] = []
+
+STAGE_SECONDS = Histogram(
+    "backend_stage_duration_seconds", "Time spent in one backend stage (provider call, OpenCV step, DB write).",
+    ("stage", "outcome"),
+)
+HTTP_SECONDS = Histogram(
+    "backend_http_request_duration_seconds", "HTTP request handling time until the response completed.",
+    ("method", "route", "status"),
+)
+PROVIDER_REQUESTS = Counter(
+    "backend_provider_requests_total", "HTTP requests sent to external providers, by response status.",
+    ("provider", "status"),
+)
+PROVIDER_BYTES = Counter(
+    "backend_provider_bytes_total", "HTTP body bytes exchanged with external providers.",
+    ("provider", "direction"),
+)
+
+
+def render_prometheus() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+# ── Stage timers ──────────────────────────────────────────────────────────────
+# (stage, seconds) for the current request; None outside a request
+_request_timings: ContextVar[list[tuple[str, float]] | None] = ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time the block into backend_stage_duration_seconds and the request's Server-Timing (and trace)."""
+    outcome = "error"
+    t0 = time.perf_counter()
+    try:
+        with tracing.span(name):
+            yield
+        outcome = "ok"
+    finally:
+        elapsed = time.perf_counter() - t0
+        STAGE_SECONDS.observe((name, outcome), elapsed)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+
+def _body_len(body) -> int:
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode())
+    try:
+        return len(body)
+    except TypeError:
+        return 0  # streamed body (generator / file object)
+
+
+def count_http(provider: str, resp) -> None:
+    """Count a completed requests.Response: status plus request / response body bytes.
+
+    Called inside the provider call's stage(), so the sizes also land on its trace span."""
+    sent, received = _body_len(resp.request.body), len(resp.content)
+    PROVIDER_REQUESTS.inc((provider, str(resp.status_code)))
+    PROVIDER_BYTES.inc((provider, "sent"), sent)
+    PROVIDER_BYTES.inc((provider, "received"), received)
+    tracing.set_attributes(
+        **{"provider": provider, "http.status_code": resp.status_code, "bytes.sent": sent, "bytes.received": received}
+    )
+
+
+def server_timing(timings: list[tuple[str, float]], total_s: float) -> str:
+    merged: dict[str, list] = {}
+    for name, seconds in list(timings):
+        entry = merged.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+    parts = [
+        f'{name};dur={seconds * 1000:.1f}' + (f';desc="{n} calls"' if n > 1 else "")
+        for name, (seconds, n) in merged.items()
+    ]
+    parts.append(f"total;dur={total_s * 1000:.1f}")
+    return ", ".join(parts)
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware: request duration histogram and the Server-Timing response header."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings: list[tuple[str, float]] = []
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        status = 500
+        elapsed = None
+
+        async def send_with_timing(message):
+            nonlocal status, elapsed
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", server_timing(timings, time.perf_counter() - start))
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body"):
+                # Response complete; background tasks run after this and are not request latency
+                elapsed = time.perf_counter() - start
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            # Route template, not the raw path, to keep label cardinality bounded
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            if elapsed is None:
+                elapsed = time.perf_counter() - start
+            HTTP_SECONDS.observe((scope["method"], route, str(status)), elapsed)
@@ -7,19 +7,30 @@ Flow:
   3. Poll task status until SUCCESS (or timeout / failure)
   4. Download and return staged image bytes
 
-Also: Gemini AI stitching for photosphere (column + full 360°) via stitch_panorama_google.
+Also: Gemini AI stitching for photosphere (column + full 360°) via stitch_panorama_google,
+and single-call seam cleanup of a locally stitched draft via refine_stitched_draft.
+
+Endpoints can be redirected (e.g. to the stand-ins in loadtest/fake_providers.py):
+  GEMINI_API_BASE, NANOBANANA_API_BASE, IMGBB_UPLOAD_URL, NANOBANANA_POLL_INTERVAL_S
 """
 import base64
+import mmap
 import os
 import time
 from pathlib import Path
 
 import requests
 
+from metrics import count_http, stage
+from tracing import span
+
 # ── API endpoints ─────────────────────────────────────────────────────────────
-_NB_BASE = "https://api.nanobananaapi.ai"
-_IMGBB_UPLOAD = "https://api.imgbb.com/1/upload"
-_GOOGLE_BASE = "https://generativelanguage.googleapis.com/v1beta/models"
+_NB_BASE = os.environ.get("NANOBANANA_API_BASE", "https://api.nanobananaapi.ai").rstrip("/")
+_IMGBB_UPLOAD = os.environ.get("IMGBB_UPLOAD_URL", "https://api.imgbb.com/1/upload")
+_GOOGLE_BASE = os.environ.get(
+    "GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta/models"
+).rstrip("/")
+_NB_POLL_INTERVAL_S = float(os.environ.get("NANOBANANA_POLL_INTERVAL_S", "5"))
 
 # Use gemini-3-pro-image-preview for stitching (column + full 360°)
 _GEMINI_STITCH_MODEL = "gemini-3-pro-image-preview"
@@ -38,13 +49,16 @@ _STATUS_GEN_FAILED    = 3
 def _call_gemini_generate(model: str, api_key: str, payload: dict) -> requests.Response:
     """Single Gemini generateContent call."""
     url = f"{_GOOGLE_BASE}/{model}:generateContent"
-    return requests.post(
-        url,
-        params={"key": api_key},
-        headers={"Content-Type": "application/json"},
-        json=payload,
-        timeout=420,
-    )
+    with stage("gemini.generate"):
+        resp = requests.post(
+            url,
+            params={"key": api_key},
+            headers={"Content-Type": "application/json"},
+            json=payload,
+            timeout=420,
+        )
+        count_http("gemini", resp)
+    return resp
 
 
 # Prompts: pure stitching only, no added content, no duplication
@@ -71,6 +85,19 @@ STITCH_360_PANORAMA_PROMPT = (
     "column width. Preserve full detail and coverage."
 )
 
+# Hybrid mode: the input is already a pose-correct equirect from stitch_equirect.py
+STITCH_SEAM_CLEANUP_PROMPT = (
+    "TASK: Seam cleanup only. This image is already a complete 360° equirectangular panorama "
+    "(2:1) assembled geometrically from overlapping photos of one room. Keep its exact layout, "
+    "framing, horizon and aspect ratio: every wall, window, door and object stays where it is. "
+    "Remove stitching artifacts only: visible seam lines, exposure and color steps between the "
+    "source photos, ghosting and doubled edges, and small breaks in straight lines across seams. "
+    "Fill small black gaps near the top and bottom from the immediately surrounding pixels. "
+    "The left and right edges must continue seamlessly into each other. "
+    "STRICT RULES: Do NOT add, remove, move, restyle or relight any content. Do NOT crop, "
+    "re-project or change the field of view. Output the full panorama at the same 2:1 aspect."
+)
+
 
 # 24-dot layout: 8 columns × 3 rings. App sends row-major: upper(8), center(8), lower(8).
 # Column i = images[i], images[i+8], images[i+16] (top to bottom)
@@ -78,8 +105,9 @@ NUM_COLS = 8
 IMAGES_PER_COL = 3
 
 
-def stitch_panorama_google(images: list[bytes], prompt: str, api_key: str) -> bytes:
+def stitch_panorama_google(images: list[bytes | mmap.mmap], prompt: str, api_key: str) -> bytes:
     """
+    images may be bytes or read-only mmaps of spooled uploads (see uploads.ScratchDir).
     Use Gemini (gemini-3-pro-image-preview) to stitch images into panorama.
     For column: use STITCH_COLUMN_PROMPT. For full 360°: use STITCH_360_PANORAMA_PROMPT.
     """
@@ -121,7 +149,7 @@ def stitch_panorama_google(images: list[bytes], prompt: str, api_key: str) -> by
 
 
 def stitch_photosphere_column_then_full(
-    images: list[bytes],
+    images: list[bytes | mmap.mmap],
     api_key: str,
     *,
     output_dir=None,
@@ -141,7 +169,16 @@ def stitch_photosphere_column_then_full(
             "Use stitch_panorama_google for other counts."
         )
 
-    # Phase 1: stitch each column (3 images top-to-bottom)
+    with span("stitch_photosphere_column_then_full", images=n, panorama_id=save_id or ""):
+        column_panoramas = _stitch_columns(images, api_key, output_dir, save_id)
+        # Phase 2: stitch all columns into 360°
+        print(f"[NanoBanana] Phase 2: stitching {NUM_COLS} columns into 360° panorama")
+        with span("stitch.merge", columns=NUM_COLS):
+            return stitch_panorama_google(column_panoramas, STITCH_360_PANORAMA_PROMPT, api_key)
+
+
+def _stitch_columns(images: list[bytes | mmap.mmap], api_key: str, output_dir, save_id: str | None) -> list[bytes]:
+    """Phase 1: stitch each column (3 images top-to-bottom)."""
     column_panoramas = []
     for col in range(NUM_COLS):
         col_images = [
@@ -150,7 +187,8 @@ def stitch_photosphere_column_then_full(
             images[col + NUM_COLS * 2],  # lower (pitch 45°)
         ]
         print(f"[NanoBanana] Phase 1: stitching column {col + 1}/{NUM_COLS}")
-        col_pano = stitch_panorama_google(col_images, STITCH_COLUMN_PROMPT, api_key)
+        with span("stitch.column", column=col):
+            col_pano = stitch_panorama_google(col_images, STITCH_COLUMN_PROMPT, api_key)
         column_panoramas.append(col_pano)
 
         # Save each stitched column to output folder when output_dir and save_id provided
@@ -160,22 +198,27 @@ def stitch_photosphere_column_then_full(
             col_path = cols_dir / f"{save_id}_column_{col}.jpg"
             col_path.write_bytes(col_pano)
             print(f"[NanoBanana] Saved column {col + 1} to {col_path}")
+    return column_panoramas
+
 
-    # Phase 2: stitch all columns into 360°
-    print(f"[NanoBanana] Phase 2: stitching {NUM_COLS} columns into 360° panorama")
-    return stitch_panorama_google(column_panoramas, STITCH_360_PANORAMA_PROMPT, api_key)
+def refine_stitched_draft(draft_jpeg: bytes | mmap.mmap, api_key: str) -> bytes:
+    """Hybrid stitching: one Gemini call cleans the seams of a local equirect draft."""
+    with span("stitch.refine"):
+        return stitch_panorama_google([draft_jpeg], STITCH_SEAM_CLEANUP_PROMPT, api_key)
 
 
 # ── imgbb upload ──────────────────────────────────────────────────────────────
-def upload_to_imgbb(image_bytes: bytes, api_key: str) -> str:
+def upload_to_imgbb(image_bytes: bytes | mmap.mmap, api_key: str) -> str:
     """Upload raw image bytes to imgbb; return the public image URL."""
     b64 = base64.b64encode(image_bytes).decode()
-    resp = requests.post(
-        _IMGBB_UPLOAD,
-        params={"key": api_key},
-        data={"image": b64},
-        timeout=60,
-    )
+    with stage("imgbb.upload"):
+        resp = requests.post(
+            _IMGBB_UPLOAD,
+            params={"key": api_key},
+            data={"image": b64},
+            timeout=60,
+        )
+        count_http("imgbb", resp)
     resp.raise_for_status()
     body = resp.json()
     if not body.get("success"):
@@ -193,22 +236,24 @@ def submit_staging_task(
     image_size: str = "16:9",
 ) -> str:
     """Submit an IMAGETOIMAGE generation task; return taskId."""
-    resp = requests.post(
-        f"{_NB_BASE}/api/v1/nanobanana/generate",
-        headers={
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-        },
-        json={
-            "type": "IMAGETOIAMGE",   # note: their API spells it this way
-            "prompt": prompt,
-            "imageUrls": [image_url],
-            "numImages": 1,
-            "image_size": image_size,
-            "callBackUrl": _DUMMY_CALLBACK,
-        },
-        timeout=30,
-    )
+    with stage("nanobanana.submit"):
+        resp = requests.post(
+            f"{_NB_BASE}/api/v1/nanobanana/generate",
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json",
+            },
+            json={
+                "type": "IMAGETOIAMGE",   # note: their API spells it this way
+                "prompt": prompt,
+                "imageUrls": [image_url],
+                "numImages": 1,
+                "image_size": image_size,
+                "callBackUrl": _DUMMY_CALLBACK,
+            },
+            timeout=30,
+        )
+        count_http("nanobanana", resp)
     resp.raise_for_status()
     body = resp.json()
     if body.get("code") != 200:
@@ -223,17 +268,19 @@ def poll_staging_task(
     task_id: str,
     api_key: str,
     timeout_s: int = 540,   # 9 min – safely inside the app's 10-min window
-    interval_s: int = 5,
+    interval_s: float = _NB_POLL_INTERVAL_S,
 ) -> str:
     """Poll until the task succeeds; return resultImageUrl."""
     deadline = time.time() + timeout_s
     while time.time() < deadline:
-        resp = requests.get(
-            f"{_NB_BASE}/api/v1/nanobanana/record-info",
-            headers={"Authorization": f"Bearer {api_key}"},
-            params={"taskId": task_id},
-            timeout=30,
-        )
+        with stage("nanobanana.poll"):
+            resp = requests.get(
+                f"{_NB_BASE}/api/v1/nanobanana/record-info",
+                headers={"Authorization": f"Bearer {api_key}"},
+                params={"taskId": task_id},
+                timeout=30,
+            )
+            count_http("nanobanana", resp)
         resp.raise_for_status()
         body = resp.json()
         if body.get("code") != 200:
@@ -259,7 +306,7 @@ def poll_staging_task(
 
 
 # ── Google Gemini staging (image-to-image) ────────────────────────────────────
-def stage_panorama_google(image_bytes: bytes, prompt: str, api_key: str) -> bytes:
+def stage_panorama_google(image_bytes: bytes | mmap.mmap, prompt: str, api_key: str) -> bytes:
     """
     Use Gemini for AI interior staging. No imgbb needed—image sent as base64.
     """
@@ -299,7 +346,7 @@ def stage_panorama_google(image_bytes: bytes, prompt: str, api_key: str) -> byte
 
 # ── Top-level helper ──────────────────────────────────────────────────────────
 def stage_panorama(
-    image_bytes: bytes,
+    image_bytes: bytes | mmap.mmap,
     prompt: str,
     nanobanana_key: str,
     imgbb_key: str,
@@ -308,12 +355,16 @@ def stage_panorama(
     """
     Staging pipeline. Uses Google Gemini if google_key is set; else NanoBanana API.
     """
-    if google_key and google_key.strip():
-        return stage_panorama_google(image_bytes, prompt, google_key.strip())
-    public_url = upload_to_imgbb(image_bytes, imgbb_key)
-    task_id    = submit_staging_task(public_url, prompt, nanobanana_key)
-    result_url = poll_staging_task(task_id, nanobanana_key)
-    print(f"[NanoBanana] downloading result from {result_url}")
-    dl = requests.get(result_url, timeout=60)
-    dl.raise_for_status()
-    return dl.content
+    use_google = bool(google_key and google_key.strip())
+    with span("stage_panorama", backend="gemini" if use_google else "nanobanana", image_bytes=len(image_bytes)):
+        if use_google:
+            return stage_panorama_google(image_bytes, prompt, google_key.strip())
+        public_url = upload_to_imgbb(image_bytes, imgbb_key)
+        task_id    = submit_staging_task(public_url, prompt, nanobanana_key)
+        result_url = poll_staging_task(task_id, nanobanana_key)
+        print(f"[NanoBanana] downloading result from {result_url}")
+        with stage("nanobanana.download"):
+            dl = requests.get(result_url, timeout=60)
+            count_http("nanobanana", dl)
+        dl.raise_for_status()
+        return dl.content
@@ -1,13 +1,176 @@
-"""CRUD helpers for panoramas (Postgres)."""
+"""
+CRUD helpers for panoramas (Postgres).
+
+Every write is a single INSERT … ON CONFLICT DO UPDATE … RETURNING or UPDATE … RETURNING
+statement: one round trip (plus COMMIT), and concurrent upserts of the same id cannot race
+on the insert. Sessions use expire_on_commit=False, so the returned row needs no refresh.
+
+Every write also stamps change_xid with its transaction id. The delta feed
+(list_changed_since) pages on (change_xid, id) and only returns rows written by
+transactions older than every transaction still in progress, so a slow or concurrent
+write can never commit behind a client's sync position. (updated_at comes from the app
+clock when the statement is built and is not commit-ordered.)
+"""
 from __future__ import annotations
 
 from datetime import datetime, timezone
 from typing import Any
 
-from sqlalchemy import select
+from sqlalchemy import BigInteger, Row, Text, case, func, null, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from db_models import Panorama
+from metrics import stage
+from tracing import set_attributes
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _current_xid():
+    """Id of the writing transaction (assigned on first write, so equal for a whole batch)."""
+    return func.pg_current_xact_id().cast(Text).cast(BigInteger)
+
+
+def _oldest_running_xid():
+    """xmin of the current snapshot: every transaction with a lower id has finished."""
+    return func.pg_snapshot_xmin(func.pg_current_snapshot()).cast(Text).cast(BigInteger)
+
+
+def _trace_write(stmt, rows: list[Panorama]) -> None:
+    set_attributes(**{"db.operation": stmt.__visit_name__, "db.rows": len(rows)})
+    if len(rows) == 1:
+        set_attributes(panorama_id=rows[0].id)
+
+
+def _write(db: Session, stmt) -> Panorama | None:
+    """Execute a RETURNING statement, commit, and return the (fresh) row or None."""
+    with stage("db.write"):
+        row = db.scalars(stmt, execution_options={"populate_existing": True}).one_or_none()
+        db.commit()
+        _trace_write(stmt, [row] if row is not None else [])
+    return row
+
+
+def _upsert_after_stitch_stmt(
+    panorama_id: str,
+    stitched_filename: str,
+    title: str | None,
+    device_id: str | None,
+    stitched_sha256: str | None = None,
+    stitch_status: str | None = None,
+):
+    now = _now()
+    ins = pg_insert(Panorama).values(
+        id=panorama_id,
+        title=title or f"Panorama {panorama_id[:8]}",
+        date_display=None,
+        stitched_filename=stitched_filename,
+        stitched_sha256=stitched_sha256,
+        stitch_status=stitch_status,
+        staged_filename=None,
+        staging_prompt_last=None,
+        world3d=null(),
+        created_at=now,
+        updated_at=now,
+        device_id=device_id,
+    )
+    set_ = {
+        "stitched_filename": ins.excluded.stitched_filename,
+        "stitched_sha256": ins.excluded.stitched_sha256,
+        "stitch_status": ins.excluded.stitch_status,
+        "updated_at": ins.excluded.updated_at,
+        "change_xid": _current_xid(),
+    }
+    if device_id:
+        set_["device_id"] = ins.excluded.device_id
+    if title is not None:
+        set_["title"] = ins.excluded.title
+    return ins.on_conflict_do_update(index_elements=[Panorama.id], set_=set_).returning(Panorama)
+
+
+def _update_stmt(panorama_id: str, **values):
+    values["updated_at"] = _now()
+    values["change_xid"] = _current_xid()
+    return update(Panorama).where(Panorama.id == panorama_id).values(**values).returning(Panorama)
+
+
+def _update_after_stage_stmt(
+    panorama_id: str,
+    staged_filename: str,
+    staging_prompt: str | None,
+    staged_sha256: str | None = None,
+):
+    values: dict[str, Any] = {"staged_filename": staged_filename, "staged_sha256": staged_sha256}
+    if staging_prompt is not None:
+        values["staging_prompt_last"] = staging_prompt
+    return _update_stmt(panorama_id, **values)
+
+
+def _patch_metadata_stmt(
+    panorama_id: str,
+    title: str | None,
+    date_display: str | None,
+    device_id: str | None,
+):
+    values: dict[str, Any] = {}
+    if title is not None:
+        values["title"] = title
+    if date_display is not None:
+        values["date_display"] = date_display
+    if device_id is not None:
+        values["device_id"] = device_id
+    return _update_stmt(panorama_id, **values)
+
+
+def _upsert_imported_stmt(items: list[dict[str, Any]]):
+    """
+    Multi-row import upsert. Each item: id, stitched_filename, stitched_sha256, title,
+    date_display, staged_filename, staged_sha256, world3d, device_id. On update, None for
+    staged_filename / world3d / device_id keeps the stored value (world3d None ⇔ "not patched").
+    """
+    now = _now()
+    ins = pg_insert(Panorama).values([
+        {
+            "id": it["id"],
+            "title": it["title"],
+            "date_display": it.get("date_display"),
+            "stitched_filename": it["stitched_filename"],
+            "stitched_sha256": it.get("stitched_sha256"),
+            "staged_filename": it.get("staged_filename"),
+            "staged_sha256": it.get("staged_sha256"),
+            "staging_prompt_last": None,
+            # SQL NULL, not JSON 'null', so COALESCE below keeps the stored value
+            "world3d": it["world3d"] if it.get("world3d") is not None else null(),
+            "created_at": now,
+            "updated_at": now,
+            "device_id": it.get("device_id"),
+        }
+        for it in items
+    ])
+    cur = Panorama.__table__.c
+    return ins.on_conflict_do_update(
+        index_elements=[Panorama.id],
+        set_={
+            "stitched_filename": ins.excluded.stitched_filename,
+            "stitched_sha256": ins.excluded.stitched_sha256,
+            "title": ins.excluded.title,
+            "date_display": ins.excluded.date_display,
+            "updated_at": ins.excluded.updated_at,
+            "staged_filename": func.coalesce(ins.excluded.staged_filename, cur.staged_filename),
+            # Hash follows the filename: only replaced together with it
+            "staged_sha256": case(
+                (ins.excluded.staged_filename.is_(None), cur.staged_sha256),
+                else_=ins.excluded.staged_sha256,
+            ),
+            "world3d": func.coalesce(ins.excluded.world3d, cur.world3d),
+            "device_id": func.coalesce(ins.excluded.device_id, cur.device_id),
+            "change_xid": _current_xid(),
+        },
+    ).returning(Panorama)
 
 
 def upsert_after_stitch(
@@ -17,33 +180,33 @@ def upsert_after_stitch(
     *,
     title: str | None = None,
     device_id: str | None = None,
+    stitched_sha256: str | None = None,
+    stitch_status: str | None = None,
 ) -> Panorama:
-    row = db.get(Panorama, panorama_id)
-    now = datetime.now(timezone.utc)
-    if row:
-        row.stitched_filename = stitched_filename
-        row.updated_at = now
-        if device_id:
-            row.device_id = device_id
-        if title is not None:
-            row.title = title
-    else:
-        row = Panorama(
-            id=panorama_id,
-            title=title or f"Panorama {panorama_id[:8]}",
-            date_display=None,
-            stitched_filename=stitched_filename,
-            staged_filename=None,
-            staging_prompt_last=None,
-            world3d=None,
-            created_at=now,
-            updated_at=now,
-            device_id=device_id,
+    return _write(db, _upsert_after_stitch_stmt(
+        panorama_id, stitched_filename, title, device_id, stitched_sha256, stitch_status,
+    ))
+
+
+def update_stitch_status(db: Session, panorama_id: str, stitch_status: str) -> Panorama | None:
+    return _write(db, _update_stmt(panorama_id, stitch_status=stitch_status))
+
+
+def replace_stitch_status(db: Session, panorama_ids: list[str], old: str, new: str) -> list[Panorama]:
+    """Set stitch_status to new on those of panorama_ids still at old (one UPDATE … RETURNING)."""
+    if not panorama_ids:
+        return []
+    with stage("db.write_batch"):
+        stmt = (
+            update(Panorama)
+            .where(Panorama.id.in_(panorama_ids), Panorama.stitch_status == old)
+            .values(stitch_status=new, updated_at=_now(), change_xid=_current_xid())
+            .returning(Panorama)
         )
-        db.add(row)
-    db.commit()
-    db.refresh(row)
-    return row
+        rows = list(db.scalars(stmt, execution_options={"populate_existing": True}).all())
+        db.commit()
+        _trace_write(stmt, rows)
+    return rows
 
 
 def update_after_stage(
@@ -51,28 +214,14 @@ def update_after_stage(
     panorama_id: str,
     staged_filename: str,
     staging_prompt: str | None = None,
+    *,
+    staged_sha256: str | None = None,
 ) -> Panorama | None:
-    row = db.get(Panorama, panorama_id)
-    if not row:
-        return None
-    row.staged_filename = staged_filename
-    row.updated_at = datetime.now(timezone.utc)
-    if staging_prompt is not None:
-        row.staging_prompt_last = staging_prompt
-    db.commit()
-    db.refresh(row)
-    return row
+    return _write(db, _update_after_stage_stmt(panorama_id, staged_filename, staging_prompt, staged_sha256))
 
 
 def update_world3d(db: Session, panorama_id: str, world3d: dict[str, Any]) -> Panorama | None:
-    row = db.get(Panorama, panorama_id)
-    if not row:
-        return None
-    row.world3d = world3d
-    row.updated_at = datetime.now(timezone.utc)
-    db.commit()
-    db.refresh(row)
-    return row
+    return _write(db, _update_stmt(panorama_id, world3d=world3d))
 
 
 def patch_metadata(
@@ -83,30 +232,100 @@ def patch_metadata(
     date_display: str | None = None,
     device_id: str | None = None,
 ) -> Panorama | None:
-    row = db.get(Panorama, panorama_id)
-    if not row:
-        return None
-    if title is not None:
-        row.title = title
-    if date_display is not None:
-        row.date_display = date_display
+    return _write(db, _patch_metadata_stmt(panorama_id, title, date_display, device_id))
+
+
+def _page(stmt, limit: int, before: tuple[datetime, str] | None, device_id: str | None):
     if device_id is not None:
-        row.device_id = device_id
-    row.updated_at = datetime.now(timezone.utc)
-    db.commit()
-    db.refresh(row)
-    return row
+        stmt = stmt.where(Panorama.device_id == device_id)
+    if before is not None:
+        stmt = stmt.where(tuple_(Panorama.created_at, Panorama.id) < tuple_(*before))
+    return stmt.order_by(Panorama.created_at.desc(), Panorama.id.desc()).limit(limit)
+
+
+def _columns_stmt(columns: list[str], limit: int, before, device_id):
+    table = Panorama.__table__
+    return _page(select(*(table.c[name] for name in columns)), limit, before, device_id)
+
+
+def _changed_since_stmt(after: tuple[int, str] | None, limit: int):
+    # Rows of transactions that may still commit are held back (not skipped) until they have
+    stmt = select(Panorama).where(Panorama.change_xid < _oldest_running_xid())
+    if after is not None:
+        stmt = stmt.where(tuple_(Panorama.change_xid, Panorama.id) > tuple_(*after))
+    return stmt.order_by(Panorama.change_xid.asc(), Panorama.id.asc()).limit(limit)
+
+
+def list_all(
+    db: Session,
+    limit: int = 200,
+    *,
+    before: tuple[datetime, str] | None = None,
+    device_id: str | None = None,
+) -> list[Panorama]:
+    """
+    Newest first, keyset-paginated on (created_at, id): pass the last row's
+    (created_at, id) as `before` to get the next page. Served by the composite indexes.
+    """
+    return list(db.scalars(_page(select(Panorama), limit, before, device_id)).all())
+
+
+def list_columns(
+    db: Session,
+    columns: list[str],
+    limit: int = 200,
+    *,
+    before: tuple[datetime, str] | None = None,
+    device_id: str | None = None,
+) -> list[Row]:
+    """
+    Same paging as list_all, but a Core select of only the named columns: no ORM identity
+    map, and heavy columns (world3d JSONB, staging_prompt_last) are never fetched unless asked for.
+    """
+    return list(db.execute(_columns_stmt(columns, limit, before, device_id)).all())
 
 
-def list_all(db: Session, limit: int = 200) -> list[Panorama]:
-    stmt = select(Panorama).order_by(Panorama.created_at.desc()).limit(limit)
-    return list(db.scalars(stmt).all())
+def list_changed_since(
+    db: Session,
+    after: tuple[int, str] | None,
+    limit: int = 500,
+) -> list[Panorama]:
+    """Rows whose (change_xid, id) is after the client's sync position, in commit order."""
+    return list(db.scalars(_changed_since_stmt(after, limit)).all())
+
+
+def list_ids_with_stitch_status(db: Session, stitch_status: str) -> list[str]:
+    return list(db.scalars(select(Panorama.id).where(Panorama.stitch_status == stitch_status)).all())
 
 
 def get_one(db: Session, panorama_id: str) -> Panorama | None:
     return db.get(Panorama, panorama_id)
 
 
+def _imported_item(
+    panorama_id: str,
+    stitched_filename: str,
+    title: str,
+    date_display: str | None,
+    staged_filename: str | None,
+    world3d: dict[str, Any] | None,
+    device_id: str | None,
+    stitched_sha256: str | None,
+    staged_sha256: str | None,
+) -> dict[str, Any]:
+    return {
+        "id": panorama_id,
+        "stitched_filename": stitched_filename,
+        "stitched_sha256": stitched_sha256,
+        "title": title,
+        "date_display": date_display,
+        "staged_filename": staged_filename,
+        "staged_sha256": staged_sha256,
+        "world3d": world3d,
+        "device_id": device_id,
+    }
+
+
 def upsert_imported_panorama(
     db: Session,
     panorama_id: str,
@@ -118,37 +337,147 @@ def upsert_imported_panorama(
     world3d: dict[str, Any] | None = None,
     patch_world3d: bool = False,
     device_id: str | None = None,
+    stitched_sha256: str | None = None,
+    staged_sha256: str | None = None,
 ) -> Panorama:
     """
     Create or replace a panorama from phone upload (stitched JPEG on disk + DB row).
-    If patch_world3d is False on update, existing world3d JSON is left unchanged.
+    If patch_world3d is False on update, existing world3d JSON is left unchanged; likewise a
+    None staged_filename keeps the stored one.
     """
-    row = db.get(Panorama, panorama_id)
-    now = datetime.now(timezone.utc)
-    if row:
-        row.stitched_filename = stitched_filename
-        row.title = title
-        row.date_display = date_display
-        row.updated_at = now
-        row.staged_filename = staged_filename
-        if patch_world3d:
-            row.world3d = world3d
-        if device_id is not None:
-            row.device_id = device_id
-    else:
-        row = Panorama(
-            id=panorama_id,
-            title=title,
-            date_display=date_display,
-            stitched_filename=stitched_filename,
-            staged_filename=staged_filename,
-            staging_prompt_last=None,
-            world3d=world3d if patch_world3d else None,
-            created_at=now,
-            updated_at=now,
-            device_id=device_id,
-        )
-        db.add(row)
-    db.commit()
-    db.refresh(row)
+    item = _imported_item(
+        panorama_id, stitched_filename, title, date_display, staged_filename,
+        world3d if patch_world3d else None, device_id, stitched_sha256, staged_sha256,
+    )
+    return _write(db, _upsert_imported_stmt([item]))
+
+
+def upsert_imported_panoramas(db: Session, items: list[dict[str, Any]]) -> list[Panorama]:
+    """
+    Batch form of upsert_imported_panorama: all items in one multi-row
+    INSERT … ON CONFLICT … RETURNING (ids must be unique within the batch).
+    Item keys: as for _upsert_imported_stmt.
+    """
+    if not items:
+        return []
+    with stage("db.write_batch"):
+        stmt = _upsert_imported_stmt(items)
+        rows = list(db.scalars(stmt, execution_options={"populate_existing": True}).all())
+        db.commit()
+        _trace_write(stmt, rows)
+    return rows
+
+
+# ── AsyncSession versions (same statements) for the async request handlers ────
+async def _awrite(db: AsyncSession, stmt) -> Panorama | None:
+    with stage("db.write"):
+        row = (await db.scalars(stmt, execution_options={"populate_existing": True})).one_or_none()
+        await db.commit()
+        _trace_write(stmt, [row] if row is not None else [])
     return row
+
+
+async def upsert_after_stitch_async(
+    db: AsyncSession,
+    panorama_id: str,
+    stitched_filename: str,
+    *,
+    title: str | None = None,
+    device_id: str | None = None,
+    stitched_sha256: str | None = None,
+    stitch_status: str | None = None,
+) -> Panorama:
+    return await _awrite(db, _upsert_after_stitch_stmt(
+        panorama_id, stitched_filename, title, device_id, stitched_sha256, stitch_status,
+    ))
+
+
+async def update_after_stage_async(
+    db: AsyncSession,
+    panorama_id: str,
+    staged_filename: str,
+    staging_prompt: str | None = None,
+    *,
+    staged_sha256: str | None = None,
+) -> Panorama | None:
+    return await _awrite(db, _update_after_stage_stmt(panorama_id, staged_filename, staging_prompt, staged_sha256))
+
+
+async def update_world3d_async(db: AsyncSession, panorama_id: str, world3d: dict[str, Any]) -> Panorama | None:
+    return await _awrite(db, _update_stmt(panorama_id, world3d=world3d))
+
+
+async def patch_metadata_async(
+    db: AsyncSession,
+    panorama_id: str,
+    *,
+    title: str | None = None,
+    date_display: str | None = None,
+    device_id: str | None = None,
+) -> Panorama | None:
+    return await _awrite(db, _patch_metadata_stmt(panorama_id, title, date_display, device_id))
+
+
+async def list_all_async(
+    db: AsyncSession,
+    limit: int = 200,
+    *,
+    before: tuple[datetime, str] | None = None,
+    device_id: str | None = None,
+) -> list[Panorama]:
+    return list((await db.scalars(_page(select(Panorama), limit, before, device_id))).all())
+
+
+async def list_columns_async(
+    db: AsyncSession,
+    columns: list[str],
+    limit: int = 200,
+    *,
+    before: tuple[datetime, str] | None = None,
+    device_id: str | None = None,
+) -> list[Row]:
+    return list((await db.execute(_columns_stmt(columns, limit, before, device_id))).all())
+
+
+async def list_changed_since_async(
+    db: AsyncSession,
+    after: tuple[int, str] | None,
+    limit: int = 500,
+) -> list[Panorama]:
+    return list((await db.scalars(_changed_since_stmt(after, limit))).all())
+
+
+async def get_one_async(db: AsyncSession, panorama_id: str) -> Panorama | None:
+    return await db.get(Panorama, panorama_id)
+
+
+async def upsert_imported_panorama_async(
+    db: AsyncSession,
+    panorama_id: str,
+    stitched_filename: str,
+    *,
+    title: str,
+    date_display: str | None,
+    staged_filename: str | None,
+    world3d: dict[str, Any] | None = None,
+    patch_world3d: bool = False,
+    device_id: str | None = None,
+    stitched_sha256: str | None = None,
+    staged_sha256: str | None = None,
+) -> Panorama:
+    item = _imported_item(
+        panorama_id, stitched_filename, title, date_display, staged_filename,
+        world3d if patch_world3d else None, device_id, stitched_sha256, staged_sha256,
+    )
+    return await _awrite(db, _upsert_imported_stmt([item]))
+
+
+async def upsert_imported_panoramas_async(db: AsyncSession, items: list[dict[str, Any]]) -> list[Panorama]:
+    if not items:
+        return []
+    with stage("db.write_batch"):
+        stmt = _upsert_imported_stmt(items)
+        rows = list((await db.scalars(stmt, execution_options={"populate_existing": True})).all())
+        await db.commit()
+        _trace_write(stmt, rows)
+    return rows
@@ -1,27 +1,101 @@
 """REST API for panoramas stored in PostgreSQL."""
 from __future__ import annotations
 
+import asyncio
+import base64
 import json
+import logging
 import os
 import re
+import time
+from collections import OrderedDict
+from datetime import datetime
 from pathlib import Path
 
-from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
+try:
+    import orjson
+except ImportError:
+    orjson = None  # optional – falls back to the stdlib json encoder
 
-from database import SessionLocal, engine, get_db
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, Request, Response, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.exc import SQLAlchemyError
+from starlette.datastructures import FormData
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from blobstore import BlobStore
+from database import get_async_db
 from db_models import Panorama
-from panorama_db import get_one, list_all, patch_metadata, upsert_imported_panorama
-from schemas_panorama import PanoramaOut, PanoramaPatch
+from http_cache import cached_file_response
+from panorama_db import (
+    get_one_async,
+    list_all_async,
+    list_changed_since_async,
+    list_columns_async,
+    patch_metadata_async,
+    upsert_imported_panorama_async,
+    upsert_imported_panoramas_async,
+)
+from retention import FileIndex
+from schemas_panorama import (
+    PanoramaBatchImportOut,
+    PanoramaChanges,
+    PanoramaImportResult,
+    PanoramaOut,
+    PanoramaPatch,
+)
+from tiles import FACES, TilePyramids
+from uploads import MAX_BATCH_UPLOAD_BYTES, ScratchDir, read_form
+from variants import DEFAULT_QUALITY, THUMBNAIL_WIDTH, VariantCache, media_type_for
+
+log = logging.getLogger("uvicorn.error")
 
 OUTPUT_DIR = Path(
     os.environ.get("PANORAMA_OUTPUT_DIR", str(Path(__file__).parent / "output"))
 )
 
+file_index = FileIndex(OUTPUT_DIR)
+blob_store = BlobStore(OUTPUT_DIR, index=file_index)
+variant_cache = VariantCache(OUTPUT_DIR, index=file_index)
+tile_pyramids = TilePyramids(OUTPUT_DIR, index=file_index)
+
+# id → (filename, version) lookups for the image routes, so repeat (conditional) GETs skip the
+# database. Only hits are cached. A row's file changes on every new stitch / stage / import
+# (content-addressed blobs), and writes only invalidate this cache in their own process: a
+# request whose ?v= differs from the cached version is therefore resolved from the database
+# again, so another worker's write is never served under its new URL from a stale entry.
+_FILE_CACHE_TTL_S = float(os.environ.get("PANORAMA_FILE_CACHE_TTL", "30"))
+_FILE_CACHE_MAX = 4096
+_file_cache: OrderedDict[tuple[str, str], tuple[float, str, str]] = OrderedDict()
+
+
+def invalidate_file_cache(panorama_id: str) -> None:
+    for kind in ("image", "staged"):
+        _file_cache.pop((panorama_id, kind), None)
+
+
+def _cached_filename(panorama_id: str, kind: str) -> tuple[str, str] | None:
+    """(filename, version) from the cache, or None."""
+    hit = _file_cache.get((panorama_id, kind))
+    if hit is None:
+        return None
+    expires, filename, version = hit
+    if expires < time.monotonic():
+        _file_cache.pop((panorama_id, kind), None)
+        return None
+    _file_cache.move_to_end((panorama_id, kind))
+    return filename, version
+
+
+def _remember_filename(panorama_id: str, kind: str, filename: str, version: str) -> None:
+    _file_cache[(panorama_id, kind)] = (time.monotonic() + _FILE_CACHE_TTL_S, filename, version)
+    _file_cache.move_to_end((panorama_id, kind))
+    while len(_file_cache) > _FILE_CACHE_MAX:
+        _file_cache.popitem(last=False)
+
 
-def _require_db(db: Session | None) -> Session:
-    if db is None or SessionLocal is None or engine is None:
+def _require_db(db: AsyncSession | None) -> AsyncSession:
+    if db is None:
         raise HTTPException(
             status_code=503,
             detail="Database not configured. Set DATABASE_URL in backend/.env and restart.",
@@ -29,26 +103,183 @@ def _require_db(db: Session | None) -> Session:
     return db
 
 
-def _row_to_out(row: Panorama, base_url: str) -> PanoramaOut:
+def _file_version(sha256: str | None, updated_at: datetime | None) -> str:
+    """?v= of an image URL: content hash prefix; legacy rows without one: last write in µs."""
+    if sha256:
+        return sha256[:16]
+    return f"{round(updated_at.timestamp() * 1_000_000):x}" if updated_at else "0"
+
+
+def _image_urls(row, base_url: str) -> dict[str, str | None]:
+    """URL fields of PanoramaOut; row needs id, updated_at, staged_filename and the sha256 columns."""
     base = base_url.rstrip("/")
-    image_url = f"{base}/panoramas/{row.id}/image"
-    staged_url = f"{base}/panoramas/{row.id}/staged" if row.staged_filename else None
+    # ?v= changes whenever the file does, so image responses requested with the current
+    # version can be cached as immutable
+    image_url = f"{base}/panoramas/{row.id}/image?v={_file_version(row.stitched_sha256, row.updated_at)}"
+    staged_url = (
+        f"{base}/panoramas/{row.id}/staged?v={_file_version(row.staged_sha256, row.updated_at)}"
+        if row.staged_filename else None
+    )
+    thumb = f"&w={THUMBNAIL_WIDTH}"
+    return {
+        "image_url": image_url,
+        "staged_image_url": staged_url,
+        "thumbnail_url": image_url + thumb,
+        "staged_thumbnail_url": staged_url + thumb if staged_url else None,
+    }
+
+
+def _row_to_out(row: Panorama, base_url: str) -> PanoramaOut:
     return PanoramaOut(
         id=row.id,
         title=row.title,
         date_display=row.date_display,
         stitched_filename=row.stitched_filename,
         staged_filename=row.staged_filename,
+        stitched_sha256=row.stitched_sha256,
+        staged_sha256=row.staged_sha256,
+        stitch_status=row.stitch_status,
         staging_prompt_last=row.staging_prompt_last,
         world3d=row.world3d,
         created_at=row.created_at,
         updated_at=row.updated_at,
         device_id=row.device_id,
-        image_url=image_url,
-        staged_image_url=staged_url,
+        **_image_urls(row, base_url),
     )
 
 
+# GET /panoramas?fields=…: "summary" preset or a comma list of PanoramaOut field names
+_SUMMARY_FIELDS = (
+    "id", "title", "date_display", "updated_at",
+    "image_url", "staged_image_url", "thumbnail_url", "staged_thumbnail_url",
+)
+_URL_FIELDS = ("image_url", "staged_image_url", "thumbnail_url", "staged_thumbnail_url")
+
+
+def _parse_fields(fields: str) -> tuple[str, ...]:
+    if fields == "summary":
+        return _SUMMARY_FIELDS
+    wanted = tuple(f.strip() for f in fields.split(",") if f.strip())
+    unknown = [f for f in wanted if f not in PanoramaOut.model_fields]
+    if unknown or not wanted:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown) or '(none)'}")
+    return wanted
+
+
+def _columns_for(fields: tuple[str, ...]) -> list[str]:
+    """DB columns needed to produce fields (plus the keyset columns for the next cursor)."""
+    cols = {"id", "created_at"}
+    for f in fields:
+        if f in _URL_FIELDS:
+            cols.update(("updated_at", "staged_filename", "stitched_sha256", "staged_sha256"))
+        else:
+            cols.add(f)
+    return sorted(cols)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat().replace("+00:00", "Z")
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def _dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_UTC_Z)
+    return json.dumps(obj, default=_json_default, separators=(",", ":")).encode()
+
+
+async def _resolve_file(
+    db: AsyncSession | None, panorama_id: str, kind: str, requested: str | None = None, *, fresh: bool = False,
+) -> tuple[Path, str]:
+    """(path, current ?v= version) of the stitched ("image") or staged file for a panorama;
+    404 if the row or file is missing. A cached entry is bypassed when fresh is set or when
+    the requested version (the URL's ?v=) is not the cached one."""
+    hit = None if fresh else _cached_filename(panorama_id, kind)
+    if hit is not None and requested is not None and requested != hit[1]:
+        hit = None
+    if hit is None:
+        s = _require_db(db)
+        row = await get_one_async(s, panorama_id)
+        if not row:
+            raise HTTPException(status_code=404, detail="Panorama not found")
+        if kind == "image":
+            filename, version = row.stitched_filename, _file_version(row.stitched_sha256, row.updated_at)
+        else:
+            filename, version = row.staged_filename, _file_version(row.staged_sha256, row.updated_at)
+        if not filename:
+            raise HTTPException(status_code=404, detail="Staged image not found")
+        _remember_filename(panorama_id, kind, filename, version)
+    else:
+        filename, version = hit
+    path = OUTPUT_DIR / filename
+    if not path.is_file():
+        label = "Stitched" if kind == "image" else "Staged"
+        raise HTTPException(status_code=404, detail=f"{label} image file missing on server")
+    return path, version
+
+
+def _serve_image(request: Request, path: Path, version: str, w: int | None, q: int, fmt: str):
+    """Original file, or a resized / re-encoded variant from the disk cache when w or fmt is set."""
+    if w is None and fmt == "jpeg":
+        sha256 = blob_store.sha256_of(path)
+        return cached_file_response(request, path, etag=f'"{sha256}"' if sha256 else None, version=version)
+    variant = variant_cache.get(path, w, q, fmt)
+    if variant is None:
+        raise HTTPException(status_code=422, detail="Image could not be decoded for resizing")
+    return cached_file_response(request, variant, media_type=media_type_for(fmt), version=version)
+
+
+def _encode_cursor(ts: datetime, panorama_id: str) -> str:
+    """Opaque keyset cursor for (timestamp, id)."""
+    raw = json.dumps([ts.isoformat(), panorama_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(token: str) -> tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        ts, panorama_id = json.loads(raw)
+        return datetime.fromisoformat(ts), str(panorama_id)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {e}") from e
+
+
+def _encode_sync_token(change_xid: int, panorama_id: str) -> str:
+    """Opaque delta-sync position (change_xid, id)."""
+    raw = json.dumps([change_xid, panorama_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_sync_token(token: str) -> tuple[int, str] | None:
+    """None for tokens issued before the feed was commit-ordered ((updated_at, id)): full sync."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        position, panorama_id = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid sync token: {e}") from e
+    if isinstance(position, str):
+        return None
+    if not isinstance(position, int):
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+    return position, str(panorama_id)
+
+
+def _item_text(item: dict, key: str) -> str | None:
+    """Optional string field of a batch-import item, stripped (None if empty); ValueError if it
+    is not a string or does not fit its Panorama column."""
+    value = item.get(key)
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f"{key} must be a string")
+    value = value.strip()
+    max_len = Panorama.__table__.c[key].type.length
+    if len(value) > max_len:
+        raise ValueError(f"{key} is longer than {max_len} characters")
+    return value or None
+
+
 _SAFE_PANORAMA_ID = re.compile(r"^[a-zA-Z0-9._-]{1,64}$")
 
 
@@ -63,11 +294,12 @@ def build_router(public_base_url: str) -> APIRouter:
         world3d_json: str | None = Form(None, description="JSON string; same shape as app World3DMeta (camelCase)"),
         image: UploadFile = File(..., description="Stitched panorama JPEG"),
         staged_image: UploadFile | None = File(None, description="Optional AI-staged JPEG"),
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_async_db),
     ):
         """
         Upload local panorama file(s) from the phone and upsert a database row.
-        Saves under output/ as panorama_{id}.jpg and optionally staged_{id}.jpg.
+        Spools uploads to a scratch dir, then moves them into the content-addressed blob store
+        (an upload identical to a stored file is not written again).
         """
         pid = panorama_id.strip()
         if not _SAFE_PANORAMA_ID.match(pid):
@@ -77,26 +309,16 @@ def build_router(public_base_url: str) -> APIRouter:
             )
 
         s = _require_db(db)
-        existing = get_one(s, pid)
-
-        img_bytes = await image.read()
-        if not img_bytes:
-            raise HTTPException(status_code=400, detail="Stitched image is empty")
-
-        stitched_name = f"panorama_{pid}.jpg"
-        path_stitched = OUTPUT_DIR / stitched_name
-        path_stitched.write_bytes(img_bytes)
-
-        staged_fn: str | None = None
-        if staged_image is not None:
-            sb = await staged_image.read()
-            if len(sb) > 0:
-                staged_fn = f"staged_{pid}.jpg"
-                (OUTPUT_DIR / staged_fn).write_bytes(sb)
-            elif existing and existing.staged_filename:
-                staged_fn = existing.staged_filename
-        elif existing and existing.staged_filename:
-            staged_fn = existing.staged_filename
+
+        with ScratchDir(OUTPUT_DIR) as scratch:
+            stitched_upload = await scratch.spool(image, "stitched.jpg")
+            if stitched_upload.size == 0:
+                raise HTTPException(status_code=400, detail="Stitched image is empty")
+            staged_upload = await scratch.spool(staged_image, "staged.jpg") if staged_image is not None else None
+
+            stitched = blob_store.put_spooled(stitched_upload)
+            # None keeps the staged file already linked to the row (if any)
+            staged = blob_store.put_spooled(staged_upload) if staged_upload and staged_upload.size else None
 
         world3d: dict | None = None
         patch_world3d = False
@@ -110,36 +332,208 @@ def build_router(public_base_url: str) -> APIRouter:
             except (json.JSONDecodeError, ValueError) as e:
                 raise HTTPException(status_code=400, detail=f"Invalid world3d_json: {e}") from e
 
-        row = upsert_imported_panorama(
+        row = await upsert_imported_panorama_async(
             s,
             pid,
-            stitched_name,
+            stitched.filename,
             title=title.strip() or f"Panorama {pid[:8]}",
             date_display=date_display.strip() if date_display else None,
-            staged_filename=staged_fn,
+            staged_filename=staged.filename if staged else None,
             world3d=world3d,
             patch_world3d=patch_world3d,
+            stitched_sha256=stitched.sha256,
+            staged_sha256=staged.sha256 if staged else None,
         )
+        invalidate_file_cache(pid)
         return _row_to_out(row, public_base_url)
 
+    @router.post("/import:batch", response_model=PanoramaBatchImportOut)
+    async def import_panoramas_batch(request: Request, db: AsyncSession = Depends(get_async_db)):
+        """
+        Many panoramas in one multipart request (backup restore / migration).
+
+        Form fields:
+          manifest_json – JSON array of {panorama_id, title, date_display?, world3d?, device_id?,
+                          image: "<file part name>", staged_image?: "<file part name>"}
+          <part names>  – the JPEG files referenced by the manifest
+
+        Files are spooled and moved into place concurrently, then all rows are upserted in a
+        single INSERT … ON CONFLICT statement. Failures are reported per item; the rest still import.
+        """
+        s = _require_db(db)
+        form = await read_form(request, MAX_BATCH_UPLOAD_BYTES, max_files=5000, max_fields=5000)
+        try:
+            return await _import_batch(s, form)
+        finally:
+            await form.close()
+
+    async def _import_batch(s: AsyncSession, form: FormData) -> PanoramaBatchImportOut:
+        try:
+            manifest = json.loads(form.get("manifest_json") or "")
+            if not isinstance(manifest, list):
+                raise ValueError("not an array")
+        except (json.JSONDecodeError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid manifest_json: {e}") from e
+
+        results: list[PanoramaImportResult] = []
+        # Last occurrence of an id wins; ON CONFLICT cannot touch one row twice per statement
+        last_index = {
+            str(it.get("panorama_id", "")).strip(): i for i, it in enumerate(manifest) if isinstance(it, dict)
+        }
+
+        async def ingest(i: int, item, scratch: ScratchDir) -> dict:
+            if not isinstance(item, dict):
+                raise ValueError("manifest item is not an object")
+            pid = str(item.get("panorama_id", "")).strip()
+            if not _SAFE_PANORAMA_ID.match(pid):
+                raise ValueError("invalid panorama_id")
+            if last_index.get(pid) != i:
+                raise ValueError("superseded by a later item with the same panorama_id")
+            world3d = item.get("world3d")
+            if world3d is not None and not isinstance(world3d, dict):
+                raise ValueError("world3d must be an object")
+            # Checked before any file is adopted: one bad value would fail the whole batch upsert
+            title = _item_text(item, "title")
+            date_display = _item_text(item, "date_display")
+            device_id = _item_text(item, "device_id")
+            image = form.get(item.get("image") or "")
+            if image is None or isinstance(image, str):
+                raise ValueError(f"missing image part {item.get('image')!r}")
+            staged = form.get(item["staged_image"]) if item.get("staged_image") else None
+            if isinstance(staged, str):
+                raise ValueError(f"staged_image part {item['staged_image']!r} is not a file")
+
+            stitched_upload = await scratch.spool(image, f"{pid}_stitched.jpg")
+            if stitched_upload.size == 0:
+                raise ValueError("stitched image is empty")
+            staged_upload = await scratch.spool(staged, f"{pid}_staged.jpg") if staged is not None else None
+
+            stitched = blob_store.put_spooled(stitched_upload)
+            staged_blob = blob_store.put_spooled(staged_upload) if staged_upload and staged_upload.size else None
+            return {
+                "id": pid,
+                "stitched_filename": stitched.filename,
+                "stitched_sha256": stitched.sha256,
+                "title": title or f"Panorama {pid[:8]}",
+                "date_display": date_display,
+                "staged_filename": staged_blob.filename if staged_blob else None,
+                "staged_sha256": staged_blob.sha256 if staged_blob else None,
+                "world3d": world3d,
+                "device_id": device_id,
+            }
+
+        with ScratchDir(OUTPUT_DIR, max_total_bytes=MAX_BATCH_UPLOAD_BYTES) as scratch:
+            outcomes = await asyncio.gather(
+                *(ingest(i, item, scratch) for i, item in enumerate(manifest)),
+                return_exceptions=True,
+            )
+
+        ok_items = [o for o in outcomes if isinstance(o, dict)]
+        try:
+            rows = {r.id: r for r in await upsert_imported_panoramas_async(s, ok_items)}
+        except SQLAlchemyError as e:
+            # Blobs adopted for these items stay unreferenced; the orphan GC removes them
+            log.warning("Batch import upsert of %d panoramas failed: %s", len(ok_items), e)
+            await s.rollback()
+            upsert_error = f"database write failed ({type(e).__name__}); retry the item"
+            outcomes = [ValueError(upsert_error) if isinstance(o, dict) else o for o in outcomes]
+            ok_items = []
+        for item, outcome in zip(manifest, outcomes):
+            pid = str(item.get("panorama_id", "")) if isinstance(item, dict) else ""
+            if isinstance(outcome, dict):
+                invalidate_file_cache(outcome["id"])
+                results.append(PanoramaImportResult(
+                    panorama_id=outcome["id"], ok=True, panorama=_row_to_out(rows[outcome["id"]], public_base_url),
+                ))
+            else:
+                error = outcome.detail if isinstance(outcome, HTTPException) else str(outcome)
+                results.append(PanoramaImportResult(panorama_id=pid, ok=False, error=error))
+        return PanoramaBatchImportOut(
+            imported=len(ok_items),
+            failed=len(results) - len(ok_items),
+            results=results,
+        )
+
     @router.get("", response_model=list[PanoramaOut])
-    def list_panoramas(db: Session = Depends(get_db)):
+    async def list_panoramas(
+        request: Request,
+        response: Response,
+        limit: int = Query(200, ge=1, le=500),
+        cursor: str | None = Query(None, description="X-Next-Cursor from the previous page"),
+        device_id: str | None = Query(None),
+        fields: str | None = Query(
+            None,
+            description="'summary' or comma-separated field names; selects only those columns and skips model validation",
+        ),
+        db: AsyncSession = Depends(get_async_db),
+    ):
+        """
+        Newest first. When more rows exist, the next page's cursor is returned in the
+        X-Next-Cursor header (and a Link rel="next" header).
+        """
         s = _require_db(db)
-        rows = list_all(s)
-        return [_row_to_out(r, public_base_url) for r in rows]
+        before = _decode_cursor(cursor) if cursor else None
+        wanted = _parse_fields(fields) if fields else None
+        if wanted is None:
+            rows = await list_all_async(s, limit + 1, before=before, device_id=device_id)
+        else:
+            rows = await list_columns_async(s, _columns_for(wanted), limit + 1, before=before, device_id=device_id)
+
+        headers: dict[str, str] = {}
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _encode_cursor(rows[-1].created_at, rows[-1].id)
+            headers["X-Next-Cursor"] = next_cursor
+            next_url = request.url.include_query_params(cursor=next_cursor)
+            headers["Link"] = f'<{next_url}>; rel="next"'
+
+        if wanted is None:
+            response.headers.update(headers)
+            return [_row_to_out(r, public_base_url) for r in rows]
+
+        # Projection path: plain dicts serialized once, bypassing PanoramaOut + response_model
+        out = []
+        for r in rows:
+            d = r._asdict()
+            if any(f in _URL_FIELDS for f in wanted):
+                d.update(_image_urls(r, public_base_url))
+            out.append({f: d[f] for f in wanted})
+        return Response(content=_dumps(out), media_type="application/json", headers=headers)
+
+    @router.get("/changes", response_model=PanoramaChanges, response_model_exclude_none=True)
+    async def list_changes(
+        since: str | None = Query(None, description="sync_token from the previous response; omit for a full sync"),
+        limit: int = Query(500, ge=1, le=2000),
+        db: AsyncSession = Depends(get_async_db),
+    ):
+        """
+        Delta sync for the app's local store: only rows written after `since`, in commit order.
+        Keep calling with the returned sync_token while has_more is true.
+        """
+        s = _require_db(db)
+        after = _decode_sync_token(since) if since else None
+        rows = await list_changed_since_async(s, after, limit + 1)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        token = _encode_sync_token(rows[-1].change_xid, rows[-1].id) if rows else since
+        return PanoramaChanges(
+            changes=[_row_to_out(r, public_base_url) for r in rows],
+            sync_token=token,
+            has_more=has_more,
+        )
 
     @router.get("/{panorama_id}", response_model=PanoramaOut)
-    def get_panorama(panorama_id: str, db: Session = Depends(get_db)):
+    async def get_panorama(panorama_id: str, db: AsyncSession = Depends(get_async_db)):
         s = _require_db(db)
-        row = get_one(s, panorama_id)
+        row = await get_one_async(s, panorama_id)
         if not row:
             raise HTTPException(status_code=404, detail="Panorama not found")
         return _row_to_out(row, public_base_url)
 
     @router.patch("/{panorama_id}", response_model=PanoramaOut)
-    def patch_panorama(panorama_id: str, body: PanoramaPatch, db: Session = Depends(get_db)):
+    async def patch_panorama(panorama_id: str, body: PanoramaPatch, db: AsyncSession = Depends(get_async_db)):
         s = _require_db(db)
-        row = patch_metadata(
+        row = await patch_metadata_async(
             s,
             panorama_id,
             title=body.title,
@@ -151,25 +545,69 @@ def build_router(public_base_url: str) -> APIRouter:
         return _row_to_out(row, public_base_url)
 
     @router.get("/{panorama_id}/image")
-    def get_stitched_file(panorama_id: str, db: Session = Depends(get_db)):
-        s = _require_db(db)
-        row = get_one(s, panorama_id)
-        if not row:
-            raise HTTPException(status_code=404, detail="Panorama not found")
-        path = OUTPUT_DIR / row.stitched_filename
-        if not path.is_file():
-            raise HTTPException(status_code=404, detail="Stitched image file missing on server")
-        return FileResponse(path, media_type="image/jpeg")
+    async def get_stitched_file(
+        panorama_id: str,
+        request: Request,
+        w: int | None = Query(None, ge=16, le=8192, description="Resize to this width (keeps aspect)"),
+        q: int = Query(DEFAULT_QUALITY, ge=30, le=95, description="Encoder quality for resized variants"),
+        fmt: str = Query("jpeg", pattern="^(jpeg|webp)$"),
+        db: AsyncSession = Depends(get_async_db),
+    ):
+        path, version = await _resolve_file(db, panorama_id, "image", request.query_params.get("v"))
+        return await run_in_threadpool(_serve_image, request, path, version, w, q, fmt)
 
     @router.get("/{panorama_id}/staged")
-    def get_staged_file(panorama_id: str, db: Session = Depends(get_db)):
-        s = _require_db(db)
-        row = get_one(s, panorama_id)
-        if not row or not row.staged_filename:
-            raise HTTPException(status_code=404, detail="Staged image not found")
-        path = OUTPUT_DIR / row.staged_filename
-        if not path.is_file():
-            raise HTTPException(status_code=404, detail="Staged image file missing on server")
-        return FileResponse(path, media_type="image/jpeg")
+    async def get_staged_file(
+        panorama_id: str,
+        request: Request,
+        w: int | None = Query(None, ge=16, le=8192, description="Resize to this width (keeps aspect)"),
+        q: int = Query(DEFAULT_QUALITY, ge=30, le=95, description="Encoder quality for resized variants"),
+        fmt: str = Query("jpeg", pattern="^(jpeg|webp)$"),
+        db: AsyncSession = Depends(get_async_db),
+    ):
+        path, version = await _resolve_file(db, panorama_id, "staged", request.query_params.get("v"))
+        return await run_in_threadpool(_serve_image, request, path, version, w, q, fmt)
+
+    @router.get("/{panorama_id}/tiles")
+    async def get_tile_manifest(
+        panorama_id: str,
+        source: str = Query("image", pattern="^(image|staged)$"),
+        db: AsyncSession = Depends(get_async_db),
+    ):
+        """Cubemap tile pyramid manifest (built on first request if the post-stitch stage has not run)."""
+        path, _ = await _resolve_file(db, panorama_id, source)
+        manifest = await run_in_threadpool(tile_pyramids.manifest, path)
+        if manifest is None:
+            raise HTTPException(status_code=422, detail="Image could not be decoded for tiling")
+        base = public_base_url.rstrip("/")
+        manifest["tile_url_template"] = (
+            f"{base}/panoramas/{panorama_id}/tiles/{{level}}/{{face}}/{{x}}_{{y}}.jpg"
+            f"?source={source}&v={manifest['version']}"
+        )
+        return manifest
+
+    @router.get("/{panorama_id}/tiles/{level}/{face}/{x}_{y}.jpg")
+    async def get_tile(
+        panorama_id: str,
+        level: int,
+        face: str,
+        x: int,
+        y: int,
+        request: Request,
+        source: str = Query("image", pattern="^(image|staged)$"),
+        db: AsyncSession = Depends(get_async_db),
+    ):
+        if face not in FACES:
+            raise HTTPException(status_code=404, detail="Unknown cube face")
+        path, _ = await _resolve_file(db, panorama_id, source)
+        requested = request.query_params.get("v")
+        if requested and requested != TilePyramids.version(tile_pyramids.pyramid_dir(path)):
+            # Tile URL of a newer file than the cached entry points at (written by another worker)
+            path, _ = await _resolve_file(db, panorama_id, source, fresh=True)
+        tile = await run_in_threadpool(tile_pyramids.tile_path, path, level, face, x, y)
+        if tile is None:
+            raise HTTPException(status_code=404, detail="Tile not found")
+        # Tiles are immutable under their pyramid's version (the source file identity)
+        return cached_file_response(request, tile, version=TilePyramids.version(tile.parents[2]))
 
     return router
@@ -0,0 +1,334 @@
+"""
+Retention / garbage collection for PANORAMA_OUTPUT_DIR.
+
+What accumulates there:
+  columns/<id>_column_<n>.jpg   – intermediate column stitches (debug output of /stitch)
+  jobs/<id>/                    – captures kept for a background full stitch (/stitch preview);
+                                  removed when it finishes, expired like columns otherwise
+                                  (the job was lost, e.g. to a restart: its row is marked failed)
+  blobs/…, panorama_*.jpg, staged_*.jpg
+                                – panorama JPEGs; unreferenced once no Panorama row points at
+                                  them (e.g. /stage without panorama_id, replaced imports)
+  variants/…, tiles/<pyramid>/  – derived caches, rebuilt on demand
+
+Writers record each file in a small SQLite index (<OUTPUT_DIR>/.file_index.sqlite) as they
+create it, so a GC pass selects candidates with indexed queries instead of walking the
+tree. The output directory is scanned once, to seed an empty index (first run / upgrade).
+Each pass handles at most GC_BATCH entries per rule and runs in a worker thread on
+GC_INTERVAL_S.
+
+Environment variables:
+  GC_INTERVAL_S        – seconds between passes (default 300; 0 disables the background GC)
+  GC_BATCH             – max files examined per rule per pass (default 500)
+  GC_COLUMNS_MAX_AGE_S – age after which intermediate columns are deleted (default 1 day)
+  GC_ORPHAN_MAX_AGE_S  – grace period before unreferenced panorama files are deleted (default 1 day)
+  GC_CACHE_MAX_AGE_S   – variants / tile pyramids unused this long are deleted (default 30 days)
+  GC_CACHE_MAX_BYTES   – byte budget for variants + tile pyramids together (default 2 GB)
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable
+from pathlib import Path
+
+from sqlalchemy import or_, select
+
+GC_INTERVAL_S = float(os.environ.get("GC_INTERVAL_S", "300"))
+GC_BATCH = int(os.environ.get("GC_BATCH", "500"))
+GC_COLUMNS_MAX_AGE_S = float(os.environ.get("GC_COLUMNS_MAX_AGE_S", str(24 * 3600)))
+GC_ORPHAN_MAX_AGE_S = float(os.environ.get("GC_ORPHAN_MAX_AGE_S", str(24 * 3600)))
+GC_CACHE_MAX_AGE_S = float(os.environ.get("GC_CACHE_MAX_AGE_S", str(30 * 24 * 3600)))
+GC_CACHE_MAX_BYTES = int(os.environ.get("GC_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+# Index kinds
+COLUMN = "column"
+PANORAMA = "panorama"  # blob or legacy panorama_*/staged_* file referenced by rows
+VARIANT = "variant"
+TILES = "tiles"  # one entry per pyramid directory
+_CACHE_KINDS = (VARIANT, TILES)
+
+# Cache hits update an entry's last_access at most this often (GC ages are days, not minutes)
+_TOUCH_INTERVAL_S = 600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path        TEXT PRIMARY KEY,  -- relative to OUTPUT_DIR
+    kind        TEXT NOT NULL,
+    size        INTEGER NOT NULL,
+    created     REAL NOT NULL,
+    last_access REAL NOT NULL,
+    checked     REAL NOT NULL DEFAULT 0  -- last orphan check (PANORAMA only)
+);
+CREATE INDEX IF NOT EXISTS ix_files_kind_created ON files (kind, created);
+CREATE INDEX IF NOT EXISTS ix_files_kind_access ON files (kind, last_access);
+CREATE INDEX IF NOT EXISTS ix_files_kind_checked ON files (kind, checked);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def _tree_size(path: Path) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.stat(os.path.join(dirpath, name)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+class FileIndex:
+    """SQLite index of files written under OUTPUT_DIR; safe to call from any thread."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # path → when its last hit was written by touch()
+        self._touched: dict[str, float] = {}
+        self._conn = sqlite3.connect(self.root / ".file_index.sqlite", check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def _rel(self, path: Path) -> str:
+        return Path(path).relative_to(self.root).as_posix()
+
+    def record(self, path: Path, kind: str, size: int | None = None, *, referenced: bool = False) -> None:
+        """Add or refresh one entry (size defaults to the file's size). referenced=True marks a
+        new reference to an existing file (a blob dedup hit): its orphan grace period restarts
+        from now. The file itself is never touched; derived caches are keyed on its mtime."""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return
+        now = time.time()
+        created_on_conflict = ", created = excluded.created" if referenced else ""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO files (path, kind, size, created, last_access) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (path) DO UPDATE SET size = excluded.size, last_access = excluded.last_access"
+                + created_on_conflict,
+                (self._rel(path), kind, st.st_size if size is None else size, now if referenced else st.st_mtime, now),
+            )
+
+    def touch(self, path: Path, when: float | None = None) -> None:
+        """Mark an entry as used (cache hit) without touching the file itself. Throttled to one
+        write per entry per _TOUCH_INTERVAL_S, so hot cache hits cost a dict lookup."""
+        now = time.time() if when is None else when
+        rel = self._rel(path)
+        with self._lock:
+            if now - self._touched.get(rel, 0.0) < _TOUCH_INTERVAL_S:
+                return
+            if len(self._touched) >= 4096:
+                self._touched = {k: t for k, t in self._touched.items() if now - t < _TOUCH_INTERVAL_S}
+            self._touched[rel] = now
+            with self._conn:
+                self._conn.execute("UPDATE files SET last_access = ? WHERE path = ?", (now, rel))
+
+    def record_existing(self, paths: Iterable[Path], kind: str) -> None:
+        for path in paths:
+            if os.path.exists(path):
+                self.record(path, kind)
+
+    def forget(self, path: Path) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM files WHERE path = ?", (self._rel(path),))
+
+    def query(self, sql: str, params: tuple = ()) -> list[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def execute(self, sql: str, params: tuple = ()) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(sql, params)
+
+    def executemany(self, sql: str, rows: list[tuple]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany(sql, rows)
+
+    def _meta(self, key: str) -> str | None:
+        rows = self.query("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def seed(self) -> int:
+        """One full scan of OUTPUT_DIR into an empty index; later passes never walk the tree."""
+        if self._meta("seeded"):
+            return 0
+        rows = []
+
+        def add(path: Path, kind: str, size: int | None = None) -> None:
+            st = path.stat()
+            rows.append((self._rel(path), kind, st.st_size if size is None else size, st.st_mtime, st.st_mtime))
+
+        for entry in self.root.iterdir():
+            if entry.is_file() and entry.suffix == ".jpg":
+                add(entry, PANORAMA)
+        for sub, kind in (("columns", COLUMN), ("variants", VARIANT)):
+            d = self.root / sub
+            if d.is_dir():
+                for entry in d.iterdir():
+                    if entry.is_file() and not entry.name.startswith("."):
+                        add(entry, kind)
+        blobs = self.root / "blobs"
+        if blobs.is_dir():
+            for entry in blobs.glob("*/*/*.jpg"):
+                add(entry, PANORAMA)
+        tiles = self.root / "tiles"
+        if tiles.is_dir():
+            for entry in tiles.iterdir():
+                if entry.is_dir():
+                    add(entry, TILES, _tree_size(entry))
+
+        self.executemany("INSERT OR IGNORE INTO files (path, kind, size, created, last_access) VALUES (?, ?, ?, ?, ?)", rows)
+        self.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('seeded', ?)", (str(time.time()),))
+        return len(rows)
+
+
+class Collector:
+    """One GC pass = run_once(); loop() repeats it in a worker thread."""
+
+    def __init__(self, root: Path, index: FileIndex, session_factory=None):
+        self.root = Path(root)
+        self.index = index
+        # Sync SQLAlchemy sessionmaker; without a database, panorama files are never orphaned
+        self.session_factory = session_factory
+
+    def _delete(self, rel: str) -> int:
+        """Remove a file or pyramid directory and its index entry; returns bytes freed (0 if already gone)."""
+        path = self.root / rel
+        freed = 0
+        try:
+            if path.is_dir():
+                freed = _tree_size(path)
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                freed = path.stat().st_size
+                path.unlink()
+        except FileNotFoundError:
+            pass
+        self.index.execute("DELETE FROM files WHERE path = ?", (rel,))
+        return freed
+
+    def _delete_derived(self, stem: str) -> int:
+        """Variants and tile pyramids built from a deleted source (named "<stem>-<mtime>-<size>…")."""
+        freed = 0
+        for prefix in (f"variants/{stem}-", f"tiles/{stem}-"):
+            rows = self.index.query(
+                "SELECT path FROM files WHERE path >= ? AND path < ?", (prefix, prefix + "\uffff"),
+            )
+            for (rel,) in rows:
+                freed += self._delete(rel)
+        return freed
+
+    def _expire_columns(self, now: float) -> tuple[int, int]:
+        rows = self.index.query(
+            "SELECT path FROM files WHERE kind = ? AND created < ? ORDER BY created LIMIT ?",
+            (COLUMN, now - GC_COLUMNS_MAX_AGE_S, GC_BATCH),
+        )
+        freed = sum(self._delete(rel) for (rel,) in rows)
+        jobs = [Path(rel).name for (rel,) in rows if rel.startswith("jobs/")]
+        if jobs and self.session_factory is not None:
+            self._fail_previews(jobs)
+        return len(rows), freed
+
+    def _fail_previews(self, panorama_ids: list[str]) -> None:
+        """An expired job dir means its background full stitch is gone: stop showing "preview"."""
+        from panorama_db import replace_stitch_status
+        from stitch_jobs import FAILED, PREVIEW
+
+        with self.session_factory() as db:
+            rows = replace_stitch_status(db, panorama_ids, PREVIEW, FAILED)
+        if rows:
+            print(f"[GC] marked {len(rows)} abandoned preview stitch(es) failed")
+
+    def _referenced(self, rels: list[str]) -> set[str]:
+        from db_models import Panorama
+
+        with self.session_factory() as db:
+            rows = db.execute(
+                select(Panorama.stitched_filename, Panorama.staged_filename).where(
+                    or_(Panorama.stitched_filename.in_(rels), Panorama.staged_filename.in_(rels))
+                )
+            ).all()
+        return {name for row in rows for name in row if name}
+
+    def _collect_orphans(self, now: float) -> tuple[int, int]:
+        if self.session_factory is None:
+            return 0, 0
+        cutoff = now - GC_ORPHAN_MAX_AGE_S
+        # Least recently checked first, so every file is revisited round-robin
+        rows = self.index.query(
+            "SELECT path FROM files WHERE kind = ? AND created < ? ORDER BY checked LIMIT ?",
+            (PANORAMA, cutoff, GC_BATCH),
+        )
+        if not rows:
+            return 0, 0
+        rels = [rel for (rel,) in rows]
+        referenced = self._referenced(rels)
+        deleted = freed = 0
+        for rel in rels:
+            if rel in referenced:
+                continue
+            freed += self._delete(rel) + self._delete_derived(Path(rel).stem)
+            deleted += 1
+        self.index.executemany("UPDATE files SET checked = ? WHERE path = ?", [(now, rel) for rel in rels])
+        return deleted, freed
+
+    def _trim_caches(self, now: float) -> tuple[int, int]:
+        kinds = ",".join("?" * len(_CACHE_KINDS))
+        deleted = freed = 0
+        cutoff = now - GC_CACHE_MAX_AGE_S
+        # Cache hits are recorded in last_access by their readers (FileIndex.touch)
+        for (rel,) in self.index.query(
+            f"SELECT path FROM files WHERE kind IN ({kinds}) AND last_access < ? ORDER BY last_access LIMIT ?",
+            (*_CACHE_KINDS, cutoff, GC_BATCH),
+        ):
+            freed += self._delete(rel)
+            deleted += 1
+
+        (total,) = self.index.query(f"SELECT COALESCE(SUM(size), 0) FROM files WHERE kind IN ({kinds})", _CACHE_KINDS)[0]
+        if total > GC_CACHE_MAX_BYTES:
+            for rel, last_access in self.index.query(
+                f"SELECT path, last_access FROM files WHERE kind IN ({kinds}) ORDER BY last_access LIMIT ?",
+                (*_CACHE_KINDS, GC_BATCH),
+            ):
+                if total <= GC_CACHE_MAX_BYTES:
+                    break
+                if last_access >= now - 60:
+                    continue
+                n = self._delete(rel)
+                total -= n
+                freed += n
+                deleted += 1
+        return deleted, freed
+
+    def run_once(self) -> dict:
+        start = time.perf_counter()
+        seeded = self.index.seed()
+        now = time.time()
+        stats = {"seeded": seeded}
+        for name, rule in (("columns", self._expire_columns), ("orphans", self._collect_orphans),
+                           ("caches", self._trim_caches)):
+            try:
+                stats[name] = rule(now)
+            except Exception as e:
+                print(f"[GC] {name} failed: {e}")
+        stats["ms"] = round((time.perf_counter() - start) * 1000, 1)
+        if any(isinstance(v, tuple) and v[0] for v in stats.values()) or seeded:
+            print(f"[GC] pass: {stats}  (deleted, bytes freed)")
+        return stats
+
+    async def loop(self, interval: float = GC_INTERVAL_S) -> None:
+        """Background task: a pass every interval seconds, off the event loop."""
+        while True:
+            try:
+                await asyncio.to_thread(self.run_once)
+            except Exception as e:
+                print(f"[GC] pass failed: {e}")
+            await asyncio.sleep(interval)
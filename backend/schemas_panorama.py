@@ -13,6 +13,9 @@ class PanoramaOut(BaseModel):
     date_display: str | None = None
     stitched_filename: str
     staged_filename: str | None = None
+    stitched_sha256: str | None = None
+    staged_sha256: str | None = None
+    stitch_status: str | None = None
     staging_prompt_last: str | None = None
     world3d: dict[str, Any] | None = None
     created_at: datetime
@@ -20,6 +23,32 @@ class PanoramaOut(BaseModel):
     device_id: str | None = None
     image_url: str
     staged_image_url: str | None = None
+    thumbnail_url: str | None = None
+    staged_thumbnail_url: str | None = None
+
+
+class PanoramaChanges(BaseModel):
+    """GET /panoramas/changes: rows changed after the client's sync token."""
+    changes: list[PanoramaOut]
+    # Ids removed since the token; always empty until panorama deletion exists
+    deleted: list[str] = []
+    # Pass back as ?since= on the next sync (unchanged when there were no changes)
+    sync_token: str | None = None
+    has_more: bool = False
+
+
+class PanoramaImportResult(BaseModel):
+    panorama_id: str
+    ok: bool
+    error: str | None = None
+    panorama: PanoramaOut | None = None
+
+
+class PanoramaBatchImportOut(BaseModel):
+    """POST /panoramas/import:batch: one result per manifest item, in manifest order."""
+    imported: int
+    failed: int
+    results: list[PanoramaImportResult]
 
 
 class PanoramaPatch(BaseModel):
@@ -0,0 +1,434 @@
+"""
+Batch (re-)stitching of stored capture sets with the geometric stitcher.
+
+A capture set is any directory under ROOT holding a poses file (default poses.json):
+  [{"pitch": deg, "yaw": deg, "roll": deg, "file": "img_00.jpg"}, …]
+"roll" is optional (0). "file" is optional too; without it, the directory's images
+(.jpg / .jpeg / .png, sorted by name, the output itself excluded) are taken in pose order.
+The pose convention is /stitch's: pitch 0 = nadir, 90 = horizon, 180 = zenith.
+
+Each set is stitched to <set>/panorama.jpg (or --out-dir/<relative set path>/panorama.jpg)
+with a manifest next to it (panorama.json): the sha256 of every input and of the poses
+file, and the stitch parameters. A set is skipped when its manifest matches; inputs whose
+size and mtime match the manifest are not re-read, so an unchanged backfill only stats
+files. Changing a parameter (FOV, calibration, width, blend mode, …) re-stitches every set.
+
+Sets are stitched in parallel in a process pool (--jobs, default one per CPU) with OpenCV
+limited to --cv-threads threads per worker, so a backfill uses every core without
+oversubscribing them. Progress is printed as sets finish; --report writes a JSON summary
+(per-set status and time, throughput).
+
+Run (from backend/):
+  python -m stitch_batch /data/captures --width 4096 --report restitch.json
+  python -m stitch_batch /data/captures --fov-h 62 --calibration pixel7.json --dry-run
+Calibration file: {"camera_matrix": [[fx,0,cx],[0,fy,cy],[0,0,1]], "dist_coeffs": [...],
+"fisheye": true}, the input-camera model used for undistorting each capture.
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from stitch_jobs import STITCH_INTERPOLATION, stitch_geometric
+from storage import CHUNK_SIZE, write_atomic
+
+MANIFEST_VERSION = 1
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png")
+
+
+@dataclass
+class StitchParams:
+    """Everything besides the inputs that changes the output; part of the up-to-date key."""
+    output_width: int = 4096
+    fov_h_deg: float | None = None  # None → stitch_equirect defaults
+    fov_v_deg: float | None = None
+    winner_takes_all: bool = True
+    column_first: bool = False
+    edge_cutoff: float = 1.0
+    interpolation: str = STITCH_INTERPOLATION
+    yaw_auto_correct: bool = True
+    undistort_inputs: bool = True
+    undistort: bool = True
+    calibration: dict | None = None
+    jpeg_quality: int = 95
+
+
+@dataclass
+class CaptureSet:
+    path: Path
+    images: list[Path]
+    pitches: list[float]
+    yaws: list[float]
+    rolls: list[float]
+    poses_file: Path
+    output: Path
+
+
+@dataclass
+class SetResult:
+    path: str
+    status: str  # stitched | skipped | failed
+    seconds: float = 0.0
+    input_bytes: int = 0
+    output: str | None = None
+    error: str | None = None
+
+
+@dataclass
+class Report:
+    root: str
+    params: dict
+    jobs: int
+    sets: int = 0
+    stitched: int = 0
+    skipped: int = 0
+    failed: int = 0
+    seconds: float = 0.0
+    sets_per_min: float = 0.0
+    input_mb_per_s: float = 0.0
+    results: list[SetResult] = field(default_factory=list)
+
+
+# ── Discovery ─────────────────────────────────────────────────────────────────
+def _load_set(directory: Path, poses_file: Path, output: Path) -> CaptureSet:
+    poses = json.loads(poses_file.read_text())
+    if not isinstance(poses, list) or not poses:
+        raise ValueError(f"{poses_file}: expected a non-empty JSON array of poses")
+    if all(isinstance(p, dict) and "file" in p for p in poses):
+        images = [directory / p["file"] for p in poses]
+    else:
+        images = sorted(
+            p for p in directory.iterdir()
+            if p.suffix.lower() in IMAGE_SUFFIXES and p.is_file() and p.resolve() != output.resolve()
+        )
+        if len(images) != len(poses):
+            raise ValueError(f"{directory}: {len(images)} images but {len(poses)} poses (and no 'file' keys)")
+    try:
+        pitches = [float(p["pitch"]) for p in poses]
+        yaws = [float(p["yaw"]) for p in poses]
+        rolls = [float(p.get("roll", 0.0)) for p in poses]
+    except (TypeError, KeyError, ValueError):
+        raise ValueError(f"{poses_file}: every pose needs numeric 'pitch' and 'yaw'")
+    return CaptureSet(directory, images, pitches, yaws, rolls, poses_file, output)
+
+
+def discover(
+    root: Path, poses_name: str = "poses.json", out_dir: Path | None = None, output_name: str = "panorama.jpg",
+) -> tuple[list[CaptureSet], list[SetResult]]:
+    """All capture sets under root (sorted by path), plus a failed result per unreadable one."""
+    sets, bad = [], []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        if poses_name not in filenames:
+            continue
+        directory = Path(dirpath)
+        output = (out_dir / directory.relative_to(root) if out_dir else directory) / output_name
+        try:
+            sets.append(_load_set(directory, directory / poses_name, output))
+        except (OSError, ValueError) as e:
+            bad.append(SetResult(str(directory), "failed", error=str(e)))
+    return sets, bad
+
+
+# ── Up-to-date check ──────────────────────────────────────────────────────────
+def _manifest_path(output: Path) -> Path:
+    return output.with_suffix(".json")
+
+
+def _read_manifest(output: Path) -> dict | None:
+    try:
+        return json.loads(_manifest_path(output).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        while chunk := fh.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _file_entries(base: Path, paths: list[Path], previous: dict | None, read: bool) -> list[dict] | None:
+    """[{name, size, mtime_ns, sha256}] per input, name relative to the set directory base (two
+    "file" entries in different subdirectories may share a basename). Hashes are reused from
+    the previous manifest while size and mtime match; with read=False, None as soon as a file
+    would need hashing."""
+    known = {e["name"]: e for e in (previous or {}).get("files", [])}
+    entries = []
+    for path in paths:
+        st = path.stat()
+        name = Path(os.path.relpath(path, base)).as_posix()
+        old = known.get(name)
+        if old and old["size"] == st.st_size and old["mtime_ns"] == st.st_mtime_ns:
+            sha = old["sha256"]
+        elif read:
+            sha = _sha256(path)
+        else:
+            return None
+        entries.append({"name": name, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": sha})
+    return entries
+
+
+def _inputs_key(entries: list[dict], params: dict) -> str:
+    """Order-sensitive hash of the input contents (poses file included) and the parameters."""
+    payload = json.dumps(
+        {"v": MANIFEST_VERSION, "inputs": [e["sha256"] for e in entries], "params": params}, sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _inputs(cs: CaptureSet) -> list[Path]:
+    return [*cs.images, cs.poses_file]
+
+
+def up_to_date(cs: CaptureSet, params: dict, *, read: bool) -> bool:
+    """True if cs.output exists and its manifest matches the inputs and params. read=False only
+    trusts size + mtime (cheap; used for the pre-scan), read=True hashes changed files."""
+    manifest = _read_manifest(cs.output)
+    if manifest is None or not cs.output.exists():
+        return False
+    try:
+        entries = _file_entries(cs.path, _inputs(cs), manifest, read)
+    except OSError:
+        return False  # missing input: the worker reports it
+    return entries is not None and manifest.get("key") == _inputs_key(entries, params)
+
+
+# ── Worker ────────────────────────────────────────────────────────────────────
+def _init_worker(cv_threads: int, verbose: bool) -> None:
+    import cv2
+
+    cv2.setNumThreads(cv_threads)
+    if not verbose:
+        # The stitcher prints per-image diagnostics; with many workers they drown the progress lines
+        sys.stdout = open(os.devnull, "w")
+
+
+def stitch_set(cs: CaptureSet, params: StitchParams, force: bool = False) -> SetResult:
+    """Stitch one capture set unless its output is up to date (runs in a pool worker)."""
+    import numpy as np
+
+    t0 = time.perf_counter()
+    p = asdict(params)
+    result = SetResult(str(cs.path), "failed")
+    try:
+        # Inside the try: a capture deleted since discovery is this set's failure, not the batch's
+        result.input_bytes = sum(f.stat().st_size for f in cs.images)
+        manifest = _read_manifest(cs.output)
+        entries = _file_entries(cs.path, _inputs(cs), manifest, read=True)
+        key = _inputs_key(entries, p)
+        if not force and manifest and manifest.get("key") == key and cs.output.exists():
+            if manifest.get("files") != entries:
+                write_atomic(_manifest_path(cs.output), json.dumps({**manifest, "files": entries}, indent=1).encode())
+            result.status, result.output = "skipped", str(cs.output)
+            return result
+
+        kwargs = {}
+        if params.fov_h_deg is not None:
+            kwargs["fov_h_deg"] = params.fov_h_deg
+        if params.fov_v_deg is not None:
+            kwargs["fov_v_deg"] = params.fov_v_deg
+        calib = params.calibration
+        if calib:
+            kwargs["input_camera_matrix"] = np.array(calib["camera_matrix"], dtype=np.float64)
+            kwargs["input_dist_coeffs"] = np.array(calib["dist_coeffs"], dtype=np.float64)
+            kwargs["input_use_fisheye"] = bool(calib.get("fisheye", True))
+        # The server's stitch path, so a backfill matches what /stitch produces for the same params
+        jpeg = stitch_geometric(
+            cs.images, cs.pitches, cs.yaws, cs.rolls, params.output_width,
+            stage_name="stitch.batch",
+            interpolation=params.interpolation,
+            undistort=params.undistort,
+            quality=params.jpeg_quality,
+            undistort_inputs=params.undistort_inputs,
+            winner_takes_all=params.winner_takes_all,
+            column_first=params.column_first,
+            edge_cutoff=params.edge_cutoff,
+            yaw_auto_correct=params.yaw_auto_correct,
+            **kwargs,
+        )
+        cs.output.parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(cs.output, jpeg)
+        write_atomic(_manifest_path(cs.output), json.dumps({
+            "version": MANIFEST_VERSION,
+            "key": key,
+            "params": p,
+            "files": entries,
+            "output_sha256": hashlib.sha256(jpeg).hexdigest(),
+            "stitched_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }, indent=1).encode())
+        result.status, result.output = "stitched", str(cs.output)
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+    finally:
+        result.seconds = round(time.perf_counter() - t0, 2)
+    return result
+
+
+# ── Driver ────────────────────────────────────────────────────────────────────
+def _progress(report: Report, done: int, total: int, start: float) -> None:
+    """done / total count the sets sent to the pool; the rate and ETA are over those."""
+    elapsed = time.perf_counter() - start
+    rate = done / elapsed if elapsed > 0 else 0.0
+    eta = f"{(total - done) / rate / 60:.1f} min" if rate > 0 and done < total else "-"
+    print(
+        f"[Batch] {done}/{total}  stitched={report.stitched} skipped={report.skipped} failed={report.failed}"
+        f"  {rate * 60:.1f} sets/min  ETA {eta}",
+        flush=True,
+    )
+
+
+def _failed(cs: CaptureSet, e: BaseException) -> SetResult:
+    return SetResult(str(cs.path), "failed", error=f"{type(e).__name__}: {e}")
+
+
+def _add(report: Report, r: SetResult) -> None:
+    report.results.append(r)
+    setattr(report, r.status, getattr(report, r.status) + 1)
+    if r.status == "failed":
+        print(f"[Batch] FAILED {r.path}: {r.error}", flush=True)
+
+
+def run(
+    root: Path, params: StitchParams, *, jobs: int, cv_threads: int = 1, out_dir: Path | None = None,
+    poses_name: str = "poses.json", force: bool = False, dry_run: bool = False, verbose: bool = False,
+) -> Report:
+    start = time.perf_counter()
+    report = Report(root=str(root), params=asdict(params), jobs=jobs)
+    sets, bad = discover(root, poses_name, out_dir)
+    for r in bad:
+        _add(report, r)
+    report.sets = len(sets) + len(bad)
+
+    # Cheap pre-scan (stat only): sets whose files are untouched never reach the pool
+    p = asdict(params)
+    todo = []
+    for cs in sets:
+        if not force and up_to_date(cs, p, read=False):
+            _add(report, SetResult(str(cs.path), "skipped", output=str(cs.output)))
+        else:
+            todo.append(cs)
+    print(f"[Batch] {report.sets} capture sets under {root}: {len(todo)} to stitch, "
+          f"{report.skipped} up to date, {report.failed} unreadable", flush=True)
+
+    if dry_run:
+        for cs in todo:
+            print(f"  {cs.path} → {cs.output}")
+    elif todo:
+        done = 0
+        pool_start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(cv_threads, verbose)) as pool:
+            # At most 2 × jobs submitted at a time: each task carries its set, and results stream in.
+            # A worker that dies (OOM kill, segfault in OpenCV) breaks the pool: the sets in flight
+            # and every set submitted after it are reported failed, the report is still written.
+            pending: dict = {}
+            queue = iter(todo)
+            while True:
+                for cs in queue:
+                    try:
+                        pending[pool.submit(stitch_set, cs, params, force)] = cs
+                    except BrokenProcessPool as e:
+                        _add(report, _failed(cs, e))
+                        done += 1
+                        continue
+                    if len(pending) >= 2 * jobs:
+                        break
+                if not pending:
+                    break
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    cs = pending.pop(fut)
+                    try:
+                        r = fut.result()
+                    except Exception as e:
+                        r = _failed(cs, e)
+                    _add(report, r)
+                    done += 1
+                    _progress(report, done, len(todo), pool_start)
+
+    report.seconds = round(time.perf_counter() - start, 2)
+    if report.seconds > 0:
+        report.sets_per_min = round(report.stitched * 60 / report.seconds, 2)
+        stitched_bytes = sum(r.input_bytes for r in report.results if r.status == "stitched")
+        report.input_mb_per_s = round(stitched_bytes / 2**20 / report.seconds, 2)
+    return report
+
+
+def _load_calibration(path: Path | None) -> dict | None:
+    if path is None:
+        return None
+    calib = json.loads(path.read_text())
+    if "camera_matrix" not in calib or "dist_coeffs" not in calib:
+        raise SystemExit(f"{path}: calibration needs 'camera_matrix' and 'dist_coeffs'")
+    return calib
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("root", type=Path, help="directory tree to search for capture sets")
+    parser.add_argument("--out-dir", type=Path, help="write outputs here (mirroring ROOT) instead of into each set")
+    parser.add_argument("--poses-name", default="poses.json", help="poses file that marks a capture set")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="parallel stitches (default: CPUs)")
+    parser.add_argument("--cv-threads", type=int, default=1, help="OpenCV threads per worker")
+    parser.add_argument("--width", type=int, default=4096, help="equirect output width")
+    parser.add_argument("--fov-h", type=float, help="horizontal capture FOV in degrees (stitcher default if unset)")
+    parser.add_argument("--fov-v", type=float, help="vertical capture FOV in degrees")
+    parser.add_argument("--calibration", type=Path, help="JSON camera_matrix / dist_coeffs / fisheye of the captures")
+    parser.add_argument("--feather", action="store_true", help="feathered blending instead of winner-takes-all")
+    parser.add_argument("--column-first", action="store_true")
+    parser.add_argument("--edge-cutoff", type=float, default=1.0)
+    parser.add_argument(
+        "--interpolation", choices=("nearest", "linear", "cubic", "lanczos"), default=STITCH_INTERPOLATION,
+        help="capture sampling quality (stitch_equirect.INTERPOLATION_TIERS; default STITCH_INTERPOLATION)",
+    )
+    parser.add_argument("--no-yaw-correct", action="store_true", help="skip ORB yaw drift correction")
+    parser.add_argument("--no-undistort-inputs", action="store_true")
+    parser.add_argument("--no-undistort", action="store_true", help="skip undistort_panorama on the result")
+    parser.add_argument("--quality", type=int, default=95, help="JPEG quality")
+    parser.add_argument("--force", action="store_true", help="re-stitch even when outputs are up to date")
+    parser.add_argument("--dry-run", action="store_true", help="only list the sets that would be stitched")
+    parser.add_argument("--report", type=Path, help="write the JSON report to this file")
+    parser.add_argument("--verbose", action="store_true", help="keep the stitcher's per-image output")
+    args = parser.parse_args()
+
+    if not args.root.is_dir():
+        raise SystemExit(f"{args.root} is not a directory")
+    params = StitchParams(
+        output_width=args.width,
+        fov_h_deg=args.fov_h,
+        fov_v_deg=args.fov_v,
+        winner_takes_all=not args.feather,
+        column_first=args.column_first,
+        edge_cutoff=args.edge_cutoff,
+        interpolation=args.interpolation,
+        yaw_auto_correct=not args.no_yaw_correct,
+        undistort_inputs=not args.no_undistort_inputs,
+        undistort=not args.no_undistort,
+        calibration=_load_calibration(args.calibration),
+        jpeg_quality=args.quality,
+    )
+    report = run(
+        args.root, params, jobs=max(1, args.jobs), cv_threads=args.cv_threads, out_dir=args.out_dir,
+        poses_name=args.poses_name, force=args.force, dry_run=args.dry_run, verbose=args.verbose,
+    )
+    print(
+        f"[Batch] done in {report.seconds:.1f} s: stitched={report.stitched} skipped={report.skipped} "
+        f"failed={report.failed}  {report.sets_per_min} sets/min  {report.input_mb_per_s} MB/s of captures"
+    )
+    if args.report:
+        args.report.write_text(json.dumps(asdict(report), indent=2))
+    sys.exit(1 if report.failed else 0)
+
+
+if __name__ == "__main__":
+    main()
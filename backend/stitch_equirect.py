@@ -21,6 +21,9 @@ Coordinate alignment with app (sphereConfig.TARGET_DOTS + projection.ts):
     15° horizontal overlap per seam — ideal for soft weighted blending (no "boxy" look).
   → Vertical overlap ≈ 15° (FOV_V=60° minus 45° ring spacing).
 """
+import threading
+from collections import OrderedDict
+
 import numpy as np
 import cv2
 
@@ -28,6 +31,21 @@ DEG2RAD = np.pi / 180
 # CRITICAL: must match PhotosphereScreen.tsx  FOV_H = 60  /  FOV_V = 75
 FOV_H_DEG = 60.0
 FOV_V_DEG = 75.0
+# Winner-takes-all: winners are computed every WTA_COARSE_STEP output pixels and per pixel
+# only in blocks where those disagree (see _winner_map); 1 = per pixel everywhere
+WTA_COARSE_STEP = 8
+# cv2.remap needs map dimensions below SHRT_MAX: pixel lists are sampled as rows this long
+_SAMPLE_ROW = 4096
+# Interpolation quality tiers for sampling the inputs (stitch_equirectangular interpolation=)
+INTERPOLATION_TIERS = {
+    "nearest": cv2.INTER_NEAREST,
+    "linear": cv2.INTER_LINEAR,
+    "cubic": cv2.INTER_CUBIC,
+    "lanczos": cv2.INTER_LANCZOS4,
+}
+# Undistortion maps kept in memory (fixed-point CV_16SC2, 6 bytes per pixel): the inputs of
+# one device share one map, and the panorama one per output size
+UNDISTORT_MAP_CACHE_BYTES = 256 * 1024 * 1024
 
 
 def uv_to_direction(u: np.ndarray, v: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
@@ -55,6 +73,26 @@ def _camera_look_direction(pitch_deg: float, yaw_deg: float) -> tuple[float, flo
     return (float(lx), float(ly), float(lz))
 
 
+def camera_rotations(pitches_deg, yaws_deg, rolls_deg) -> np.ndarray:
+    """World → camera rotations for N poses at once, shape (N, 3, 3).
+    Rows are the (rolled) right, up and look axes, so R @ d = (cam_x, cam_y, depth)."""
+    lon = (np.asarray(yaws_deg, dtype=np.float64) - 180.0) * DEG2RAD
+    lat = (np.asarray(pitches_deg, dtype=np.float64) - 90.0) * DEG2RAD
+    cl = np.cos(lat)
+    # Look direction, as _camera_look_direction
+    look = np.stack([np.cos(lon) * cl, np.sin(lat), np.sin(lon) * cl], axis=-1)
+    # Camera basis: forward = L, right = up_world × L, up = L × right (Y-up world)
+    right = np.stack([look[:, 2], np.zeros_like(cl), -look[:, 0]], axis=-1)
+    right /= np.maximum(np.linalg.norm(right, axis=-1, keepdims=True), 1e-9)
+    up = np.cross(look, right)
+    up /= np.maximum(np.linalg.norm(up, axis=-1, keepdims=True), 1e-9)
+    # Roll rotates Right and Up around the Look axis:
+    # Right' = Right·cos + Up·sin, Up' = Up·cos − Right·sin
+    roll = np.asarray(rolls_deg, dtype=np.float64)[:, np.newaxis] * DEG2RAD
+    cr, sr = np.cos(roll), np.sin(roll)
+    return np.stack([right * cr + up * sr, up * cr - right * sr, look], axis=1)
+
+
 def direction_to_rectilinear(
     dx: np.ndarray, dy: np.ndarray, dz: np.ndarray,
     pitch_deg: float, yaw_deg: float, roll_deg: float,
@@ -62,40 +100,7 @@ def direction_to_rectilinear(
 ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
     """World directions (dx,dy,dz) -> camera rectilinear (x, y) in [-1,1]; mask in_frame.
     Uses camera look direction from app pitch/yaw so east/north/etc. map correctly."""
-    lx, ly, lz = _camera_look_direction(pitch_deg, yaw_deg)
-    # Camera basis: forward = L, right = up_world × L, up = L × right (Y-up world)
-    rx, ry, rz = lz, 0.0, -lx
-    rnorm = np.sqrt(rx * rx + rz * rz)
-    if rnorm < 1e-9:
-        rnorm = 1e-9
-    rx, rz = rx / rnorm, rz / rnorm
-    ux = ly * rz - lz * 0
-    uy = lz * rx - lx * rz
-    uz = lx * 0 - ly * rx
-    unorm = np.sqrt(ux * ux + uy * uy + uz * uz)
-    if unorm < 1e-9:
-        unorm = 1e-9
-    ux, uy, uz = ux / unorm, uy / unorm, uz / unorm
-
-    # Apply Roll Rotation around the Look axis (L)
-    # Rotating Right and Up vectors around L by roll_deg
-    roll_rad = roll_deg * DEG2RAD
-    cr = np.cos(roll_rad)
-    sr = np.sin(roll_rad)
-    
-    # New Right = Right * cos(roll) + Up * sin(roll)
-    rx_new = rx * cr + ux * sr
-    ry_new = ry * cr + uy * sr
-    rz_new = rz * cr + uz * sr
-    
-    # New Up = Up * cos(roll) - Right * sin(roll)
-    ux_new = ux * cr - rx * sr
-    uy_new = uy * cr - ry * sr
-    uz_new = uz * cr - rz * sr
-
-    # Re-assign rotated basis
-    rx, ry, rz = rx_new, ry_new, rz_new
-    ux, uy, uz = ux_new, uy_new, uz_new
+    (rx, ry, rz), (ux, uy, uz), (lx, ly, lz) = camera_rotations([pitch_deg], [yaw_deg], [roll_deg])[0]
 
     # Depth = dot(L, d); in front when depth > 0
     depth = lx * dx + ly * dy + lz * dz
@@ -113,19 +118,226 @@ def direction_to_rectilinear(
 
 
 def sample_rectilinear_grid(
-    img: np.ndarray, x_norm: np.ndarray, y_norm: np.ndarray
+    img: np.ndarray, x_norm: np.ndarray, y_norm: np.ndarray, interpolation: int = cv2.INTER_CUBIC,
 ) -> np.ndarray:
     """Sample image at normalized coords (x_norm, y_norm) in [-1,1]. Returns (H,W,3)."""
     h, w = img.shape[:2]
-    px = (x_norm + 1) * 0.5 * (w - 1)
-    py = (1 - y_norm) * 0.5 * (h - 1)
-    px = np.clip(px, 0, w - 1).astype(np.float32)
-    py = np.clip(py, 0, h - 1).astype(np.float32)
-    # OpenCV remap: map_x, map_y same size as output
-    map_x = px.astype(np.float32)
-    map_y = py.astype(np.float32)
-    out = cv2.remap(img, map_x, map_y, cv2.INTER_CUBIC, borderMode=cv2.BORDER_REFLECT)
-    return out
+    # OpenCV remap: map_x, map_y same size as output. Single-use float32 maps are quantized to
+    # the same 1/32-pixel fixed-point table that cv2.convertMaps(CV_16SC2) would produce, so
+    # converting them first only adds a pass (unlike the cached undistortion maps).
+    map_x = np.asarray(x_norm, dtype=np.float32) + 1
+    map_x *= 0.5 * (w - 1)
+    map_y = 1 - np.asarray(y_norm, dtype=np.float32)
+    map_y *= 0.5 * (h - 1)
+    np.clip(map_x, 0, w - 1, out=map_x)
+    np.clip(map_y, 0, h - 1, out=map_y)
+    return cv2.remap(img, map_x, map_y, interpolation, borderMode=cv2.BORDER_REFLECT)
+
+
+def _sample_points(img: np.ndarray, x_norm: np.ndarray, y_norm: np.ndarray, interpolation: int) -> np.ndarray:
+    """sample_rectilinear_grid for 1-D coordinate lists → (N, 3)."""
+    n = x_norm.size
+    rows = -(-n // _SAMPLE_ROW)
+    pad = rows * _SAMPLE_ROW - n
+    xs = np.pad(x_norm, (0, pad)).reshape(rows, _SAMPLE_ROW)
+    ys = np.pad(y_norm, (0, pad)).reshape(rows, _SAMPLE_ROW)
+    return sample_rectilinear_grid(img, xs, ys, interpolation).reshape(-1, img.shape[2])[:n]
+
+
+def interpolation_flag(interpolation: int | str) -> int:
+    """cv2.INTER_* flag, or a tier name from INTERPOLATION_TIERS → its flag. Raises ValueError."""
+    if isinstance(interpolation, str):
+        try:
+            return INTERPOLATION_TIERS[interpolation.strip().lower()]
+        except KeyError:
+            raise ValueError(
+                f"unknown interpolation {interpolation!r} (expected one of {', '.join(INTERPOLATION_TIERS)})"
+            )
+    return int(interpolation)
+
+
+# Output pixels per projection tile: keeps the (tile, 3N) camera-coordinate buffer small
+_TILE = 1 << 15
+
+
+class _OutputGrid:
+    """Output pixel centres as separable lon / lat tables, so the directions (and column index)
+    of any subset of pixels are computed without materialising the full (H, W) grid."""
+
+    def __init__(self, u: np.ndarray, v: np.ndarray, num_columns: int | None):
+        lon = (u * 360 - 180) * DEG2RAD
+        lat = (90 - v * 180) * DEG2RAD
+        self.width = u.size
+        self.height = v.size
+        self.cos_lon = np.cos(lon).astype(np.float32)
+        self.sin_lon = np.sin(lon).astype(np.float32)
+        self.cos_lat = np.cos(lat).astype(np.float32)
+        self.sin_lat = np.sin(lat).astype(np.float32)
+        # Nearest yaw column of each output column (column_first)
+        self.col_idx = None
+        if num_columns is not None:
+            self.col_idx = np.round(u * 360.0 / (360.0 / num_columns)).astype(int) % num_columns
+
+
+class _Projector:
+    """Output pixels → rectilinear coordinates and blend weights in all N cameras at once.
+
+    The N rotations are stacked into one (3, 3N) float32 matrix, so a tile of output
+    directions is projected into every camera by a single matmul. Directions, camera
+    coordinates and weights are written into float32 buffers allocated once per stitch."""
+
+    def __init__(
+        self, grid: _OutputGrid, rotations: np.ndarray, fov_h_deg: float, fov_v_deg: float,
+        cutoff: float, power: float, img_cols: list[int] | None,
+    ):
+        n = len(rotations)
+        self.grid = grid
+        self.n = n
+        self.rot_t = np.ascontiguousarray(rotations.reshape(3 * n, 3).T, dtype=np.float32)  # (3, 3N)
+        self.tan_h = np.float32(np.tan((fov_h_deg / 2) * DEG2RAD))
+        self.tan_v = np.float32(np.tan((fov_v_deg / 2) * DEG2RAD))
+        self.cutoff = np.float32(cutoff)
+        self.power = np.float32(power)
+        self.img_cols = np.asarray(img_cols) if img_cols is not None else None
+        self._dirs = np.empty((_TILE, 3), dtype=np.float32)
+        self._cam = np.empty(_TILE * 3 * n, dtype=np.float32)
+        self._x, self._y, self._w, self._tmp = (np.empty(_TILE * n, dtype=np.float32) for _ in range(4))
+        self._front, self._active = (np.empty(_TILE * n, dtype=bool) for _ in range(2))
+
+    def _tile(self, rows: np.ndarray, cols: np.ndarray, k0: int, k1: int):
+        """x_norm, y_norm, w of pixels (rows, cols) in cameras k0…k1-1 → (t, k1-k0) buffer views."""
+        t, m = rows.size, k1 - k0
+        g = self.grid
+        d = self._dirs[:t]
+        cos_lat = g.cos_lat[rows]
+        np.multiply(g.cos_lon[cols], cos_lat, out=d[:, 0])
+        d[:, 1] = g.sin_lat[rows]
+        np.multiply(g.sin_lon[cols], cos_lat, out=d[:, 2])
+        cam = self._cam[:t * 3 * m].reshape(t, 3 * m)
+        np.matmul(d, self.rot_t[:, 3 * k0:3 * k1], out=cam)
+        cam = cam.reshape(t, m, 3)  # (cam_x, cam_y, depth)
+
+        x, y, w, tmp = (b[:t * m].reshape(t, m) for b in (self._x, self._y, self._w, self._tmp))
+        front, active = (b[:t * m].reshape(t, m) for b in (self._front, self._active))
+        # In front when depth > 0; project to the image plane and normalize by FOV
+        np.greater(cam[..., 2], 1e-6, out=front)
+        np.maximum(cam[..., 2], 1e-6, out=tmp)
+        np.divide(cam[..., 0], tmp, out=x)
+        x /= self.tan_h
+        np.divide(cam[..., 1], tmp, out=y)
+        y /= self.tan_v
+
+        # Distance from image center (0 = center, 1 = edge); anything beyond edge_cutoff is ignored
+        np.abs(x, out=tmp)
+        np.maximum(tmp, np.abs(y, out=w), out=tmp)
+        np.less_equal(tmp, self.cutoff, out=active)
+        active &= front
+        # Column-first restriction: each image only paints its own yaw column, so
+        # upper/lower ring drift cannot bleed into adjacent columns.
+        if self.img_cols is not None:
+            active &= g.col_idx[cols][:, None] == self.img_cols[None, k0:k1]
+
+        # Remap dist within [0, cutoff] → [0, 1] so weight=1 at center, ~0 at cutoff.
+        # The 1e-9 floor keeps pixels exactly at the frame edge positive — with w=0 there,
+        # WTA would never assign them, leaving a 1-pixel black seam at every column boundary.
+        np.divide(tmp, self.cutoff, out=w)
+        np.subtract(1.0, w, out=w)
+        np.clip(w, 0.0, 1.0, out=w)
+        np.power(w, self.power, out=w)
+        np.maximum(w, 1e-9, out=w)
+        w *= active
+        return x, y, w
+
+    def winners(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        """Index of the winning image at each (row, col) pixel; -1 where no image covers it.
+        Ties go to the earlier image."""
+        out = np.empty(rows.size, dtype=np.int16)
+        for lo in range(0, rows.size, _TILE):
+            hi = min(lo + _TILE, rows.size)
+            _, _, w = self._tile(rows[lo:hi], cols[lo:hi], 0, self.n)
+            best = w.argmax(axis=1)
+            covered = w[np.arange(hi - lo), best] > 0
+            out[lo:hi] = np.where(covered, best, -1)
+        return out
+
+    def project(self, k: int, rows: np.ndarray, cols: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """x_norm, y_norm, w of pixels (rows, cols) in camera k, as new (M,) float32 arrays."""
+        x_out, y_out, w_out = (np.empty(rows.size, dtype=np.float32) for _ in range(3))
+        for lo in range(0, rows.size, _TILE):
+            hi = min(lo + _TILE, rows.size)
+            x, y, w = self._tile(rows[lo:hi], cols[lo:hi], k, k + 1)
+            x_out[lo:hi], y_out[lo:hi], w_out[lo:hi] = x[:, 0], y[:, 0], w[:, 0]
+        return x_out, y_out, w_out
+
+
+def _winner_map(grid: _OutputGrid, step: int, winners_at) -> np.ndarray:
+    """(H, W) winner indices, coarse to fine.
+
+    winners_at(rows, cols) gives the exact winners of a pixel list. They are evaluated on a
+    lattice every `step` pixels (plus the last row / column); a block whose four lattice
+    corners agree takes that winner, and only blocks with disagreeing corners (seams, coverage
+    edges) and their 8 neighbours — margin for a winner region thinner than a block — are
+    evaluated per pixel. Winner regions are a few hundred pixels across, seams a few pixels.
+    """
+    h, w = grid.height, grid.width
+    if step <= 1:
+        rr, cc = np.divmod(np.arange(h * w), w)
+        return winners_at(rr, cc).reshape(h, w)
+    lat_r = np.unique(np.r_[np.arange(0, h, step), h - 1])
+    lat_c = np.unique(np.r_[np.arange(0, w, step), w - 1])
+    rr, cc = np.meshgrid(lat_r, lat_c, indexing="ij")
+    coarse = winners_at(rr.ravel(), cc.ravel()).reshape(rr.shape)
+    corner = coarse[:-1, :-1]
+    mixed = (corner != coarse[1:, :-1]) | (corner != coarse[:-1, 1:]) | (corner != coarse[1:, 1:])
+    mixed = cv2.dilate(mixed.astype(np.uint8), np.ones((3, 3), np.uint8)) > 0
+    # Pixel → block; the last block also takes the last row / column
+    row_block = np.minimum(np.arange(h) // step, corner.shape[0] - 1)
+    col_block = np.minimum(np.arange(w) // step, corner.shape[1] - 1)
+    winner = corner[row_block][:, col_block]
+    fine_r, fine_c = np.nonzero(mixed[row_block][:, col_block])
+    winner[fine_r, fine_c] = winners_at(fine_r, fine_c)
+    return winner
+
+
+_undistort_maps_cache: OrderedDict[tuple, tuple[np.ndarray, np.ndarray]] = OrderedDict()
+_undistort_maps_bytes = 0
+_undistort_maps_lock = threading.Lock()
+
+
+def _undistort_maps(
+    K: np.ndarray, D: np.ndarray, size: tuple[int, int], fisheye: bool, balance: float = 1.0,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Rectification maps of cv2.fisheye.undistortImage (new K = K) or cv2.undistort (new K from
+    getOptimalNewCameraMatrix with balance) in fixed-point CV_16SC2 form, so undistorting is a
+    single cv2.remap. LRU-cached by (K, D, size, balance) up to UNDISTORT_MAP_CACHE_BYTES."""
+    global _undistort_maps_bytes
+    key = (fisheye, K.tobytes(), D.tobytes(), D.shape, size, None if fisheye else float(balance))
+    with _undistort_maps_lock:
+        maps = _undistort_maps_cache.get(key)
+        if maps is not None:
+            _undistort_maps_cache.move_to_end(key)
+            return maps
+
+    if fisheye:
+        maps = cv2.fisheye.initUndistortRectifyMap(K, D, np.eye(3), K, size, cv2.CV_16SC2)
+    else:
+        new_K, _ = cv2.getOptimalNewCameraMatrix(K, D, size, balance, size)
+        maps = cv2.initUndistortRectifyMap(K, D, None, new_K, size, cv2.CV_16SC2)
+
+    with _undistort_maps_lock:
+        if key not in _undistort_maps_cache:
+            _undistort_maps_cache[key] = maps
+            _undistort_maps_bytes += maps[0].nbytes + maps[1].nbytes
+            # Evict least recently used, always keeping the maps just built
+            while _undistort_maps_bytes > UNDISTORT_MAP_CACHE_BYTES and len(_undistort_maps_cache) > 1:
+                _, (m1, m2) = _undistort_maps_cache.popitem(last=False)
+                _undistort_maps_bytes -= m1.nbytes + m2.nbytes
+    return maps
+
+
+def _remap_undistort(img: np.ndarray, maps: tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    # Bilinear with a black border, as cv2.undistort / cv2.fisheye.undistortImage
+    return cv2.remap(img, maps[0], maps[1], cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
 
 
 def _default_input_camera_matrix(width: int, height: int) -> np.ndarray:
@@ -168,14 +380,35 @@ def _undistort_input_image(
         D = np.asarray(D, dtype=np.float64).flatten()
         if D.size < 4:
             D = np.resize(D, 4)
-        return cv2.fisheye.undistortImage(im, K, D, None, K)
+        return _remap_undistort(im, _undistort_maps(K, D, (w, h), fisheye=True))
     else:
         D = dist_coeffs if dist_coeffs is not None else DEFAULT_INPUT_CLASSIC_D
         D = np.asarray(D, dtype=np.float64)
         if D.ndim == 1:
             D = D.reshape(-1, 1)
-        new_K, _ = cv2.getOptimalNewCameraMatrix(K, D, (w, h), 1.0, (w, h))
-        return cv2.undistort(im, K, D, None, new_K)
+        return _remap_undistort(im, _undistort_maps(K, D, (w, h), fisheye=False, balance=1.0))
+
+
+_REDUCED_READ_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def _read_input(path: str, reduce: int = 1) -> np.ndarray | None:
+    """cv2.imread, optionally decoding at 1/2, 1/4 or 1/8 size (JPEG DCT scaling, much cheaper)."""
+    return cv2.imread(path, _REDUCED_READ_FLAGS[reduce])
+
+
+def _scaled_camera_matrix(K: np.ndarray | None, reduce: int) -> np.ndarray | None:
+    """Calibrated K for full-size captures → K for captures decoded at 1/reduce size."""
+    if K is None or reduce == 1:
+        return K
+    K = np.array(K, dtype=np.float64)
+    K[:2] /= reduce
+    return K
 
 
 def _pose_to_uv_bounds(pitch_deg: float, yaw_deg: float, fov_h_deg: float, fov_v_deg: float) -> tuple[float, float, float, float]:
@@ -387,6 +620,9 @@ def stitch_equirectangular(
     column_first: bool = False,
     num_columns: int = 8,
     yaw_auto_correct: bool = True,
+    input_reduce: int = 1,
+    interpolation: int | str = cv2.INTER_CUBIC,
+    wta_coarse_step: int = WTA_COARSE_STEP,
 ) -> np.ndarray:
     """
     Stitch images with known poses into one equirectangular panorama.
@@ -402,12 +638,23 @@ def stitch_equirectangular(
                          image so stretched edges never appear in the output.
       edge_cutoff=1.0  — use 100% of each frame (all the way to the edge).
       winner_takes_all=True — each output pixel gets colour from whichever image centre is nearest.
+                         The winner map is built coarse to fine (wta_coarse_step) and each
+                         image is sampled only where it wins; the result is the same as
+                         comparing every image at every pixel (wta_coarse_step=1).
       yaw_auto_correct=True — ORB drift correction runs independently of column_first.
       column_first=False — no hard column boundaries; adjacent images fill seam gaps naturally.
       blend_softness is only used when winner_takes_all=False (feathered weighted average).
 
+    Cheaper settings for previews: input_reduce (1, 2, 4 or 8) decodes the inputs at that
+    fraction of their size; interpolation=cv2.INTER_LINEAR (or "linear", see
+    INTERPOLATION_TIERS) samples them bilinearly.
+
     Returns BGR image of shape (output_height, output_width, 3).
     """
+    if input_reduce not in _REDUCED_READ_FLAGS:
+        raise ValueError(f"input_reduce must be one of {sorted(_REDUCED_READ_FLAGS)}")
+    interpolation = interpolation_flag(interpolation)
+    input_camera_matrix = _scaled_camera_matrix(input_camera_matrix, input_reduce)
     seen = set()
     paths, pitches, yaws, rolls = [], [], [], []
     for path, p, y, r in zip(image_paths, pitches_deg, yaws_deg, rolls_deg):
@@ -458,30 +705,12 @@ def stitch_equirectangular(
 
     u = (np.arange(out_w, dtype=np.float64) + 0.5) / out_w * span_u + u_min
     v = (np.arange(out_h, dtype=np.float64) + 0.5) / out_h * span_v + v_min
-    uu, vv = np.meshgrid(u, v)
-    dx, dy, dz = uv_to_direction(uu, vv)
-
-    out_acc = np.zeros((out_h, out_w, 3), dtype=np.float64)
-    out_weight = np.zeros((out_h, out_w), dtype=np.float64)
-    # winner-takes-all: track best weight and winning color per pixel separately
-    out_best_w = np.zeros((out_h, out_w), dtype=np.float64) if winner_takes_all else None
-    out_wta_color = np.zeros((out_h, out_w, 3), dtype=np.float64) if winner_takes_all else None
 
     cutoff = float(np.clip(edge_cutoff, 0.1, 1.0))
     power = max(1.0, float(blend_softness))
 
-    # Column-first: pre-compute which yaw column each output pixel belongs to.
-    # Each image is then restricted to paint only pixels inside its own column,
-    # so upper/lower ring drift cannot bleed horizontally into neighbouring columns.
-    col_step = 360.0 / num_columns  # e.g. 45° for 8 columns
-    if column_first:
-        # uu is in [0,1]; yaw_deg = uu * 360 → [0, 360)
-        out_yaw_deg = uu * 360.0
-        # Snap each output pixel to the nearest column index (0 … num_columns-1)
-        out_col_idx = np.round(out_yaw_deg / col_step).astype(int) % num_columns  # (H, W)
-
-    for path, pitch_deg, yaw_deg, roll_deg in zip(paths, pitches, yaws, rolls):
-        im = cv2.imread(path)
+    def load(path: str) -> np.ndarray:
+        im = _read_input(path, input_reduce)
         if im is None:
             raise FileNotFoundError(f"Cannot read image: {path}")
         if undistort_inputs:
@@ -491,51 +720,52 @@ def stitch_equirectangular(
                 camera_matrix=input_camera_matrix,
                 dist_coeffs=input_dist_coeffs,
             )
-        x_norm, y_norm, in_frame = direction_to_rectilinear(
-            dx, dy, dz, pitch_deg, yaw_deg, roll_deg, fov_h_deg, fov_v_deg
-        )
-        sampled = sample_rectilinear_grid(im, x_norm, y_norm)
+        return im
 
-        # Distance from image center; 0 = center, 1 = edge corner
-        dist = np.maximum(np.abs(x_norm), np.abs(y_norm))
-        # Hard cutoff: ignore anything beyond edge_cutoff from center
-        in_active = in_frame & (dist <= cutoff)
+    # Column-first: each output pixel belongs to the yaw column nearest to it, and each
+    # image only paints pixels inside its own column, so upper/lower ring drift cannot
+    # bleed horizontally into neighbouring columns.
+    col_step = 360.0 / num_columns  # e.g. 45° for 8 columns
+    img_cols = [round(yaw_deg / col_step) % num_columns for yaw_deg in yaws] if column_first else None
+    grid = _OutputGrid(u, v, num_columns if column_first else None)
+    # All N camera rotations at once; output pixels are projected into every camera per tile
+    projector = _Projector(
+        grid, camera_rotations(pitches, yaws, rolls), fov_h_deg, fov_v_deg, cutoff, power, img_cols,
+    )
 
-        # Column-first restriction: this image only paints its own yaw column.
-        # e.g. image at yaw=45° (col=1) only fills output pixels whose nearest
-        # yaw column is also 1 (yaw 22.5°…67.5°). Upper/lower drift stays
-        # confined to that column and cannot shift content in adjacent columns.
-        if column_first:
-            img_col_idx = round(yaw_deg / col_step) % num_columns
-            in_active = in_active & (out_col_idx == img_col_idx)
+    if winner_takes_all:
+        # Each output pixel takes color only from the image whose center it is closest to.
+        # No averaging → no ghosting from mis-aligned overlapping views. The winner depends
+        # only on the poses, so the winner map is built first (coarse to fine) and each
+        # image is then projected and sampled only at the pixels it wins.
+        winner = _winner_map(grid, wta_coarse_step, projector.winners).ravel()
+        # Pixel indices grouped by winner (-1 = uncovered first); stable radix sort on int16
+        order = np.argsort(winner, kind="stable")
+        counts = np.bincount(winner + 1, minlength=len(paths) + 1)
+        out_img = np.zeros((out_h * out_w, 3), dtype=np.uint8)
+        start = counts[0]
+        for k, path in enumerate(paths):
+            idx = order[start:start + counts[k + 1]]
+            start += counts[k + 1]
+            if idx.size == 0:
+                continue
+            rows, cols = np.divmod(idx, out_w)
+            x_norm, y_norm, _ = projector.project(k, rows, cols)
+            out_img[idx] = _sample_points(load(path), x_norm, y_norm, interpolation)
+        return out_img.reshape(out_h, out_w, 3)
 
-        # Remap dist within [0, cutoff] → [0, 1] so weight=1 at center, ~0 at cutoff.
-        # Use a tiny floor (1e-9) so that pixels exactly at the frame edge still get
-        # a positive weight — without this, edge pixels have w=0 and WTA never assigns
-        # them, leaving a 1-pixel-wide black seam at every column boundary.
-        dist_norm = np.where(in_active, dist / cutoff, 1.0)
-        base = np.clip(1.0 - dist_norm, 0.0, 1.0)
-        w_soft = base ** power
-        w = np.where(in_active, np.maximum(w_soft, 1e-9), 0.0)
-
-        if winner_takes_all:
-            # Each output pixel takes color only from the image whose center it is closest to.
-            # No averaging → no ghosting from mis-aligned overlapping views.
-            update = w > out_best_w
-            out_wta_color[update] = sampled.astype(np.float64)[update]
-            out_best_w[update] = w[update]
-        else:
-            out_acc += sampled.astype(np.float64) * w[:, :, np.newaxis]
-            out_weight += w
+    rr, cc = np.divmod(np.arange(out_h * out_w), out_w)
+    out_acc = np.zeros((out_h * out_w, 3), dtype=np.float64)
+    out_weight = np.zeros(out_h * out_w, dtype=np.float64)
+    for k, path in enumerate(paths):
+        x_norm, y_norm, w = projector.project(k, rr, cc)
+        sampled = _sample_points(load(path), x_norm, y_norm, interpolation)
+        out_acc += sampled.astype(np.float64) * w[:, np.newaxis]
+        out_weight += w
 
-    if winner_takes_all:
-        # Thin seam feathering: near seam boundaries, blend winner with runner-up.
-        # For now use winner color directly; pure WTA gives zero ghost.
-        out_img = np.clip(out_wta_color, 0, 255).astype(np.uint8)
-    else:
-        out_weight = np.maximum(out_weight, 1e-6)
-        out_img = (out_acc / out_weight[:, :, np.newaxis]).astype(np.uint8)
-    return out_img
+    out_weight = np.maximum(out_weight, 1e-6)
+    out_img = (out_acc / out_weight[:, np.newaxis]).astype(np.uint8)
+    return out_img.reshape(out_h, out_w, 3)
 
 
 def _default_camera_matrix(width: int, height: int, scale: float = 1.0) -> np.ndarray:
@@ -557,8 +787,11 @@ def undistort_panorama(
     """
     Remove lens distortion from the stitched panorama using OpenCV undistort.
 
-    - use_fisheye=True: cv2.fisheye.undistortImage (4 coeffs: k1, k2, k3, k4).
-    - use_fisheye=False: cv2.undistort (classic model: k1, k2, p1, p2, k3).
+    - use_fisheye=True: as cv2.fisheye.undistortImage (4 coeffs: k1, k2, k3, k4).
+    - use_fisheye=False: as cv2.undistort (classic model: k1, k2, p1, p2, k3).
+
+    The rectification maps are cached per (K, D, size, balance) (see _undistort_maps), so
+    repeated calls at the same output size cost one fixed-point cv2.remap.
 
     If camera_matrix or dist_coeffs are None, defaults are used (mild barrel correction).
     balance (0..1) only for classic model: 0 = crop black, 1 = keep all pixels.
@@ -578,7 +811,7 @@ def undistort_panorama(
         D = np.asarray(dist_coeffs, dtype=np.float64).flatten()
         if D.size < 4:
             D = np.resize(D, 4)
-        out = cv2.fisheye.undistortImage(img, K, D, None, K)
+        out = _remap_undistort(img, _undistort_maps(K, D, (w, h), fisheye=True))
     else:
         # Classic k1,k2,p1,p2,k3: stronger default matching phone barrel distortion.
         if dist_coeffs is None:
@@ -586,10 +819,7 @@ def undistort_panorama(
         D = np.asarray(dist_coeffs, dtype=np.float64)
         if D.ndim == 1:
             D = D.reshape(-1, 1)
-        new_K, _ = cv2.getOptimalNewCameraMatrix(
-            K, D, (w, h), balance, (w, h)
-        )
-        out = cv2.undistort(img, K, D, None, new_K)
+        out = _remap_undistort(img, _undistort_maps(K, D, (w, h), fisheye=False, balance=balance))
     return out
 
 
@@ -0,0 +1,138 @@
+"""
+Two-tier /stitch: a low-resolution local preview answered right away, and the full-quality
+stitch that replaces it on the same Panorama row once a background task finishes.
+
+  preview  – stitch_equirectangular at STITCH_PREVIEW_WIDTH from captures decoded at 1/4
+             size, bilinear sampling, no input undistortion, yaw correction or post-undistort
+  full     – with GOOGLE_API_KEY, by STITCH_MODE (or the request's mode field):
+               columns  Gemini column-then-full for 24 captures (9 calls), one call otherwise
+               hybrid   local pose-correct draft (STITCH_HYBRID_DRAFT_WIDTH), then one Gemini
+                        seam-cleanup call on the draft instead of the raw captures
+             without it, the geometric stitcher at the requested output width, sampling the
+             captures at the STITCH_INTERPOLATION tier
+
+The captures outlive the request in OUTPUT_DIR/jobs/<panorama id>/ until the full stitch is
+done; the directory is recorded as a COLUMN entry in the retention index, so a job lost to a
+restart is expired like any other intermediate output.
+
+Environment variables:
+  STITCH_PREVIEW_WIDTH   – preview equirect width in pixels (default 1024)
+  STITCH_PREVIEW_QUALITY – preview JPEG quality (default 80)
+  STITCH_MODE            – default Gemini stitch mode: columns | hybrid (default columns)
+  STITCH_HYBRID_DRAFT_WIDTH – width of the draft sent to Gemini in hybrid mode (default 2048)
+  STITCH_INTERPOLATION   – capture sampling of the full / draft stitch: nearest | linear | cubic |
+                           lanczos (default cubic; the preview is always linear)
+"""
+from __future__ import annotations
+
+import os
+import shutil
+from pathlib import Path
+from typing import Any
+
+from metrics import stage
+
+STITCH_PREVIEW_WIDTH = int(os.environ.get("STITCH_PREVIEW_WIDTH", "1024"))
+STITCH_PREVIEW_QUALITY = int(os.environ.get("STITCH_PREVIEW_QUALITY", "80"))
+STITCH_HYBRID_DRAFT_WIDTH = int(os.environ.get("STITCH_HYBRID_DRAFT_WIDTH", "2048"))
+STITCH_INTERPOLATION = os.environ.get("STITCH_INTERPOLATION", "cubic").strip().lower()
+
+# Accepted /stitch output_width (stitch_equirectangular caps full 360° output at 8192)
+MIN_OUTPUT_WIDTH = 256
+MAX_OUTPUT_WIDTH = 8192
+
+# Gemini stitch modes
+COLUMNS = "columns"
+HYBRID = "hybrid"
+MODES = (COLUMNS, HYBRID)
+STITCH_MODE = os.environ.get("STITCH_MODE", COLUMNS).strip().lower()
+
+# Captures are decoded at 1/PREVIEW_INPUT_REDUCE size (JPEG DCT scaling); a 1440 px wide
+# capture at 1/4 still has more pixels per degree than a 1024 px equirect needs
+PREVIEW_INPUT_REDUCE = 4
+
+# Panorama.stitch_status
+PREVIEW = "preview"
+COMPLETE = "complete"
+FAILED = "failed"
+
+
+def parse_poses(poses: list[Any]) -> tuple[list[float], list[float], list[float]]:
+    """[{"pitch", "yaw", optional "roll"}, …] → (pitches, yaws, rolls). Raises ValueError."""
+    pitches, yaws, rolls = [], [], []
+    for i, pose in enumerate(poses):
+        try:
+            pitches.append(float(pose["pitch"]))
+            yaws.append(float(pose["yaw"]))
+            rolls.append(float(pose.get("roll", 0.0)))
+        except (TypeError, KeyError, ValueError):
+            raise ValueError(f"pose {i} needs numeric 'pitch' and 'yaw' (and optional 'roll')")
+    return pitches, yaws, rolls
+
+
+def job_dir(output_dir: Path, panorama_id: str) -> Path:
+    return Path(output_dir) / "jobs" / panorama_id
+
+
+def remove_job_dir(path: Path) -> None:
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def _encode_jpeg(img, quality: int) -> bytes:
+    import cv2
+
+    with stage("opencv.encode"):
+        ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise RuntimeError("JPEG encode failed")
+    return buf.tobytes()
+
+
+def stitch_preview(
+    paths: list[Path], pitches: list[float], yaws: list[float], rolls: list[float],
+    width: int = STITCH_PREVIEW_WIDTH,
+) -> bytes:
+    """Fast low-resolution local stitch → JPEG bytes."""
+    from stitch_equirect import stitch_equirectangular
+
+    with stage("stitch.preview"):
+        pano = stitch_equirectangular(
+            [str(p) for p in paths], pitches, yaws, rolls,
+            output_width=width,
+            force_full_360=True,
+            undistort_inputs=False,
+            yaw_auto_correct=False,
+            input_reduce=PREVIEW_INPUT_REDUCE,
+            interpolation="linear",
+        )
+    return _encode_jpeg(pano, STITCH_PREVIEW_QUALITY)
+
+
+def stitch_geometric(
+    paths: list[Path], pitches: list[float], yaws: list[float], rolls: list[float], width: int,
+    *, stage_name: str = "stitch.geometric", interpolation: str = STITCH_INTERPOLATION,
+    undistort: bool = True, quality: int = 95, **options: Any,
+) -> bytes:
+    """
+    Full-quality local stitch (input + output undistortion, yaw correction) → JPEG bytes.
+    options go to stitch_equirectangular (FOV, input calibration, blend mode, … as exposed by
+    stitch_batch); left unset, the result is what /stitch produces.
+    """
+    from stitch_equirect import stitch_equirectangular, undistort_panorama
+
+    with stage(stage_name):
+        pano = stitch_equirectangular(
+            [str(p) for p in paths], pitches, yaws, rolls, output_width=width, force_full_360=True,
+            interpolation=interpolation, **options,
+        )
+        if undistort:
+            pano = undistort_panorama(pano)
+    return _encode_jpeg(pano, quality)
+
+
+def stitch_draft(
+    paths: list[Path], pitches: list[float], yaws: list[float], rolls: list[float],
+    width: int = STITCH_HYBRID_DRAFT_WIDTH,
+) -> bytes:
+    """Pose-correct local draft for hybrid mode (the geometric stitch at draft width)."""
+    return stitch_geometric(paths, pitches, yaws, rolls, width, stage_name="stitch.draft")
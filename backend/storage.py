@@ -0,0 +1,26 @@
+"""Filesystem helpers for files written under PANORAMA_OUTPUT_DIR."""
+from __future__ import annotations
+
+import os
+import uuid
+from pathlib import Path
+
+# Block size for streaming files through memory (upload spooling, hashing)
+CHUNK_SIZE = 1024 * 1024
+
+
+def write_atomic(path: Path, data: bytes) -> Path:
+    """
+    Write data to a temp file next to path, then os.replace it into place, so readers
+    (FileResponse, variant/tile builders) never see a half-written JPEG.
+    """
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return path
@@ -0,0 +1,227 @@
+"""
+Cubemap tile pyramids for panorama viewers.
+
+Each stitched / staged equirect is converted into 6 cube faces (px, nx, py, ny, pz, nz —
+three.js CubeTexture order, Y up, same world axes as stitch_equirect.uv_to_direction) and
+every face into a DeepZoom-style pyramid of JPEG tiles:
+
+  <PANORAMA_OUTPUT_DIR>/tiles/<source stem>-<mtime>-<size>/
+      manifest.json
+      <level>/<face>/<x>_<y>.jpg
+
+Level max_level is the full face size; every level below halves it, down to level 0 which
+fits in a single tile. Viewers fetch manifest.json, then only the tiles in view at the
+level matching their zoom.
+
+The equirect → cube remap LUT depends only on (face size, source size), so it is built
+once per size and cached in fixed-point (CV_16SC2) form.
+
+Environment variables:
+  PANORAMA_TILE_SIZE – tile edge in pixels (default 512)
+"""
+from __future__ import annotations
+
+import json
+import math
+import os
+import shutil
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from metrics import stage
+from retention import TILES, FileIndex
+
+if TYPE_CHECKING:
+    import numpy as np
+
+TILE_SIZE = int(os.environ.get("PANORAMA_TILE_SIZE", "512"))
+TILE_QUALITY = 85
+MAX_FACE_SIZE = 2048
+
+FACES = ("px", "nx", "py", "ny", "pz", "nz")
+
+# Builds of the same pyramid are serialized on one of these, picked by pyramid name
+_LOCK_STRIPES = 64
+
+
+def _face_directions(face: str, n: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """World directions for each pixel of one cube face; a = right, b = down in face coords."""
+    import numpy as np
+
+    c = (np.arange(n, dtype=np.float32) + 0.5) / n * 2 - 1
+    a, b = np.meshgrid(c, c)
+    one = np.ones_like(a)
+    return {
+        "px": (one, -b, -a),
+        "nx": (-one, -b, a),
+        "py": (a, one, b),
+        "ny": (a, -one, -b),
+        "pz": (a, -b, one),
+        "nz": (-a, -b, -one),
+    }[face]
+
+
+@lru_cache(maxsize=2)
+def _cube_remap_lut(face_size: int, src_w: int, src_h: int) -> dict[str, tuple[np.ndarray, np.ndarray]]:
+    """Per-face fixed-point remap maps from equirect (src_w × src_h) to face_size² faces."""
+    import cv2  # OpenCV / numpy load on the first pyramid build, not at import
+    import numpy as np
+
+    lut = {}
+    for face in FACES:
+        x, y, z = _face_directions(face, face_size)
+        lon = np.arctan2(z, x)
+        lat = np.arctan2(y, np.sqrt(x * x + z * z))
+        # Inverse of uv_to_direction: u=0 → lon=-180, v=0 → lat=+90
+        map_x = ((lon / np.pi + 1.0) * 0.5 * src_w - 0.5).astype(np.float32)
+        map_y = np.clip((0.5 - lat / np.pi) * src_h - 0.5, 0, src_h - 1).astype(np.float32)
+        lut[face] = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+    return lut
+
+
+def face_size_for(src_w: int) -> int:
+    return min(MAX_FACE_SIZE, max(TILE_SIZE, src_w // 4))
+
+
+def level_count(face_size: int, tile_size: int = TILE_SIZE) -> int:
+    return max(0, math.ceil(math.log2(face_size / tile_size))) + 1
+
+
+class TilePyramids:
+    def __init__(self, root: Path, tile_size: int = TILE_SIZE, index: FileIndex | None = None):
+        self.dir = Path(root) / "tiles"
+        self.tile_size = tile_size
+        self.index = index
+        self._locks = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+
+    def pyramid_dir(self, src: Path) -> Path:
+        st = src.stat()
+        return self.dir / f"{src.stem}-{st.st_mtime_ns:x}-{st.st_size:x}"
+
+    @staticmethod
+    def version(pyramid: Path) -> str:
+        """The ?v= of a pyramid's tile URLs (its source mtime)."""
+        return pyramid.name.rsplit("-", 2)[-2]
+
+    def _lock_for(self, key: str) -> threading.Lock:
+        return self._locks[hash(key) % _LOCK_STRIPES]
+
+    def manifest(self, src: Path) -> dict | None:
+        """Manifest of src's pyramid, building the pyramid first if needed. None if src is unreadable."""
+        out = self.pyramid_dir(src)
+        manifest_path = out / "manifest.json"
+        if not manifest_path.is_file():
+            with self._lock_for(out.name):
+                if not manifest_path.is_file():
+                    if not self._build_into_place(src, out):
+                        return None
+        elif self.index is not None:
+            # Manifest and tile requests are the pyramid's hits (the GC evicts by last_access)
+            self.index.touch(out)
+        return json.loads(manifest_path.read_text())
+
+    def tile_path(self, src: Path, level: int, face: str, x: int, y: int) -> Path | None:
+        if self.manifest(src) is None:
+            return None
+        path = self.pyramid_dir(src) / str(level) / face / f"{x}_{y}.jpg"
+        return path if path.is_file() else None
+
+    def _build_into_place(self, src: Path, out: Path) -> bool:
+        """
+        Build in a temporary sibling and rename it to out once complete, so a failed or
+        interrupted build never leaves a half-written pyramid under the real name. The
+        temporary directory is indexed before the first tile is written: if the process dies
+        mid-build, the GC's cache trim removes it.
+        """
+        tmp = out.with_name(f".{out.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.mkdir(parents=True, exist_ok=True)
+        if self.index is not None:
+            self.index.record(tmp, TILES, size=0)
+        try:
+            tiles_bytes = self._build(src, tmp, version=self.version(out))
+            if tiles_bytes is None:
+                return False
+            if (out / "manifest.json").is_file():
+                return True  # another worker finished the same pyramid first
+            # Left by a build from before builds were atomic
+            shutil.rmtree(out, ignore_errors=True)
+            try:
+                os.replace(tmp, out)
+            except OSError:
+                if not (out / "manifest.json").is_file():
+                    raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+            if self.index is not None:
+                self.index.forget(tmp)
+        if self.index is not None:
+            self.index.record(out, TILES, size=tiles_bytes)
+        print(f"[Tiles] built pyramid for {src.name} → {out}")
+        return True
+
+    def _build(self, src: Path, out: Path, version: str) -> int | None:
+        """Write src's tiles and manifest under out; bytes of tiles written, None if src is unreadable."""
+        import cv2
+
+        with stage("opencv.decode"):
+            img = cv2.imread(str(src), cv2.IMREAD_COLOR)
+        if img is None:
+            return None
+        src_h, src_w = img.shape[:2]
+        face_size = face_size_for(src_w)
+        levels = level_count(face_size, self.tile_size)
+        lut = _cube_remap_lut(face_size, src_w, src_h)
+        params = [cv2.IMWRITE_JPEG_QUALITY, TILE_QUALITY]
+        tiles_bytes = 0
+
+        for face in FACES:
+            map1, map2 = lut[face]
+            with stage("opencv.remap"):
+                level_img = cv2.remap(img, map1, map2, cv2.INTER_LINEAR, borderMode=cv2.BORDER_WRAP)
+            for level in range(levels - 1, -1, -1):
+                if level < levels - 1:
+                    h, w = level_img.shape[:2]
+                    level_img = cv2.resize(
+                        level_img, (max(1, (w + 1) // 2), max(1, (h + 1) // 2)),
+                        interpolation=cv2.INTER_AREA,
+                    )
+                face_dir = out / str(level) / face
+                face_dir.mkdir(parents=True, exist_ok=True)
+                size = level_img.shape[0]
+                for ty in range(math.ceil(size / self.tile_size)):
+                    for tx in range(math.ceil(size / self.tile_size)):
+                        tile = level_img[
+                            ty * self.tile_size:(ty + 1) * self.tile_size,
+                            tx * self.tile_size:(tx + 1) * self.tile_size,
+                        ]
+                        with stage("opencv.encode"):
+                            ok, buf = cv2.imencode(".jpg", tile, params)
+                        if not ok:
+                            raise RuntimeError(f"JPEG encode of tile {level}/{face}/{tx}_{ty} failed")
+                        (face_dir / f"{tx}_{ty}.jpg").write_bytes(buf.tobytes())
+                        tiles_bytes += len(buf)
+
+        manifest = {
+            "type": "cubemap",
+            "faces": list(FACES),
+            "face_size": face_size,
+            "tile_size": self.tile_size,
+            "levels": [
+                {"level": lv, "size": math.ceil(face_size / 2 ** (levels - 1 - lv))}
+                for lv in range(levels)
+            ],
+            "format": "jpeg",
+            "version": version,
+        }
+        # Written last: its presence marks the pyramid complete
+        (out / "manifest.json").write_text(json.dumps(manifest))
+        return tiles_bytes
+
+    def warm(self, src: Path) -> None:
+        """Build the pyramid for a freshly written panorama (run as a background task)."""
+        try:
+            self.manifest(src)
+        except Exception as e:
+            print(f"[Tiles] build for {src.name} failed: {e}")
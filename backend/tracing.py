@@ -0,0 +1,296 @@
+"""
+Per-job traces: one trace per HTTP request, spans for every provider call, OpenCV step and
+DB write made on its behalf (metrics.stage opens a span), exported as OTLP/JSON.
+
+  with span("stitch.column", column=3):   # child of whatever span is current
+      ...
+  set_attributes(panorama_id=save_id)     # on the current span
+
+The current span lives in a contextvar, so it follows the request into run_in_threadpool /
+asyncio.to_thread workers and into the blocking provider calls made from the handlers.
+
+Sampling is decided per trace: a trace is kept when it was head-sampled (TRACE_SAMPLE_RATE,
+or the sampled flag of an incoming W3C `traceparent` header) or when it lasted at least
+TRACE_SLOW_MS from the root span's start to the last span's end, so slow jobs are always
+attributable, including background tasks that run after the response was sent. Spans are
+buffered in memory until the request and its background tasks finish; kept traces are
+written by one background thread, never by the request.
+Sampled responses carry a `traceparent` header with the trace id.
+
+Environment:
+  TRACE_FILE           – append OTLP/JSON (one ExportTraceServiceRequest per line) to this file
+  TRACE_OTLP_ENDPOINT  – also POST to an OTLP/HTTP collector, e.g. http://localhost:4318
+  TRACE_SAMPLE_RATE    – fraction of requests traced regardless of latency (default 0.1)
+  TRACE_SLOW_MS        – always keep traces at least this long, background tasks included (default 10000, 0 = off)
+Tracing is off (spans are no-ops) unless TRACE_FILE or TRACE_OTLP_ENDPOINT is set.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator
+
+from starlette.datastructures import MutableHeaders
+
+log = logging.getLogger("uvicorn.error")
+
+TRACE_FILE = os.environ.get("TRACE_FILE", "").strip()
+TRACE_OTLP_ENDPOINT = os.environ.get("TRACE_OTLP_ENDPOINT", "").strip().rstrip("/")
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0.1"))
+TRACE_SLOW_MS = float(os.environ.get("TRACE_SLOW_MS", "10000"))
+
+SERVICE_NAME = "panorama-backend"
+
+# OTLP enums
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+class _Trace:
+    __slots__ = ("trace_id", "sampled", "spans")
+
+    def __init__(self, trace_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans: list[Span] = []
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace: _Trace, name: str, parent_id: str | None, kind: int, attributes: dict):
+        self.trace = trace
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.error: str | None = None
+
+    def end(self) -> None:
+        self.end_ns = time.time_ns()
+        self.trace.spans.append(self)
+
+    def to_otlp(self) -> dict:
+        out = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": k, "value": _any_value(v)} for k, v in self.attributes.items()],
+            "status": {"code": STATUS_ERROR, "message": self.error} if self.error else {"code": STATUS_OK},
+        }
+        if self.parent_id:
+            out["parentSpanId"] = self.parent_id
+        return out
+
+
+def _any_value(v: Any) -> dict:
+    if isinstance(v, bool):
+        return {"boolValue": v}
+    if isinstance(v, int):
+        return {"intValue": str(v)}
+    if isinstance(v, float):
+        return {"doubleValue": v}
+    return {"stringValue": str(v)}
+
+
+_current: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+def enabled() -> bool:
+    return bool(TRACE_FILE or TRACE_OTLP_ENDPOINT)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span | None]:
+    """Child span of the current one (a new root trace if there is none); no-op when tracing is off."""
+    if not enabled():
+        yield None
+        return
+    parent = _current.get()
+    if parent is None:
+        trace, parent_id = _Trace(_new_trace_id(), random.random() < TRACE_SAMPLE_RATE), None
+    else:
+        trace, parent_id = parent.trace, parent.span_id
+    s = Span(trace, name, parent_id, KIND_INTERNAL, attributes)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        s.end()
+        if parent is None:
+            _finish(trace, s)
+
+
+def set_attributes(**attributes: Any) -> None:
+    s = _current.get()
+    if s is not None:
+        s.attributes.update(attributes)
+
+
+def current_trace_id() -> str | None:
+    s = _current.get()
+    return s.trace.trace_id if s is not None else None
+
+
+def _new_trace_id() -> str:
+    return f"{random.getrandbits(128):032x}"
+
+
+def _finish(trace: _Trace, root: Span) -> None:
+    # The root of a request ends with the response; its background tasks' spans end later
+    end_ns = max(s.end_ns for s in trace.spans)
+    slow = TRACE_SLOW_MS > 0 and (end_ns - root.start_ns) / 1e6 >= TRACE_SLOW_MS
+    if trace.sampled or slow:
+        _exporter().submit(trace.spans)
+
+
+# ── Export (background thread) ────────────────────────────────────────────────
+class _Exporter(threading.Thread):
+    def __init__(self):
+        super().__init__(name="trace-exporter", daemon=True)
+        self.queue: queue.Queue[list[Span] | None] = queue.Queue(maxsize=1024)
+
+    def submit(self, spans: list[Span]) -> None:
+        try:
+            self.queue.put_nowait(spans)
+        except queue.Full:
+            pass  # never block a request on the exporter; drop the trace
+
+    def run(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < 64:
+                try:
+                    batch.append(self.queue.get(timeout=0.5))
+                except queue.Empty:
+                    break
+            stop = None in batch
+            spans = [s for item in batch if item for s in item]
+            if spans:
+                self._write(spans)
+            if stop:
+                return
+
+    def _write(self, spans: list[Span]) -> None:
+        payload = json.dumps({"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "backend.tracing"}, "spans": [s.to_otlp() for s in spans]}],
+        }]}, separators=(",", ":"))
+        if TRACE_FILE:
+            try:
+                with open(TRACE_FILE, "a", encoding="utf-8") as fh:
+                    fh.write(payload + "\n")
+            except OSError as e:
+                log.warning("Trace export to %s failed: %s", TRACE_FILE, e)
+        if TRACE_OTLP_ENDPOINT:
+            req = urllib.request.Request(
+                f"{TRACE_OTLP_ENDPOINT}/v1/traces", data=payload.encode(),
+                headers={"Content-Type": "application/json"}, method="POST",
+            )
+            try:
+                urllib.request.urlopen(req, timeout=5).close()
+            except OSError as e:
+                log.warning("Trace export to %s failed: %s", TRACE_OTLP_ENDPOINT, e)
+
+
+_exporter_thread: _Exporter | None = None
+_exporter_lock = threading.Lock()
+
+
+def _exporter() -> _Exporter:
+    global _exporter_thread
+    with _exporter_lock:
+        if _exporter_thread is None:
+            _exporter_thread = _Exporter()
+            _exporter_thread.start()
+        return _exporter_thread
+
+
+def shutdown(timeout: float = 5.0) -> None:
+    """Flush queued traces (called from the app lifespan on shutdown)."""
+    global _exporter_thread
+    with _exporter_lock:
+        thread, _exporter_thread = _exporter_thread, None
+    if thread is not None:
+        thread.queue.put(None)
+        thread.join(timeout)
+
+
+# ── ASGI middleware: one root span per request ────────────────────────────────
+class TracingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not enabled():
+            await self.app(scope, receive, send)
+            return
+        trace = None
+        parent_id = None
+        for key, value in scope.get("headers", ()):
+            if key == b"traceparent":
+                m = _TRACEPARENT.match(value.decode("latin-1").strip().lower())
+                if m:
+                    trace = _Trace(m.group(1), bool(int(m.group(3), 16) & 1))
+                    parent_id = m.group(2)
+                break
+        if trace is None:
+            trace = _Trace(_new_trace_id(), random.random() < TRACE_SAMPLE_RATE)
+        root = Span(trace, f"{scope['method']} {scope['path']}", parent_id, KIND_SERVER, {
+            "http.method": scope["method"],
+            "http.target": scope["path"],
+        })
+        token = _current.set(root)
+        ended = False
+
+        async def send_traced(message):
+            nonlocal ended
+            if message["type"] == "http.response.start":
+                root.attributes["http.status_code"] = message["status"]
+                if message["status"] >= 500:
+                    root.error = f"HTTP {message['status']}"
+                if trace.sampled:
+                    MutableHeaders(scope=message).append("traceparent", f"00-{trace.trace_id}-{root.span_id}-01")
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body") and not ended:
+                # Response complete; background tasks that follow still add child spans
+                ended = True
+                root.end()
+
+        try:
+            await self.app(scope, receive, send_traced)
+        except BaseException as e:
+            root.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current.reset(token)
+            route = getattr(scope.get("route"), "path", None)
+            if route:
+                root.name = f"{scope['method']} {route}"
+                root.attributes["http.route"] = route
+            if not ended:
+                root.end()
+            _finish(trace, root)
@@ -0,0 +1,154 @@
+"""
+Chunked spooling of multipart uploads to a per-request scratch directory.
+
+UploadFile.read() copies the whole part onto the Python heap; with 24 phone JPEGs per
+/stitch that is tens of MB per in-flight request. ScratchDir.spool() copies each part to
+disk in fixed-size chunks, hashing (sha256) and enforcing size limits while streaming, so
+downstream stages read the file back — or memory-map it — only when they need it.
+
+Scratch directories live under <PANORAMA_OUTPUT_DIR>/tmp so spooled files can be moved
+into place with an atomic os.replace (same filesystem).
+
+Environment variables:
+  MAX_UPLOAD_BYTES          – per-file limit (default 40 MB)
+  MAX_REQUEST_UPLOAD_BYTES  – limit across all files of one request (default 400 MB)
+  MAX_BATCH_UPLOAD_BYTES    – same, for POST /panoramas/import:batch; also caps its request body (default 8 GB)
+"""
+from __future__ import annotations
+
+import hashlib
+import mmap
+import os
+import shutil
+import uuid
+from collections.abc import Iterator
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+from fastapi import HTTPException, Request, UploadFile
+from starlette.datastructures import FormData
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.formparsers import MultiPartException
+
+from storage import CHUNK_SIZE
+
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(40 * 1024 * 1024)))
+MAX_REQUEST_UPLOAD_BYTES = int(os.environ.get("MAX_REQUEST_UPLOAD_BYTES", str(400 * 1024 * 1024)))
+MAX_BATCH_UPLOAD_BYTES = int(os.environ.get("MAX_BATCH_UPLOAD_BYTES", str(8 * 1024 * 1024 * 1024)))
+
+
+@dataclass
+class SpooledFile:
+    path: Path
+    size: int
+    sha256: str
+
+    def read_bytes(self) -> bytes:
+        return self.path.read_bytes()
+
+    def map(self) -> mmap.mmap:
+        """Read-only memory map of the file (page cache backed, not a heap copy). Caller closes it."""
+        with open(self.path, "rb") as fh:
+            return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def move_to(self, dest: Path) -> Path:
+        """Atomically move the spooled file to dest (must be on the same filesystem)."""
+        os.replace(self.path, dest)
+        self.path = dest
+        return dest
+
+
+class ScratchDir:
+    """Per-request scratch directory; removed (with everything left in it) on close()."""
+
+    def __init__(self, root: Path, max_total_bytes: int = MAX_REQUEST_UPLOAD_BYTES):
+        self.path = Path(root) / "tmp" / uuid.uuid4().hex
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_total_bytes = max_total_bytes
+        self.total_bytes = 0
+
+    async def spool(
+        self,
+        upload: UploadFile,
+        name: str | None = None,
+        max_bytes: int = MAX_UPLOAD_BYTES,
+    ) -> SpooledFile:
+        """Copy one multipart part to disk in chunks. Raises HTTP 413 as soon as a limit is exceeded."""
+        dest = self.path / (name or f"{uuid.uuid4().hex}.bin")
+        digest = hashlib.sha256()
+        size = 0
+        with open(dest, "wb") as out:
+            while True:
+                chunk = await upload.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                self.total_bytes += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Upload {upload.filename or name!r} exceeds {max_bytes} bytes",
+                    )
+                if self.total_bytes > self.max_total_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Request uploads exceed {self.max_total_bytes} bytes in total",
+                    )
+                digest.update(chunk)
+                out.write(chunk)
+        return SpooledFile(path=dest, size=size, sha256=digest.hexdigest())
+
+    def close(self) -> None:
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self) -> ScratchDir:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class _BodyTooLarge(MultiPartException):
+    pass
+
+
+async def read_form(request: Request, max_total_bytes: int, **limits) -> FormData:
+    """
+    request.form(**limits) with the request body capped at max_total_bytes. Starlette spools
+    every file part to a temp file before the handler sees the form, so ScratchDir's limits
+    come too late to bound what the server receives: a Content-Length over the cap is refused
+    up front, a chunked body as soon as it streams past it. The caller closes the form.
+    """
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > max_total_bytes:
+        raise HTTPException(status_code=413, detail=f"Request body exceeds {max_total_bytes} bytes")
+    received = 0
+
+    async def receive():
+        nonlocal received
+        message = await request.receive()
+        received += len(message.get("body", b""))
+        if received > max_total_bytes:
+            # A MultiPartException makes Starlette close the parts spooled so far
+            raise _BodyTooLarge(f"Request body exceeds {max_total_bytes} bytes")
+        return message
+
+    try:
+        return await Request(request.scope, receive).form(**limits)
+    except StarletteHTTPException as e:  # what Starlette turns a MultiPartException into
+        if received > max_total_bytes:
+            raise HTTPException(status_code=413, detail=e.detail) from None
+        raise
+
+
+@contextmanager
+def mapped(files: list[SpooledFile]) -> Iterator[list[mmap.mmap]]:
+    """Memory-map several spooled files at once; all maps are closed on exit."""
+    with ExitStack() as stack:
+        maps = []
+        for f in files:
+            m = f.map()
+            stack.callback(m.close)
+            maps.append(m)
+        yield maps
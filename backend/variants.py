@@ -0,0 +1,136 @@
+"""
+Resized panorama variants (thumbnails / previews) cached on disk.
+
+GET /panoramas/{id}/image?w=…&q=…&fmt=jpeg|webp resolves here. Variants live under
+<PANORAMA_OUTPUT_DIR>/variants/, named after the source file identity (name + mtime + size)
+and the parameters, so a re-stitched source never serves a stale variant.
+
+The directory has its own byte budget, checked on every write: once over it, the least
+recently served variants are deleted. Recency is the retention index's last_access (the
+same LRU the GC's GC_CACHE_MAX_AGE_S / GC_CACHE_MAX_BYTES trim uses, see retention.py), so
+the budget holds between GC passes and with the GC off. Hits never touch the variant file
+(its mtime is part of the served ETag); they are recorded in the index instead, at most
+every few minutes per variant.
+
+Environment variables:
+  PANORAMA_VARIANT_CACHE_BYTES – disk budget for cached variants (default 512 MB)
+"""
+from __future__ import annotations
+
+import os
+import threading
+from pathlib import Path
+
+from metrics import stage
+from retention import VARIANT, FileIndex
+from storage import write_atomic
+
+VARIANT_CACHE_BYTES = int(os.environ.get("PANORAMA_VARIANT_CACHE_BYTES", str(512 * 1024 * 1024)))
+
+# Widths generated eagerly after /stitch and /stage (list cards, detail preview, viewer fallback)
+COMMON_WIDTHS = (256, 512, 1024)
+THUMBNAIL_WIDTH = 512
+DEFAULT_QUALITY = 80
+
+# OpenCV is imported on first resize, not at module load (see app.py cold-start notes)
+_FORMATS = {
+    "jpeg": (".jpg", "image/jpeg", "IMWRITE_JPEG_QUALITY"),
+    "webp": (".webp", "image/webp", "IMWRITE_WEBP_QUALITY"),
+}
+
+
+def media_type_for(fmt: str) -> str:
+    return _FORMATS[fmt][1]
+
+
+def _read_reduced(src: Path, width: int):
+    """Decode src at the smallest libjpeg scale (1/2, 1/4, 1/8) that is still >= width."""
+    import cv2
+
+    probe = cv2.imread(str(src), cv2.IMREAD_REDUCED_COLOR_8)
+    if probe is None:
+        return None
+    for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                         (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if probe.shape[1] * 8 // factor >= width:
+            return probe if factor == 8 else cv2.imread(str(src), flag)
+    return cv2.imread(str(src), cv2.IMREAD_COLOR)
+
+
+class VariantCache:
+    def __init__(self, root: Path, budget_bytes: int = VARIANT_CACHE_BYTES, index: FileIndex | None = None):
+        self.dir = Path(root) / "variants"
+        self.budget_bytes = budget_bytes
+        self.index = index  # the budget is enforced through it; without one, unbounded
+        self._lock = threading.Lock()
+        # Bytes of variants per the index; None until first needed. Other workers write too,
+        # so it is re-read from the index before evicting.
+        self._total: int | None = None
+
+    def _variants_bytes(self) -> int:
+        return self.index.query("SELECT COALESCE(SUM(size), 0) FROM files WHERE kind = ?", (VARIANT,))[0][0]
+
+    def _added(self, path: Path, size: int) -> None:
+        """Account for a new variant; evict least recently used ones while over budget."""
+        with self._lock:
+            if self._total is None:
+                self._total = self._variants_bytes()
+            else:
+                self._total += size
+            if self._total <= self.budget_bytes:
+                return
+            self._total = self._variants_bytes()
+            if self._total <= self.budget_bytes:
+                return
+            keep = path.relative_to(self.index.root).as_posix()
+            rows = self.index.query(
+                "SELECT path, size FROM files WHERE kind = ? ORDER BY last_access LIMIT ?", (VARIANT, 256),
+            )
+            for rel, old_size in rows:
+                if self._total <= self.budget_bytes:
+                    break
+                if rel == keep:
+                    continue
+                (self.index.root / rel).unlink(missing_ok=True)
+                self.index.forget(self.index.root / rel)
+                self._total -= old_size
+
+    def get(self, src: Path, width: int | None, quality: int = DEFAULT_QUALITY, fmt: str = "jpeg") -> Path | None:
+        """Path of the resized variant of src, building it on a miss. None if src cannot be decoded."""
+        ext, _, quality_flag = _FORMATS[fmt]
+        st = src.stat()
+        name = f"{src.stem}-{st.st_mtime_ns:x}-{st.st_size:x}-w{width or 0}-q{quality}{ext}"
+        path = self.dir / name
+        if path.is_file():
+            if self.index is not None:
+                self.index.touch(path)
+            return path
+
+        import cv2
+
+        with stage("opencv.decode"):
+            img = _read_reduced(src, width) if width else cv2.imread(str(src), cv2.IMREAD_COLOR)
+        if img is None:
+            return None
+        h, w = img.shape[:2]
+        if width and width < w:
+            with stage("opencv.resize"):
+                img = cv2.resize(img, (width, max(1, round(h * width / w))), interpolation=cv2.INTER_AREA)
+        with stage("opencv.encode"):
+            ok, buf = cv2.imencode(ext, img, [getattr(cv2, quality_flag), quality])
+        if not ok:
+            return None
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(path, buf.tobytes())
+        if self.index is not None:
+            self.index.record(path, VARIANT)
+            self._added(path, len(buf))
+        return path
+
+    def warm(self, src: Path) -> None:
+        """Generate the common JPEG widths for a freshly written panorama (run as a background task)."""
+        for width in COMMON_WIDTHS:
+            try:
+                self.get(src, width)
+            except Exception as e:
+                print(f"[Variants] warm {src.name} w={width} failed: {e}")
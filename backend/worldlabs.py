@@ -18,20 +18,24 @@ Output format:
   - JPEG (re-rendered panorama from WorldLabs)
   - Marble viewer URL  (https://marble.worldlabs.ai/world/{world_id})
 
-Environment variable:
-  WORLDLABS_API_KEY  – from https://platform.worldlabs.ai/api-keys
+Environment variables:
+  WORLDLABS_API_KEY          – from https://platform.worldlabs.ai/api-keys
+  WORLDLABS_API_BASE         – optional; API origin (e.g. loadtest/fake_providers.py)
+  WORLDLABS_POLL_INTERVAL_S  – optional; seconds between operation polls (default 8)
 """
+import mmap
 import os
 import time
 from dataclasses import dataclass
 from typing import Optional
 
-import cv2
-import numpy as np
 import requests
 
-_BASE = "https://api.worldlabs.ai"
-_POLL_INTERVAL_S = 8
+from metrics import count_http, stage
+from tracing import span
+
+_BASE = os.environ.get("WORLDLABS_API_BASE", "https://api.worldlabs.ai").rstrip("/")
+_POLL_INTERVAL_S = float(os.environ.get("WORLDLABS_POLL_INTERVAL_S", "8"))
 _POLL_TIMEOUT_S  = 540  # 9 min – well inside the app's 10-min window
 
 
@@ -58,19 +62,23 @@ _PANO_WIDTH_WORLDLABS = 2560
 _PANO_HEIGHT_WORLDLABS = 1280  # 2:1
 
 # ── Ensure full 360° equirectangular (2:1) for WorldLabs environment mode ─
-def ensure_equirect_2to1(image_bytes: bytes) -> bytes:
+def ensure_equirect_2to1(image_bytes: bytes | mmap.mmap) -> bytes:
     """
     Resize to exactly 2:1 and WorldLabs-recommended size (2560×1280) so the
     image is recognized as a full 360° panorama and used as the 3D environment,
     not as a picture on a wall.
     """
+    import cv2  # heavy; only /reconstruct needs it
+    import numpy as np
+
     arr = np.frombuffer(image_bytes, dtype=np.uint8)
-    img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
+    with stage("opencv.decode"):
+        img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
     if img is None:
-        return image_bytes
+        return bytes(image_bytes)
     h, w = img.shape[:2]
     if w <= 0 or h <= 0:
-        return image_bytes
+        return bytes(image_bytes)
     target_ratio = 2.0
     current_ratio = w / h
     if abs(current_ratio - target_ratio) > 0.01:
@@ -79,14 +87,17 @@ def ensure_equirect_2to1(image_bytes: bytes) -> bytes:
         else:
             new_h, new_w = h, int(round(h * target_ratio))
         new_w, new_h = max(new_w, 256), max(new_h, 128)
-        img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        with stage("opencv.resize"):
+            img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
     # Resize to recommended size so WorldLabs reliably treats as full 360° pano
-    img = cv2.resize(
-        img, (_PANO_WIDTH_WORLDLABS, _PANO_HEIGHT_WORLDLABS),
-        interpolation=cv2.INTER_LINEAR,
-    )
-    _, out = cv2.imencode(".jpg", img)
-    return out.tobytes() if out is not None else image_bytes
+    with stage("opencv.resize"):
+        img = cv2.resize(
+            img, (_PANO_WIDTH_WORLDLABS, _PANO_HEIGHT_WORLDLABS),
+            interpolation=cv2.INTER_LINEAR,
+        )
+    with stage("opencv.encode"):
+        _, out = cv2.imencode(".jpg", img)
+    return out.tobytes() if out is not None else bytes(image_bytes)
 
 
 # ── Step 1+2: upload panorama as a media asset ────────────────────────────────
@@ -94,12 +105,14 @@ def upload_panorama(image_bytes: bytes, api_key: str) -> str:
     """Upload panorama to WorldLabs; return media_asset_id."""
 
     # 1a. Prepare upload (get signed URL)
-    prep = requests.post(
-        f"{_BASE}/marble/v1/media-assets:prepare_upload",
-        headers=_headers(api_key),
-        json={"file_name": "panorama.jpg", "kind": "image", "extension": "jpg"},
-        timeout=30,
-    )
+    with stage("worldlabs.prepare_upload"):
+        prep = requests.post(
+            f"{_BASE}/marble/v1/media-assets:prepare_upload",
+            headers=_headers(api_key),
+            json={"file_name": "panorama.jpg", "kind": "image", "extension": "jpg"},
+            timeout=30,
+        )
+        count_http("worldlabs", prep)
     prep.raise_for_status()
     prep_data = prep.json()
     print(f"[WorldLabs] prepare_upload response keys={list(prep_data.keys())} body={prep_data}")
@@ -135,12 +148,14 @@ def upload_panorama(image_bytes: bytes, api_key: str) -> str:
     print(f"[WorldLabs] media_asset_id={media_asset_id} uploading {len(image_bytes)} bytes…")
 
     # 1b. PUT image bytes to signed GCS URL (no auth header needed here)
-    up = requests.put(
-        upload_url,
-        headers=upload_headers,
-        data=image_bytes,
-        timeout=120,
-    )
+    with stage("worldlabs.upload"):
+        up = requests.put(
+            upload_url,
+            headers=upload_headers,
+            data=image_bytes,
+            timeout=120,
+        )
+        count_http("worldlabs", up)
     up.raise_for_status()
     print(f"[WorldLabs] upload OK (HTTP {up.status_code})")
     return media_asset_id
@@ -180,12 +195,14 @@ def submit_world_generation(
         },
     }
 
-    resp = requests.post(
-        f"{_BASE}/marble/v1/worlds:generate",
-        headers=_headers(api_key),
-        json=payload,
-        timeout=30,
-    )
+    with stage("worldlabs.generate"):
+        resp = requests.post(
+            f"{_BASE}/marble/v1/worlds:generate",
+            headers=_headers(api_key),
+            json=payload,
+            timeout=30,
+        )
+        count_http("worldlabs", resp)
     resp.raise_for_status()
     body = resp.json()
     print(f"[WorldLabs] worlds:generate response keys={list(body.keys())} body={body}")
@@ -207,11 +224,13 @@ def poll_operation(operation_id: str, api_key: str) -> dict:
     """Poll until operation.done is True; return the world response dict."""
     deadline = time.time() + _POLL_TIMEOUT_S
     while time.time() < deadline:
-        resp = requests.get(
-            f"{_BASE}/marble/v1/operations/{operation_id}",
-            headers={"WLT-Api-Key": api_key},
-            timeout=30,
-        )
+        with stage("worldlabs.poll"):
+            resp = requests.get(
+                f"{_BASE}/marble/v1/operations/{operation_id}",
+                headers={"WLT-Api-Key": api_key},
+                timeout=30,
+            )
+            count_http("worldlabs", resp)
         resp.raise_for_status()
         op = resp.json()
 
@@ -282,7 +301,7 @@ def _parse_world(response: dict) -> WorldResult:
 
 # ── Top-level convenience function ───────────────────────────────────────────
 def reconstruct_world(
-    image_bytes: bytes,
+    image_bytes: bytes | mmap.mmap,
     display_name: str,
     text_prompt: str,
     api_key: str,
@@ -293,13 +312,16 @@ def reconstruct_world(
     Ensures 2:1 aspect ratio so WorldLabs uses the image as the full environment.
     Takes ~5 minutes with Marble 0.1-plus, ~30-45s with Marble 0.1-mini.
     """
-    image_bytes = ensure_equirect_2to1(image_bytes)
-    media_asset_id = upload_panorama(image_bytes, api_key)
-    operation_id   = submit_world_generation(
-        media_asset_id, display_name, text_prompt, api_key, model
-    )
-    world_dict = poll_operation(operation_id, api_key)
-    result     = _parse_world(world_dict)
+    with span("reconstruct_world", model=model) as s:
+        image_bytes = ensure_equirect_2to1(image_bytes)
+        media_asset_id = upload_panorama(image_bytes, api_key)
+        operation_id   = submit_world_generation(
+            media_asset_id, display_name, text_prompt, api_key, model
+        )
+        world_dict = poll_operation(operation_id, api_key)
+        result     = _parse_world(world_dict)
+        if s is not None:
+            s.attributes.update(operation_id=operation_id, world_id=result.world_id)
 
     print(
         f"[WorldLabs] reconstruction complete → world_id={result.world_id}"
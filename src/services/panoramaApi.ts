@@ -237,8 +237,113 @@ export async function uploadLocalPanoramaToServer(
   }
 }
 
+/** Panoramas per POST /panoramas/import:batch request */
+const IMPORT_BATCH_SIZE = 25;
+
+type BatchImportResponse = {
+  imported: number;
+  failed: number;
+  results: {panorama_id: string; ok: boolean; error?: string | null}[];
+};
+
+function failAll(
+  manifest: Record<string, unknown>[],
+  error: string,
+): {id: string; ok: boolean; error?: string}[] {
+  return manifest.map(m => ({id: String(m.panorama_id), ok: false, error}));
+}
+
+/**
+ * Upload several local panoramas in one multipart request to POST /panoramas/import:batch
+ * (server writes files concurrently and upserts all rows in one statement).
+ * Items whose stitched file is not local are reported as failures without being sent.
+ */
+export async function uploadLocalPanoramasBatch(
+  items: PanoramaItem[],
+): Promise<{id: string; ok: boolean; error?: string}[]> {
+  const out: {id: string; ok: boolean; error?: string}[] = [];
+  const manifest: Record<string, unknown>[] = [];
+  const parts: Parameters<typeof ReactNativeBlobUtil.fetch>[3] = [];
+
+  for (const [i, item] of items.entries()) {
+    if (item.id === STITCHING_PLACEHOLDER_ID) {
+      out.push({id: item.id, ok: false, error: 'skip placeholder'});
+      continue;
+    }
+    const stitchPath = fileUriToPath(item.imageUri);
+    if (!stitchPath || !(await ReactNativeBlobUtil.fs.exists(stitchPath))) {
+      out.push({id: item.id, ok: false, error: 'stitched image is not a local file'});
+      continue;
+    }
+    const entry: Record<string, unknown> = {
+      panorama_id: item.id,
+      title: item.title,
+      date_display: item.date,
+      image: `image_${i}`,
+    };
+    parts.push({
+      name: `image_${i}`,
+      filename: 'panorama.jpg',
+      type: 'image/jpeg',
+      data: ReactNativeBlobUtil.wrap(stitchPath),
+    });
+    const stagedPath = item.stagedImageUri
+      ? fileUriToPath(item.stagedImageUri)
+      : null;
+    if (stagedPath && (await ReactNativeBlobUtil.fs.exists(stagedPath))) {
+      entry.staged_image = `staged_${i}`;
+      parts.push({
+        name: `staged_${i}`,
+        filename: 'staged.jpg',
+        type: 'image/jpeg',
+        data: ReactNativeBlobUtil.wrap(stagedPath),
+      });
+    }
+    if (item.world3d) {
+      entry.world3d = item.world3d;
+    }
+    manifest.push(entry);
+  }
+
+  if (manifest.length === 0) {
+    return out;
+  }
+  parts.push({name: 'manifest_json', data: JSON.stringify(manifest)});
+
+  try {
+    const resp = await ReactNativeBlobUtil.config({
+      timeout: UPLOAD_TIMEOUT_MS,
+    }).fetch(
+      'POST',
+      getStitchApiUrl('/panoramas/import:batch'),
+      {'Content-Type': 'multipart/form-data'},
+      parts,
+    );
+    const status = resp.respInfo.status;
+    if (status < 200 || status >= 300) {
+      const body = await resp.text();
+      const error = `HTTP ${status}: ${String(body).slice(0, 200)}`;
+      return out.concat(failAll(manifest, error));
+    }
+    const body = (await resp.json()) as BatchImportResponse;
+    console.log(
+      `${LOG} batch import: ${body.imported} ok, ${body.failed} failed`,
+    );
+    return out.concat(
+      body.results.map(r => ({
+        id: r.panorama_id,
+        ok: r.ok,
+        error: r.error ?? undefined,
+      })),
+    );
+  } catch (e) {
+    const error = e instanceof Error ? e.message : String(e);
+    return out.concat(failAll(manifest, error));
+  }
+}
+
 /**
- * Upload every panorama from AsyncStorage, one after another (sequential).
+ * Upload every panorama from AsyncStorage in batches of IMPORT_BATCH_SIZE.
  */
 export async function pushAllLocalPanoramasToServer(): Promise<{
   uploaded: number;
@@ -247,18 +352,24 @@ export async function pushAllLocalPanoramasToServer(): Promise<{
 }> {
   const {loadPanoramas} = await import('./panoramaStorage');
   const list = await loadPanoramas();
+  const byId = new Map(list.map(p => [p.id, p]));
   let uploaded = 0;
   let failed = 0;
   const errors: string[] = [];
 
-  for (const item of list) {
-    const r = await uploadLocalPanoramaToServer(item);
-    if (r.ok) {
-      uploaded += 1;
-    } else {
-      failed += 1;
-      if (r.error && r.error !== 'skip placeholder') {
-        errors.push(`${item.title} (${item.id.slice(0, 8)}…): ${r.error}`);
+  for (let i = 0; i < list.length; i += IMPORT_BATCH_SIZE) {
+    const results = await uploadLocalPanoramasBatch(
+      list.slice(i, i + IMPORT_BATCH_SIZE),
+    );
+    for (const r of results) {
+      if (r.ok) {
+        uploaded += 1;
+      } else {
+        failed += 1;
+        if (r.error && r.error !== 'skip placeholder') {
+          const title = byId.get(r.id)?.title ?? r.id;
+          errors.push(`${title} (${r.id.slice(0, 8)}…): ${r.error}`);
+        }
       }
     }
   }